@@ -0,0 +1,156 @@
+"""
+Semantic answer cache for the Insurance Chatbot application
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+
+def hash_context(context: str) -> str:
+    """Hash the retrieved context an answer was generated from"""
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """Cache of LLM answers served for repeated or paraphrased questions.
+
+    Exact repeats are looked up by normalized query text before any retrieval
+    happens. Paraphrases are matched by cosine similarity of their query
+    embeddings, but only against answers generated from the same retrieved
+    context and the same provider/model. All entries are dropped when the
+    vector store version changes.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version = None
+        self._entries = OrderedDict()
+        # (context_hash, provider, model) -> {"keys": [...], "matrix": ndarray or None}
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def validate(self, index_version: int):
+        """Drop every entry if the vector store changed since they were cached"""
+        with self._lock:
+            if index_version != self.index_version:
+                self._entries.clear()
+                self._groups.clear()
+                self.index_version = index_version
+
+    def get_exact(self, query: str, provider: str, model: str) -> Optional[Dict[str, Any]]:
+        """Get a cached answer for the same normalized query, provider and model"""
+        with self._lock:
+            key = (normalize_text(query), provider, model)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return self._cached_result(entry)
+
+    def get_similar(self, query_embedding: List[float], context: str, provider: str,
+                    model: str) -> Optional[Dict[str, Any]]:
+        """Get a cached answer for a similar query that retrieved the same context"""
+        with self._lock:
+            group = self._groups.get((hash_context(context), provider, model))
+            if not group or not group["keys"]:
+                self.misses += 1
+                return None
+
+            if group["matrix"] is None:
+                group["matrix"] = np.stack([self._entries[key]["vector"] for key in group["keys"]])
+
+            similarities = group["matrix"] @ self._normalize(query_embedding)
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.similarity_threshold:
+                    break
+                key = group["keys"][position]
+                entry = self._entries[key]
+                if self._is_expired(entry):
+                    continue
+                self._entries.move_to_end(key)
+                self.similar_hits += 1
+                return self._cached_result(entry)
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, query_embedding: List[float], context: str, provider: str, model: str,
+            result: Dict[str, Any]):
+        """Cache a successful answer"""
+        with self._lock:
+            key = (normalize_text(query), provider, model)
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = {
+                "result": dict(result),
+                "vector": self._normalize(query_embedding),
+                "group": (hash_context(context), provider, model),
+                "created": time.time()
+            }
+            group = self._groups.setdefault(self._entries[key]["group"], {"keys": [], "matrix": None})
+            group["keys"].append(key)
+            group["matrix"] = None
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Remove all cached answers"""
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and cache size"""
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+    def _remove(self, key):
+        """Remove an entry and its row in the similarity group"""
+        entry = self._entries.pop(key)
+        group = self._groups.get(entry["group"])
+        if group is not None:
+            group["keys"].remove(key)
+            group["matrix"] = None
+            if not group["keys"]:
+                del self._groups[entry["group"]]
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created"] > self.ttl_seconds
+
+    def _cached_result(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        result = dict(entry["result"])
+        result["cached"] = True
+        return result
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
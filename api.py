@@ -1,15 +1,20 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Response, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Optional, Tuple
 import os
-import tempfile
+import json
+import asyncio
 from chatbot import InsuranceChatbot
+from chat_history import ChatHistory
+from ingestion_jobs import IngestionJobQueue
+from session_manager import ChatSessionManager, get_credentials_fingerprint, get_default_session_id
+from provider_clients import get_client_registry
+from provider_health import get_provider_health
 from dotenv import load_dotenv
-from utils import get_api_key_and_provider, validate_api_key, get_supported_providers
-
-# Load environment variables
-load_dotenv()
+from utils import get_api_key_and_provider, validate_api_key, get_configured_providers
 
 app = FastAPI(
     title="Insurance Chatbot API",
@@ -26,12 +31,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-chatbot_instance = None
+# Built on startup rather than at import: parser worker processes import this
+# module as their __main__ and must not set up a server of their own
+sessions: Optional[ChatSessionManager] = None
+ingestion_jobs: Optional[IngestionJobQueue] = None
+# Largest number of queries accepted by /chat/batch
+CHAT_BATCH_MAX_QUERIES = 1000
+
+@app.on_event("startup")
+def create_services():
+    """Load the environment and create the session manager and ingestion queue"""
+    global sessions, ingestion_jobs, CHAT_BATCH_MAX_QUERIES
+    load_dotenv()
+    
+    # Every session shares one loaded vector store; each has its own chat history and LLM handler
+    sessions = ChatSessionManager(
+        max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "10000")),
+        ttl_seconds=float(os.getenv("CHAT_SESSION_TTL_SECONDS", "1800")),
+        # Histories are appended to disk, trimmed in the background, and outlive their sessions
+        history_path="models/chat_history.sqlite3",
+        history_window=int(os.getenv("CHAT_HISTORY_WINDOW", "100")),
+        history_max_entries=int(os.getenv("CHAT_HISTORY_MAX_ENTRIES", "1000")),
+        history_retention_seconds=float(os.getenv("CHAT_HISTORY_RETENTION_SECONDS", "2592000")),
+        history_compact_interval=float(os.getenv("CHAT_HISTORY_COMPACT_INTERVAL_SECONDS", "300")),
+        # Providers with keys in the environment take over when a session's provider is failing
+        fallbacks=get_configured_providers() if os.getenv("LLM_FAILOVER", "true").lower() == "true" else [],
+        # The server's own OpenAI key embeds queries for every session, never a caller's
+        embedding_api_key=os.getenv("OPENAI_API_KEY") if validate_api_key(os.getenv("OPENAI_API_KEY"), "openai") else None
+    )
+    # Documents are parsed, embedded and indexed here instead of inside the request
+    ingestion_jobs = IngestionJobQueue(jobs=int(os.getenv("INGEST_JOBS", "0")) or None)
+    CHAT_BATCH_MAX_QUERIES = int(os.getenv("CHAT_BATCH_MAX_QUERIES", "1000"))
 
 class ChatRequest(BaseModel):
     query: str
     provider: str = "openai"
     api_key: str
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
@@ -39,19 +75,64 @@ class ChatResponse(BaseModel):
     model: str
     success: bool
     error: Optional[str] = None
+    session_id: Optional[str] = None
+
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    provider: str = "openai"
+    api_key: str
+    max_concurrency: Optional[int] = None
+    session_id: Optional[str] = None
+
+class BatchChatResult(BaseModel):
+    index: int
+    query: str
+    response: str
+    provider: str
+    model: str
+    success: bool
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatResult]
+    succeeded: int
+    failed: int
+    session_id: Optional[str] = None
 
 class InitializeRequest(BaseModel):
     provider: str = "openai"
     api_key: str
+    session_id: Optional[str] = None
 
 class InitializeResponse(BaseModel):
     success: bool
     message: str
+    session_id: Optional[str] = None
 
 class DocumentUploadResponse(BaseModel):
     success: bool
     message: str
     chunks_processed: Optional[int] = None
+    job_id: Optional[str] = None
+    status: Optional[str] = None
+
+class IngestionDocumentResult(BaseModel):
+    file: str
+    success: bool
+    message: str
+    chunks: int
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    status: str
+    files: List[str]
+    pages_processed: int
+    chunks_processed: int
+    documents: List[IngestionDocumentResult]
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 @app.get("/")
 async def root():
@@ -62,16 +143,58 @@ async def root():
         "status": "running"
     }
 
+@app.on_event("startup")
+async def warm_up():
+    """Load the vector store and open provider connections before the first request
+    
+    Uses the API keys configured in the environment; the default provider's
+    key loads the index. Set WARM_START=false to skip.
+    """
+    if os.getenv("WARM_START", "true").lower() != "true":
+        return
+    
+    configured = get_configured_providers()
+    if not configured:
+        return
+    
+    registry = get_client_registry()
+    
+    async def warm_provider(provider: str, api_key: str):
+        await run_in_threadpool(registry.warm, provider, api_key)
+        await registry.awarm(provider, api_key)
+    
+    provider, api_key = configured[0]
+    await asyncio.gather(
+        run_in_threadpool(sessions.initialize, api_key, provider),
+        *(warm_provider(provider, api_key) for provider, api_key in configured)
+    )
+
+@app.on_event("shutdown")
+async def close_provider_clients():
+    """Close the pooled provider connections"""
+    await get_client_registry().aclose()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "chatbot_initialized": chatbot_instance is not None}
+    return {
+        "status": "healthy",
+        "chatbot_initialized": sessions.is_initialized(),
+        "active_sessions": sessions.get_stats()["active"],
+        "provider_clients": get_client_registry().get_stats(),
+        # Circuit state and recent latencies of every provider used so far
+        "providers": get_provider_health().get_stats()
+    }
 
 @app.post("/initialize", response_model=InitializeResponse)
 async def initialize_chatbot(request: InitializeRequest = None):
-    """Initialize the chatbot with API key and provider"""
-    global chatbot_instance
+    """Start a chat session with an API key and provider
     
+    The vector store is loaded by the first call only; later calls start (or
+    restart) a session on the already loaded index. Without a session_id
+    the session is one of the caller's own, named after a hash of its
+    provider and key, and its id is returned.
+    """
     try:
         if request is None or not request.api_key:
             api_key, provider = get_api_key_and_provider(request.provider if request else None)
@@ -85,61 +208,165 @@ async def initialize_chatbot(request: InitializeRequest = None):
                 message=f"No valid API key found for provider '{provider}'. Please set the appropriate environment variable."
             )
         
-        chatbot_instance = InsuranceChatbot()
-        success, message = chatbot_instance.initialize(api_key, provider)
+        session_id = (request.session_id if request else None) or get_default_session_id(api_key, provider)
+        # Loading the FAISS index is blocking I/O, keep it off the event loop
+        success, message = await run_in_threadpool(sessions.initialize, api_key, provider)
+        if success:
+            sessions.create_session(session_id, api_key, provider)
         
         return InitializeResponse(
             success=success,
-            message=message
+            message=message,
+            session_id=session_id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error initializing chatbot: {str(e)}")
 
+async def get_session_chatbot(request: ChatRequest) -> Tuple[InsuranceChatbot, str]:
+    """Get the chatbot and session id for a chat request, auto-initializing the session if needed
+    
+    A session is only reused by callers with the provider and key it was
+    started with; other credentials restart it with their own. Without a
+    session_id the caller gets a session of its own (see /initialize).
+    """
+    try:
+        if not request.api_key:
+            api_key, provider = get_api_key_and_provider(request.provider)
+        else:
+            api_key = request.api_key
+            provider = request.provider
+        
+        session_id = request.session_id or get_default_session_id(api_key, provider)
+        chatbot = sessions.get_session(session_id, get_credentials_fingerprint(api_key, provider))
+        if chatbot:
+            return chatbot, session_id
+        
+        if not validate_api_key(api_key, provider):
+            raise HTTPException(status_code=400, detail=f"No valid API key found for provider '{provider}'. Please set the appropriate environment variable.")
+        
+        success, message = await run_in_threadpool(sessions.initialize, api_key, provider)
+        
+        if not success:
+            raise HTTPException(status_code=400, detail=f"Failed to initialize chatbot: {message}")
+        
+        return sessions.get_or_create_session(session_id, api_key, provider), session_id
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Chatbot not initialized and auto-initialization failed: {str(e)}")
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Send a message to the chatbot"""
-    global chatbot_instance
-    
-    if not chatbot_instance:
-        try:
-            if not request.api_key:
-                api_key, provider = get_api_key_and_provider(request.provider)
-            else:
-                api_key = request.api_key
-                provider = request.provider
-            
-            if not validate_api_key(api_key, provider):
-                raise HTTPException(status_code=400, detail=f"No valid API key found for provider '{provider}'. Please set the appropriate environment variable.")
-            
-            chatbot_instance = InsuranceChatbot()
-            success, message = chatbot_instance.initialize(api_key, provider)
-            
-            if not success:
-                raise HTTPException(status_code=400, detail=f"Failed to initialize chatbot: {message}")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Chatbot not initialized and auto-initialization failed: {str(e)}")
+    chatbot, session_id = await get_session_chatbot(request)
     
     try:
-        result = chatbot_instance.process_query(request.query)
+        result = await chatbot.aprocess_query(request.query)
         
         return ChatResponse(
             response=result.get("response", "No response generated"),
             provider=result.get("provider", "unknown"),
             model=result.get("model", "unknown"),
             success=not result.get("error", False),
-            error=result.get("error") if result.get("error") else None
+            error=result.get("error") if result.get("error") else None,
+            session_id=session_id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
-@app.post("/upload-document", response_model=DocumentUploadResponse)
-async def upload_document(file: UploadFile = File(...)):
-    """Upload and process an insurance policy document"""
-    global chatbot_instance
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Send a message to the chatbot and stream the response as Server-Sent Events
+    
+    Emits `token` events as the answer is generated, then a single `done`
+    event with the full response (or an `error` event).
+    """
+    chatbot, _ = await get_session_chatbot(request)
+    
+    async def event_stream():
+        async for event in chatbot.astream_query(request.query):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(request: BatchChatRequest):
+    """Answer a batch of queries
+    
+    Retrieval for the whole batch uses one embedding request and one vector
+    search, and LLM calls run with bounded concurrency. Results come back in
+    input order; a failed query is reported in its own result.
+    """
+    if len(request.queries) > CHAT_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries ({len(request.queries)}); the limit is {CHAT_BATCH_MAX_QUERIES} per batch"
+        )
     
-    if not chatbot_instance:
+    chatbot, session_id = await get_session_chatbot(request)
+    
+    try:
+        results = await chatbot.aprocess_queries(request.queries, max_concurrency=request.max_concurrency)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing chat batch: {str(e)}")
+    
+    items = []
+    for index, (query, result) in enumerate(zip(request.queries, results)):
+        error = result.get("error")
+        items.append(BatchChatResult(
+            index=index,
+            query=query,
+            response=result.get("response", "No response generated"),
+            provider=result.get("provider", "unknown"),
+            model=result.get("model", "unknown"),
+            success=not error,
+            # Errors are either a message or a flag with the message in the response
+            error=(error if isinstance(error, str) else result.get("response")) if error else None
+        ))
+    
+    failed = sum(1 for item in items if not item.success)
+    return BatchChatResponse(
+        results=items,
+        succeeded=len(items) - failed,
+        failed=failed,
+        session_id=session_id
+    )
+
+async def queue_document(file_path: str, wait: bool, response: Response) -> DocumentUploadResponse:
+    """Queue a document for background loading, optionally waiting for the result"""
+    job_id = ingestion_jobs.submit(sessions.indexer, [file_path])
+    
+    if not wait:
+        return DocumentUploadResponse(
+            success=True,
+            message=f"Document queued for processing - poll /jobs/{job_id} for progress",
+            job_id=job_id,
+            status="queued"
+        )
+    
+    job = await run_in_threadpool(ingestion_jobs.wait, job_id)
+    response.status_code = 200
+    document = job["documents"][0] if job["documents"] else None
+    return DocumentUploadResponse(
+        success=job["status"] == "completed",
+        message=document["message"] if document else job["error"] or "Document was not processed",
+        chunks_processed=job["chunks_processed"],
+        job_id=job_id,
+        status=job["status"]
+    )
+
+@app.post("/upload-document", response_model=DocumentUploadResponse, status_code=202)
+async def upload_document(response: Response, file: UploadFile = File(...), wait: bool = False):
+    """Upload an insurance policy document and queue it for processing
+    
+    Returns a job id to poll at /jobs/{job_id}. With wait=true the request
+    blocks until the document is indexed and returns the chunk count.
+    """
+    if not sessions.is_initialized():
         raise HTTPException(status_code=400, detail="Chatbot not initialized. Please call /initialize first.")
     
     if not file.filename.lower().endswith('.pdf'):
@@ -154,13 +381,7 @@ async def upload_document(file: UploadFile = File(...)):
             content = await file.read()
             f.write(content)
 
-        success, message = chatbot_instance.load_policy_document(file_path)
-        
-        return DocumentUploadResponse(
-            success=success,
-            message=message,
-            chunks_processed=None
-        )
+        return await queue_document(file_path, wait, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
@@ -182,12 +403,10 @@ async def get_policy_documents():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing policy documents: {str(e)}")
 
-@app.post("/load-policy-document/{filename}")
-async def load_policy_document(filename: str):
-    """Load a specific policy document from policy_docs folder"""
-    global chatbot_instance
-    
-    if not chatbot_instance:
+@app.post("/load-policy-document/{filename}", response_model=DocumentUploadResponse, status_code=202)
+async def load_policy_document(filename: str, response: Response, wait: bool = False):
+    """Queue a specific policy document from policy_docs folder for loading"""
+    if not sessions.is_initialized():
         raise HTTPException(status_code=400, detail="Chatbot not initialized. Please call /initialize first.")
     
     policy_docs_dir = "policy_docs"
@@ -197,38 +416,113 @@ async def load_policy_document(filename: str):
         raise HTTPException(status_code=404, detail=f"Policy document '{filename}' not found")
     
     try:
-        success, message = chatbot_instance.load_policy_document(file_path)
-        return DocumentUploadResponse(
-            success=success,
-            message=message,
-            chunks_processed=None
-        )
+        return await queue_document(file_path, wait, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading policy document: {str(e)}")
 
-@app.get("/chat-history")
-async def get_chat_history():
-    """Get chat history"""
-    global chatbot_instance
+@app.get("/jobs", response_model=List[IngestionJobResponse])
+async def list_jobs():
+    """List document ingestion jobs"""
+    return ingestion_jobs.list_jobs()
+
+@app.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_job(job_id: str):
+    """Get the status and progress of a document ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    
+    return job
+
+@app.delete("/policy-documents/{filename}")
+async def delete_policy_document(filename: str):
+    """Remove a policy document's chunks from the vector store"""
+    if not sessions.is_initialized():
+        raise HTTPException(status_code=400, detail="Chatbot not initialized. Please call /initialize first.")
+    
+    policy_docs_dir = "policy_docs"
+    file_path = os.path.join(policy_docs_dir, filename)
+    
+    try:
+        success, message = await run_in_threadpool(sessions.indexer.delete_policy_document, file_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting policy document: {str(e)}")
+    
+    if not success:
+        raise HTTPException(status_code=404 if "not indexed" in message else 500, detail=message)
+    
+    return {"success": success, "message": message}
+
+@app.post("/vectorstore/compact")
+async def compact_vectorstore():
+    """Reclaim index space used by deleted or replaced document chunks"""
+    if not sessions.is_initialized():
+        raise HTTPException(status_code=400, detail="Chatbot not initialized. Please call /initialize first.")
+    
+    success, message = await run_in_threadpool(sessions.indexer.compact_vectorstore)
+    if not success:
+        raise HTTPException(status_code=500, detail=message)
     
-    if not chatbot_instance:
+    return {"success": success, "message": message}
+
+def get_session_history(session_id: str) -> ChatHistory:
+    """Get a session's chat history for the chat history endpoints"""
+    if not sessions.is_initialized():
         raise HTTPException(status_code=400, detail="Chatbot not initialized")
     
+    history = sessions.get_history(session_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired")
+    
+    return history
+
+@app.get("/chat-history")
+async def get_chat_history(session_id: str, cursor: Optional[int] = None,
+                           limit: int = Query(50, ge=1, le=500)):
+    """Get a page of a session's chat history
+    
+    Returns the latest `limit` messages, oldest first. Pass `next_cursor`
+    back as `cursor` for the page before them; it is null on the first page
+    of the conversation.
+    """
+    history = get_session_history(session_id)
+    page = await run_in_threadpool(history.get_page, cursor, limit)
+    
     return {
-        "chat_history": chatbot_instance.get_chat_history(),
-        "total_messages": len(chatbot_instance.get_chat_history())
+        "chat_history": page["entries"],
+        "total_messages": page["total"],
+        "next_cursor": page["next_cursor"],
+        "session_id": session_id
     }
 
 @app.delete("/chat-history")
-async def clear_chat_history():
-    """Clear chat history"""
-    global chatbot_instance
+async def clear_chat_history(session_id: str):
+    """Clear a session's chat history"""
+    history = get_session_history(session_id)
     
-    if not chatbot_instance:
+    await run_in_threadpool(history.clear)
+    return {"message": "Chat history cleared successfully"}
+
+@app.get("/sessions")
+async def get_session_stats():
+    """Get active session counts and eviction statistics"""
+    return sessions.get_stats()
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """End a chat session, discarding its history (including the copy on disk)"""
+    if not await run_in_threadpool(sessions.end_session, session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired")
+    
+    return {"message": f"Session '{session_id}' ended"}
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Get cache hit/miss statistics"""
+    if not sessions.is_initialized():
         raise HTTPException(status_code=400, detail="Chatbot not initialized")
     
-    chatbot_instance.clear_chat_history()
-    return {"message": "Chat history cleared successfully"}
+    return sessions.indexer.get_cache_stats()
 
 @app.get("/providers")
 async def get_available_providers():
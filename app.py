@@ -2,7 +2,10 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 from chatbot import InsuranceChatbot
-from utils import get_api_key_and_provider, validate_api_key, get_supported_providers
+from rag_system import VECTORSTORE_DIR
+from index_store import has_vectorstore
+from provider_health import create_provider_router, is_routing_enabled
+from utils import get_api_key_and_provider, validate_api_key, get_configured_providers
 
 load_dotenv()
 
@@ -66,119 +69,54 @@ def initialize_session_state():
         st.session_state.selected_provider = None
     if 'provider_changed' not in st.session_state:
         st.session_state.provider_changed = False
-    if 'failed_providers' not in st.session_state:
-        st.session_state.failed_providers = []
-    if 'last_failover_time' not in st.session_state:
-        st.session_state.last_failover_time = None
 
 def get_available_providers():
-    """Get list of providers that have valid API keys and haven't failed recently"""
-    available_providers = []
-    providers = get_supported_providers()
-    
-    for provider in providers:
-        api_key, _ = get_api_key_and_provider(provider)
-        if validate_api_key(api_key, provider) and provider not in st.session_state.failed_providers:
-            available_providers.append(provider)
-    
-    return available_providers
-
-def is_provider_failure(error_message):
-    """Check if an error indicates a provider failure that should trigger failover"""
-    failure_indicators = [
-        "quota exceeded",
-        "rate limit",
-        "billing",
-        "insufficient credits",
-        "api key invalid",
-        "incorrect api key",
-        "invalid api key",
-        "unauthorized",
-        "forbidden",
-        "service unavailable",
-        "timeout",
-        "connection error",
-        "api error",
-        "provider error",
-        "your_goo",
-        "your_openai",
-        "your_anthropic"
-    ]
-    
-    error_lower = error_message.lower()
-    return any(indicator in error_lower for indicator in failure_indicators)
+    """Get list of providers that have valid API keys, default provider first (best performing first with LLM_ROUTING)"""
+    providers = [provider for provider, _ in get_configured_providers()]
+    if not is_routing_enabled():
+        return providers
+    return create_provider_router().rank(providers, st.session_state.get('selected_provider'))
 
-def try_failover():
-    """Try to switch to another available provider"""
-    available_providers = get_available_providers()
-    
-    if not available_providers:
-        return False, "No other providers available"
-    
-    for provider in available_providers:
-        if provider != st.session_state.selected_provider:
-            success, message = initialize_chatbot_with_provider(provider)
-            if success:
-                st.session_state.failed_providers.append(st.session_state.selected_provider)
-                import time
-                st.session_state.last_failover_time = time.time()
-                return True, f"Switched to {provider.upper()}"
+def process_query(query):
+    """Process a query (the chatbot fails over between providers by itself)"""
+    if not st.session_state.initialized or not st.session_state.chatbot:
+        return {"error": True, "response": "Chatbot not initialized"}
     
-    return False, "All providers failed"
+    try:
+        return st.session_state.chatbot.process_query(query)
+    except Exception as e:
+        return {"error": True, "response": f"Unexpected error: {str(e)}"}
 
-def reset_failed_providers():
-    """Reset the list of failed providers to allow retrying them"""
-    st.session_state.failed_providers = []
-    st.session_state.last_failover_time = None
-    st.success("🔄 Failed providers reset - all providers available again")
+def render_bot_message(placeholder, text):
+    """Render a VIA message into a placeholder"""
+    placeholder.markdown(f"""
+    <div class="chat-message bot-message">
+        <strong>🤖 VIA:</strong><br>
+        {text}
+    </div>
+    """, unsafe_allow_html=True)
 
-def check_provider_recovery():
-    """Check if failed providers should be recovered (after 5 minutes)"""
-    if st.session_state.last_failover_time:
-        import time
-        current_time = time.time()
-        # Recover failed providers after 1 minute
-        if current_time - st.session_state.last_failover_time > 60:
-            st.session_state.failed_providers = []
-            st.session_state.last_failover_time = None
+def render_streamed_response(query, placeholder):
+    """Render response tokens into the placeholder as they arrive and return the final event"""
+    response_text = ""
+    with st.spinner("Thinking..."):
+        for event in st.session_state.chatbot.stream_query(query):
+            if event["type"] == "token":
+                response_text += event["content"]
+                render_bot_message(placeholder, response_text + "▌")
+            else:
+                if event["type"] == "done":
+                    render_bot_message(placeholder, event["response"])
+                return event
+    
+    return {"error": True, "response": "No response generated"}
 
-def process_query_with_failover(query):
-    """Process query with automatic failover on provider failure (transparent to user)"""
+def stream_query(query, placeholder):
+    """Stream a query (the chatbot fails over between providers until the first token)"""
     if not st.session_state.initialized or not st.session_state.chatbot:
         return {"error": True, "response": "Chatbot not initialized"}
     
-    try:
-        result = st.session_state.chatbot.process_query(query)
-        
-        if result.get("error") and is_provider_failure(result.get("response", "")):
-            # Silently try to failover to another provider
-            success, message = try_failover()
-            
-            if success:
-                # Retry the query with the new provider
-                result = st.session_state.chatbot.process_query(query)
-            else:
-                result["response"] = f"Service temporarily unavailable. Please try again later."
-        
-        return result
-        
-    except Exception as e:
-        error_msg = str(e)
-        if is_provider_failure(error_msg):
-            # Silently try to failover to another provider
-            success, message = try_failover()
-            
-            if success:
-                # Retry the query with the new provider
-                try:
-                    result = st.session_state.chatbot.process_query(query)
-                    return result
-                except Exception as retry_error:
-                    return {"error": True, "response": "Service temporarily unavailable. Please try again later."}
-            else:
-                return {"error": True, "response": "Service temporarily unavailable. Please try again later."}
-        else:
-            return {"error": True, "response": f"Unexpected error: {error_msg}"}
+    return render_streamed_response(query, placeholder)
 
 def initialize_chatbot_with_provider(provider):
     """Initialize chatbot with specific provider"""
@@ -189,9 +127,12 @@ def initialize_chatbot_with_provider(provider):
     
     try:
         chatbot = InsuranceChatbot()
-        success, message = chatbot.initialize(api_key, provider)
+        # The other configured providers take over while this one is failing
+        success, message = chatbot.initialize(api_key, provider, get_configured_providers())
         
         if success:
+            if chatbot.vectorstore_warning:
+                st.warning(chatbot.vectorstore_warning)
             st.session_state.chatbot = chatbot
             st.session_state.initialized = True
             st.session_state.selected_provider = provider
@@ -226,28 +167,16 @@ def auto_initialize_chatbot():
         st.session_state.auto_initialized = True
         auto_load_documents()
     else:
-        # Check if initialization failed due to provider error and try failover
-        if is_provider_failure(message):
-            st.warning("Provider failed during initialization, trying failover...")
-            success, failover_msg = try_failover()
-            if success:
-                st.session_state.auto_initialized = True
-                auto_load_documents()
-            else:
-                st.error(f"All providers failed: {failover_msg}")
-                st.session_state.auto_initialized = True
-        else:
-            st.error(f"Initialization failed: {message}")
-            st.session_state.auto_initialized = True
+        st.error(f"Initialization failed: {message}")
+        st.session_state.auto_initialized = True
 
 def auto_load_documents():
-    """Automatically load all PDF documents from policy_docs folder with failover"""
+    """Automatically load all PDF documents from policy_docs folder"""
     if not st.session_state.initialized:
         return
     
     # Check if vector store already exists
-    vectorstore_path = "models/faiss_index"
-    if os.path.exists(vectorstore_path) and os.path.exists(f"{vectorstore_path}/index.faiss"):
+    if has_vectorstore(VECTORSTORE_DIR):
         # Vector store exists, mark all PDF files as loaded
         policy_docs_dir = "policy_docs"
         if os.path.exists(policy_docs_dir):
@@ -271,42 +200,12 @@ def auto_load_documents():
                     if success:
                         st.session_state.loaded_docs = st.session_state.get('loaded_docs', []) + [pdf_file]
                     else:
-                        # Check if this is a provider failure and try failover
-                        if is_provider_failure(message):
-                            success, failover_msg = try_failover()
-                            if success:
-                                # Retry with new provider
-                                success, message = st.session_state.chatbot.load_policy_document(file_path)
-                                if success:
-                                    st.session_state.loaded_docs = st.session_state.get('loaded_docs', []) + [pdf_file]
-                                else:
-                                    st.warning(f"Could not load {pdf_file} even after failover: {message}")
-                            else:
-                                st.warning(f"Could not load {pdf_file}: {message}")
-                        else:
-                            st.warning(f"Could not load {pdf_file}: {message}")
+                        st.warning(f"Could not load {pdf_file}: {message}")
                 except Exception as e:
-                    # Check if this is a provider failure and try failover
-                    if is_provider_failure(str(e)):
-                        success, failover_msg = try_failover()
-                        if success:
-                            try:
-                                success, message = st.session_state.chatbot.load_policy_document(file_path)
-                                if success:
-                                    st.session_state.loaded_docs = st.session_state.get('loaded_docs', []) + [pdf_file]
-                                    # Don't show success messages in sidebar - silent loading
-                                else:
-                                    st.warning(f"Could not load {pdf_file} even after failover: {message}")
-                            except Exception as retry_error:
-                                st.error(f"Error loading {pdf_file} even after failover: {str(retry_error)}")
-                        else:
-                            st.error(f"Error loading {pdf_file}: {str(e)}")
-                    else:
-                        st.error(f"Error loading {pdf_file}: {str(e)}")
+                    st.error(f"Error loading {pdf_file}: {str(e)}")
 
 def main():
     initialize_session_state()
-    check_provider_recovery()
     
     st.markdown('<h1 class="main-header"> VIA - Virtual Insurance Assistant</h1>', unsafe_allow_html=True)
     
@@ -415,18 +314,19 @@ def main():
         submitted = st.form_submit_button("Send", type="primary")
         
         if submitted and user_input:
-            with st.spinner("Thinking..."):
-                result = process_query_with_failover(user_input)
-                
-                if result.get("error"):
-                    st.error(f"❌ {result['response']}")
-                else:
-                    # Save the chat to history
-                    st.session_state.chat_history.append({
-                        "user": user_input,
-                        "response": result['response']
-                    })
-                    st.rerun()
+            response_placeholder = st.empty()
+            result = stream_query(user_input, response_placeholder)
+            
+            if result.get("error"):
+                response_placeholder.empty()
+                st.error(f"❌ {result['response']}")
+            else:
+                # Save the chat to history
+                st.session_state.chat_history.append({
+                    "user": user_input,
+                    "response": result['response']
+                })
+                st.rerun()
     
     # handle Enter key press for prompt submission
     st.markdown("""
@@ -459,7 +359,7 @@ def main():
         with cols[i % 2]:
             if st.button(f"❓ {question}", key=f"sample_{i}"):
                 with st.spinner("Thinking..."):
-                    result = process_query_with_failover(question)
+                    result = process_query(question)
                     if not result.get("error"):
                         st.rerun()
 
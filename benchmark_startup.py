@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Script to measure cold-start time: module import times and the API's time to first request
+Every measurement runs in a fresh Python process. Fails when a module imports a provider SDK
+or Streamlit at load time, or when a number goes over its budget, so regressions are caught
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Kept in sync with rag_system.VECTORSTORE_DIR, which isn't imported so this process stays cold-start neutral
+VECTORSTORE_DIR = os.path.join("models", "faiss_index")
+
+# Modules whose import time is tracked
+MODULES = ("llm_handlers", "rag_system", "chatbot", "api", "create_vectorstore")
+
+# Loaded on first use only - importing any of these at module load is a regression
+LAZY_MODULES = ("streamlit", "openai", "anthropic", "google.generativeai", "langchain_openai")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {project_dir!r})
+import api
+from fastapi.testclient import TestClient
+imported = time.perf_counter()
+with TestClient(api.app) as client:
+    started = time.perf_counter()
+    client.get("/health").raise_for_status()
+    first_request = time.perf_counter()
+    response = client.post("/initialize", json={{"provider": {provider!r}, "api_key": "benchmark-key"}})
+    initialized = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "startup": started - imported,
+    "first_request": first_request - start,
+    "initialize": initialized - first_request,
+    "initialized": response.json().get("success", False)
+}}))
+"""
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Measure import times and API time to first request")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per measurement (default: 3)")
+    parser.add_argument("--modules", default=",".join(MODULES),
+                        help=f"Comma-separated modules to import (default: {','.join(MODULES)})")
+    parser.add_argument("--directory", default=os.path.join(PROJECT_DIR, VECTORSTORE_DIR),
+                        help=f"Vector store loaded by /initialize (default: {VECTORSTORE_DIR})")
+    parser.add_argument("--provider", default="openai", help="Provider passed to /initialize (default: openai)")
+    parser.add_argument("--import-budget", type=float, default=None,
+                        help="Fail if any module's median import time is over this many seconds")
+    parser.add_argument("--first-request-budget", type=float, default=None,
+                        help="Fail if the median time from process start to the first response is over this many seconds")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    return parser.parse_args()
+
+def run_snippet(snippet, env=None, cwd=PROJECT_DIR):
+    """Run Python code in a fresh process and parse the JSON it prints"""
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "process failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure_import(module, runs):
+    """Median import time of a module, and the lazily loaded modules it pulled in"""
+    samples = [run_snippet(IMPORT_SNIPPET.format(module=module, lazy=LAZY_MODULES)) for _ in range(runs)]
+    return {
+        "module": module,
+        "seconds": statistics.median(sample["seconds"] for sample in samples),
+        "loaded": samples[0]["loaded"]
+    }
+
+def measure_first_request(provider, runs, directory):
+    """Median API cold-start timings, without warm-up network calls
+    
+    Each run works on a fresh copy of the vector store, so loading it
+    (and any migration) never touches the real one.
+    """
+    env = dict(os.environ, WARM_START="false")
+    snippet = FIRST_REQUEST_SNIPPET.format(provider=provider, project_dir=PROJECT_DIR)
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as work_dir:
+            if os.path.isdir(directory):
+                shutil.copytree(directory, os.path.join(work_dir, VECTORSTORE_DIR))
+            samples.append(run_snippet(snippet, env, cwd=work_dir))
+    result = {key: statistics.median(sample[key] for sample in samples)
+              for key in ("import", "startup", "first_request", "initialize")}
+    result["initialized"] = all(sample["initialized"] for sample in samples)
+    return result
+
+def main(args=None):
+    """Main function to benchmark cold starts"""
+    if args is None:
+        args = parse_args()
+
+    modules = [module.strip() for module in args.modules.split(",") if module.strip()]
+    try:
+        imports = [measure_import(module, args.runs) for module in modules]
+        first_request = measure_first_request(args.provider, args.runs, args.directory)
+    except Exception as e:
+        print(f"❌ Error running benchmark: {str(e)}")
+        return False
+
+    failures = []
+    for result in imports:
+        if result["loaded"]:
+            failures.append(f"{result['module']} imports {', '.join(result['loaded'])} at load time")
+        if args.import_budget is not None and result["seconds"] > args.import_budget:
+            failures.append(f"{result['module']} imports in {result['seconds']:.2f}s "
+                            f"(budget {args.import_budget:.2f}s)")
+    if args.first_request_budget is not None and first_request["first_request"] > args.first_request_budget:
+        failures.append(f"first request after {first_request['first_request']:.2f}s "
+                        f"(budget {args.first_request_budget:.2f}s)")
+
+    if args.json:
+        print(json.dumps({"imports": imports, "first_request": first_request, "failures": failures}, indent=2))
+    else:
+        print(f"🚀 Cold-start timings, median of {args.runs} fresh processes")
+        print(f"{'module':<20} {'import s':>9}  lazily loaded modules imported")
+        for result in imports:
+            print(f"{result['module']:<20} {result['seconds']:>9.3f}  {', '.join(result['loaded']) or '-'}")
+        print(f"\nAPI: import {first_request['import']:.3f}s, startup {first_request['startup']:.3f}s, "
+              f"first request {first_request['first_request']:.3f}s after process start, "
+              f"/initialize {first_request['initialize']:.3f}s"
+              + ("" if first_request["initialized"] else " (failed)"))
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Within budget")
+
+    return not failures
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Script to compare vector encodings (float32 / float16 / SQ8 / PQ) on an existing vector store
+Each encoding is built in memory from the stored vectors and reports its memory footprint,
+recall@k against exact search (with and without exact re-ranking) and query latency;
+the saved vector store is not changed
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+from dotenv import load_dotenv
+from rag_system import InsuranceRAGSystem, VECTORSTORE_DIR
+from index_store import IndexStore, has_vectorstore
+from vector_index import (AUTO, ENCODINGS, INDEX_TYPES, build_index, configure_search, get_memory_usage,
+                          rerank, select_encoding, select_index_type)
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Compare memory and recall of vector store encodings")
+    parser.add_argument("--directory", default=VECTORSTORE_DIR,
+                        help=f"Vector store directory (default: {VECTORSTORE_DIR})")
+    parser.add_argument("--index-type", default=None, choices=INDEX_TYPES + (AUTO,),
+                        help="Index type to build (default: VECTORSTORE_INDEX_TYPE)")
+    parser.add_argument("--encodings", default=",".join(ENCODINGS),
+                        help=f"Comma-separated encodings to compare (default: {','.join(ENCODINGS)})")
+    parser.add_argument("-k", type=int, default=5, help="Results per query (default: 5)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sample queries (default: 200)")
+    parser.add_argument("--rerank-factor", type=int, default=None,
+                        help="Candidates re-ranked per result (default: VECTORSTORE_RERANK_FACTOR)")
+    return parser.parse_args()
+
+def get_sample_queries(vectors, count, seed=0):
+    """Midpoints of random pairs of stored vectors, so queries aren't exact copies of an indexed vector"""
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(vectors), size=(count, 2))
+    return np.ascontiguousarray((vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2, dtype=np.float32)
+
+def get_recall(results, ground_truth, k):
+    """Fraction of the exact top-k found in the top-k results"""
+    found = sum(len(set(row[:k]) & set(truth[:k])) for row, truth in zip(results, ground_truth))
+    return found / (len(ground_truth) * k)
+
+def benchmark_encoding(vectors, queries, ground_truth, index_type, encoding, k, rerank_factor, rag_system, metric):
+    """Build one encoding and measure it"""
+    start = time.time()
+    index = build_index(vectors, index_type, metric, encoding=encoding)
+    configure_search(index, rag_system.nprobe, rag_system.ef_search)
+    build_seconds = time.time() - start
+
+    start = time.time()
+    _, positions = index.search(queries, k)
+    search_ms = (time.time() - start) * 1000 / len(queries)
+
+    start = time.time()
+    candidate_k = min(k * rerank_factor, len(vectors))
+    scores, candidates = index.search(queries, candidate_k)
+    reranked = []
+    for query, row_scores, row in zip(queries, scores, candidates):
+        row_candidates = [(int(p), float(s)) for p, s in zip(row, row_scores) if p != -1]
+        exact = {position: vectors[position] for position, _ in row_candidates}
+        reranked.append([position for position, _ in rerank(query, row_candidates, exact, metric)])
+    rerank_ms = (time.time() - start) * 1000 / len(queries)
+
+    memory_bytes = get_memory_usage(index)
+    return {
+        "encoding": encoding,
+        "memory_mb": memory_bytes / 1e6,
+        "bytes_per_vector": memory_bytes / len(vectors),
+        "recall": get_recall(positions.tolist(), ground_truth, k),
+        "rerank_recall": get_recall(reranked, ground_truth, k),
+        "search_ms": search_ms,
+        "rerank_ms": rerank_ms,
+        "build_seconds": build_seconds
+    }
+
+def main(args=None):
+    """Main function to benchmark vector encodings"""
+    if args is None:
+        args = parse_args()
+
+    load_dotenv()
+
+    if not has_vectorstore(args.directory):
+        print(f"❌ Error: No vector store found in {args.directory}")
+        return False
+
+    encodings = [encoding.strip() for encoding in args.encodings.split(",") if encoding.strip()]
+    unknown = [encoding for encoding in encodings if encoding not in ENCODINGS]
+    if unknown:
+        print(f"❌ Error: Unknown encodings {', '.join(unknown)} (expected {', '.join(ENCODINGS)})")
+        return False
+
+    try:
+        # No embedding calls are made, so any key will do
+        rag_system = InsuranceRAGSystem(os.getenv("OPENAI_API_KEY") or "unused", mmap_index=False)
+        rag_system.store = IndexStore(args.directory)
+        success, message = rag_system.load_vectorstore()
+        if not success:
+            print(f"❌ Error: {message}")
+            return False
+
+        vectors = rag_system.get_index_vectors()
+        metric = rag_system.vectorstore.index.metric_type
+    except Exception as e:
+        print(f"❌ Error loading vector store: {str(e)}")
+        return False
+
+    count = len(vectors)
+    if count == 0:
+        print("❌ Error: Vector store is empty")
+        return False
+
+    k = min(args.k, count)
+    rerank_factor = args.rerank_factor or rag_system.rerank_factor
+    index_type = select_index_type(count, args.index_type or rag_system.index_type, rag_system.ann_threshold)
+    queries = get_sample_queries(vectors, args.queries)
+
+    exact = faiss.IndexFlat(vectors.shape[1], metric)
+    exact.add(vectors)
+    ground_truth = exact.search(queries, k)[1].tolist()
+
+    print(f"🚀 Benchmarking {count} vectors ({vectors.shape[1]} dimensions) in a {index_type} index, "
+          f"{len(queries)} queries, recall@{k}, re-ranking {k * rerank_factor} candidates")
+    print(f"{'encoding':<10} {'memory MB':>10} {'bytes/vec':>10} {'recall':>8} {'+rerank':>8} "
+          f"{'ms/query':>9} {'+rerank':>8} {'build s':>8}")
+
+    for requested in encodings:
+        encoding = select_encoding(count, requested)
+        if encoding != requested:
+            print(f"⚠️ {requested} needs more vectors to train - using {encoding}")
+        try:
+            result = benchmark_encoding(vectors, queries, ground_truth, index_type, encoding, k,
+                                        rerank_factor, rag_system, metric)
+        except Exception as e:
+            print(f"❌ Error benchmarking {requested}: {str(e)}")
+            return False
+        print(f"{requested:<10} {result['memory_mb']:>10.1f} {result['bytes_per_vector']:>10.1f} "
+              f"{result['recall']:>8.3f} {result['rerank_recall']:>8.3f} {result['search_ms']:>9.2f} "
+              f"{result['rerank_ms']:>8.2f} {result['build_seconds']:>8.1f}")
+
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
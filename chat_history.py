@@ -0,0 +1,231 @@
+"""
+Bounded, persistent chat history for the Insurance Chatbot application
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class ChatHistoryStore:
+    """Append-only SQLite log of chat exchanges for every session.
+
+    Exchanges are only ever inserted, with increasing ids that double as
+    pagination cursors. compact() trims each session to its newest
+    max_entries_per_session exchanges and drops exchanges older than
+    retention_seconds; start_compaction() runs it periodically on a
+    background thread so requests never pay for it. get_generation()
+    changes whenever exchanges may have been removed, so holders of a
+    cached view know to reload it.
+    """
+
+    def __init__(self, db_path: str, max_entries_per_session: int = 1000, retention_seconds: float = 0):
+        self.db_path = db_path
+        self.max_entries_per_session = max_entries_per_session
+        # 0 keeps exchanges until they fall out of the per-session limit
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._compactor = None
+        self.compacted = 0
+        # Bumped whenever this store removes exchanges
+        self._generation = 0
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        # Only takes effect on a new database; lets compaction hand freed pages back to the OS
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_history "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, query TEXT NOT NULL, "
+            "response TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chat_history_session ON chat_history (session_id, id)")
+        self._conn.commit()
+
+    def append(self, session_id: str, entry: Dict[str, Any]) -> int:
+        """Store an exchange and return its id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO chat_history (session_id, query, response, provider, model, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, entry["query"], entry["response"], entry["provider"], entry["model"], time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def get_entries(self, session_id: str, before: Optional[int] = None, limit: int = 50) -> List[Tuple[int, Dict[str, Any]]]:
+        """Get a session's newest `limit` exchanges with ids below `before`, as (id, entry) oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, query, response, provider, model FROM chat_history "
+                "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
+        return [
+            (entry_id, {"query": query, "response": response, "provider": provider, "model": model})
+            for entry_id, query, response, provider, model in reversed(rows)
+        ]
+
+    def count(self, session_id: str) -> int:
+        """Number of stored exchanges for a session"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chat_history WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def clear(self, session_id: str) -> int:
+        """Remove a session's exchanges; returns the number removed"""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,)).rowcount
+            self._conn.commit()
+            if removed:
+                self._generation += 1
+        return removed
+
+    def compact(self) -> int:
+        """Drop exchanges past the retention period or the per-session limit; returns the number removed"""
+        with self._lock:
+            removed = 0
+            if self.retention_seconds > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM chat_history WHERE created_at < ?", (time.time() - self.retention_seconds,)
+                ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM chat_history WHERE id IN ("
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id DESC) AS position "
+                "FROM chat_history) WHERE position > ?)",
+                (self.max_entries_per_session,)
+            ).rowcount
+            self._conn.commit()
+            if removed:
+                self._conn.execute("PRAGMA incremental_vacuum")
+                self._generation += 1
+            self.compacted += removed
+        return removed
+
+    def get_generation(self) -> Tuple[int, int]:
+        """A value that changes whenever exchanges may have been removed
+
+        data_version covers commits from other processes sharing the file,
+        whose compactors can remove exchanges this process has cached.
+        """
+        with self._lock:
+            return self._generation, self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def start_compaction(self, interval_seconds: float = 300):
+        """Compact now and then every interval_seconds on a background thread"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while True:
+                try:
+                    self.compact()
+                except sqlite3.Error:
+                    # Most likely the database is busy; try again next interval
+                    pass
+                if self._stop.wait(interval_seconds):
+                    return
+
+        self._compactor = threading.Thread(target=run, name="chat-history-compaction", daemon=True)
+        self._compactor.start()
+
+    def stop_compaction(self):
+        self._stop.set()
+
+
+class ChatHistory:
+    """One session's chat history: a ring buffer of recent exchanges over an optional store.
+
+    The newest `window` exchanges are kept in memory, so recent pages are
+    served without touching disk. With a store every exchange is also
+    appended to it, and older pages are read from there; without one the
+    history is just the in-memory window. After the store has removed
+    exchanges (compaction, retention) the window and total are reloaded
+    from it.
+    """
+
+    def __init__(self, session_id: str = "default", store: Optional[ChatHistoryStore] = None, window: int = 100):
+        self.session_id = session_id
+        self.store = store
+        self.window = window
+        # (id, entry) pairs, oldest first
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._total = 0
+        self._generation = None
+        self._sync()
+        # Ids for exchanges that aren't stored
+        self._next_id = self._recent[-1][0] + 1 if self._recent else 1
+
+    def _sync(self):
+        """Reload the window and total if the store may have removed exchanges; hold _lock"""
+        if self.store is None:
+            return
+        generation = self.store.get_generation()
+        if generation == self._generation:
+            return
+        self._recent.clear()
+        self._recent.extend(self.store.get_entries(self.session_id, limit=self.window))
+        self._total = self.store.count(self.session_id)
+        self._generation = generation
+
+    def append(self, entry: Dict[str, Any]):
+        """Add an exchange"""
+        with self._lock:
+            entry_id = self.store.append(self.session_id, entry) if self.store is not None else self._next_id
+            self._next_id = entry_id + 1
+            self._recent.append((entry_id, entry))
+            self._total += 1
+
+    def get_recent(self) -> List[Dict[str, Any]]:
+        """Get the exchanges kept in memory, oldest first"""
+        with self._lock:
+            return [entry for _, entry in self._recent]
+
+    def get_page(self, cursor: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+        """Get the newest `limit` exchanges before a cursor, oldest first
+
+        Start without a cursor for the latest exchanges, then pass each
+        page's next_cursor to walk further back; it is None on the last page.
+        """
+        with self._lock:
+            self._sync()
+            older = [(entry_id, entry) for entry_id, entry in self._recent if cursor is None or entry_id < cursor]
+            total = self._total if self.store is not None else len(self._recent)
+            # The buffer answers unless the page may reach past its oldest exchange into ones only on disk
+            in_memory = len(older) > limit or self.store is None or self._total <= len(self._recent)
+
+        if in_memory:
+            has_more = len(older) > limit
+            entries = older[-limit:]
+        else:
+            entries = self.store.get_entries(self.session_id, before=cursor, limit=limit + 1)
+            has_more = len(entries) > limit
+            entries = entries[-limit:]
+
+        return {
+            "entries": [entry for _, entry in entries],
+            "next_cursor": entries[0][0] if has_more else None,
+            "total": total
+        }
+
+    def clear(self):
+        """Remove every exchange, in memory and on disk"""
+        with self._lock:
+            if self.store is not None:
+                self.store.clear(self.session_id)
+            self._recent.clear()
+            self._total = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return self._total if self.store is not None else len(self._recent)
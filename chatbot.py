@@ -1,32 +1,64 @@
 import os
-import streamlit as st
-from typing import Dict, Any, List
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Callable, Iterator, AsyncIterator, Optional, Tuple, Union
 from rag_system import InsuranceRAGSystem
 from llm_handlers import LLMHandler
+from answer_cache import SemanticAnswerCache
+from chat_history import ChatHistory
+
+logger = logging.getLogger(__name__)
 
 class InsuranceChatbot:
-    def __init__(self):
-        self.rag_system = None
+    def __init__(self, rag_system: Optional[InsuranceRAGSystem] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None, chat_history: Optional[ChatHistory] = None):
+        # Chatbots for different sessions can share one loaded RAG system and answer cache
+        self.rag_system = rag_system
         self.llm_handler = None
-        self.chat_history = []
+        # Only the most recent exchanges are kept in memory; pass a history with a store to keep them all
+        if chat_history is None:
+            chat_history = ChatHistory(window=int(os.getenv("CHAT_HISTORY_WINDOW", "100")))
+        self.chat_history = chat_history
+        # Why an existing vector store couldn't be loaded, for the UI to show
+        self.vectorstore_warning = None
+        if answer_cache is None:
+            answer_cache = SemanticAnswerCache(
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+            )
+        self.answer_cache = answer_cache
+        # LLM calls in flight at once when answering a batch of queries
+        self.batch_concurrency = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+        
+    def initialize(self, api_key: str, provider: str = "openai", fallbacks: Optional[List[Tuple[str, str]]] = None,
+                   embedding_api_key: Optional[str] = None):
+        """Initialize the chatbot with API key and provider, and (provider, api_key) pairs to fail over to
         
-    def initialize(self, api_key: str, provider: str = "openai"):
-        """Initialize the chatbot with API key and provider"""
+        embedding_api_key, if given, is the OpenAI key documents and queries
+        are embedded with instead of one derived from api_key.
+        """
         try:
-            self.rag_system = InsuranceRAGSystem(api_key, provider)
-            self.llm_handler = LLMHandler(provider, api_key)
+            self.rag_system = InsuranceRAGSystem(api_key, provider, embedding_api_key=embedding_api_key)
+            self.llm_handler = LLMHandler(provider, api_key, fallbacks)
             
             # Try to load existing vector store
             success, message = self.rag_system.load_vectorstore()
             if not success:
                 # Don't show warning if no vector store exists yet - this is normal for first run
                 if "No vector store found" not in message:
-                    st.warning(f"Could not load existing vector store: {message}")
+                    self.vectorstore_warning = f"Could not load existing vector store: {message}"
+                    logger.warning(self.vectorstore_warning)
             
             return True, "Chatbot initialized successfully"
         except Exception as e:
             return False, f"Error initializing chatbot: {str(e)}"
     
+    def set_provider(self, api_key: str, provider: str = "openai", fallbacks: Optional[List[Tuple[str, str]]] = None):
+        """Switch the LLM provider, keeping the loaded RAG system and chat history"""
+        self.llm_handler = LLMHandler(provider, api_key, fallbacks)
+    
     def load_policy_document(self, file_path: str):
         """Load a new policy document"""
         if not self.rag_system:
@@ -34,6 +66,38 @@ class InsuranceChatbot:
         
         return self.rag_system.load_policy_document(file_path)
     
+    def load_policy_documents(self, file_paths: List[str], jobs: Optional[int] = None,
+                              progress_callback: Optional[Callable[[str, int, int], None]] = None) -> Iterator[Tuple[str, bool, str]]:
+        """Load several policy documents, yielding (file_path, success, message) per document"""
+        if not self.rag_system:
+            for file_path in file_paths:
+                yield file_path, False, "Chatbot not initialized"
+            return
+        
+        yield from self.rag_system.load_policy_documents(file_paths, jobs=jobs, progress_callback=progress_callback)
+    
+    def get_document_chunk_count(self, file_path: str) -> Optional[int]:
+        """Get the number of chunks an indexed document contributes"""
+        if not self.rag_system:
+            return None
+        
+        entry = self.rag_system.manifest.get_document(file_path)
+        return len(entry["chunk_ids"]) if entry else None
+    
+    def delete_policy_document(self, file_path: str):
+        """Remove a policy document from the vector store"""
+        if not self.rag_system:
+            return False, "Chatbot not initialized"
+        
+        return self.rag_system.delete_policy_document(file_path)
+    
+    def compact_vectorstore(self):
+        """Reclaim space used by deleted document chunks"""
+        if not self.rag_system:
+            return False, "Chatbot not initialized"
+        
+        return self.rag_system.compact_vectorstore()
+    
     def process_query(self, query: str) -> Dict[str, Any]:
         """Process a user query and return response"""
         if not self.rag_system or not self.llm_handler:
@@ -43,19 +107,24 @@ class InsuranceChatbot:
             }
         
         try:
+            cached = self._get_exact_cached_answer(query)
+            if cached:
+                self._record_exchange(query, cached)
+                return cached
+            
             # Get relevant context from RAG system
-            context = self.rag_system.get_context_for_query(query)
+            embedding, context = self.rag_system.retrieve_context(query, provider=self.llm_handler.provider)
+            
+            cached = self._get_similar_cached_answer(embedding, context)
+            if cached:
+                self._record_exchange(query, cached)
+                return cached
             
             # Generate response using LLM
             result = self.llm_handler.generate_response(query, context)
             
-            # Add to chat history
-            self.chat_history.append({
-                "query": query,
-                "response": result.get("response", "No response generated"),
-                "provider": result.get("provider", "unknown"),
-                "model": result.get("model", "unknown")
-            })
+            self._cache_answer(query, embedding, context, result)
+            self._record_exchange(query, result)
             
             return result
             
@@ -65,10 +134,313 @@ class InsuranceChatbot:
                 "error": True
             }
     
+    async def aprocess_query(self, query: str) -> Dict[str, Any]:
+        """Process a user query without blocking the event loop"""
+        if not self.rag_system or not self.llm_handler:
+            return {
+                "response": "Chatbot not properly initialized. Please check your API keys.",
+                "error": True
+            }
+        
+        try:
+            cached = self._get_exact_cached_answer(query)
+            if cached:
+                self._record_exchange(query, cached)
+                return cached
+            
+            embedding, context = await self.rag_system.aretrieve_context(query, provider=self.llm_handler.provider)
+            
+            cached = self._get_similar_cached_answer(embedding, context)
+            if cached:
+                self._record_exchange(query, cached)
+                return cached
+            
+            result = await self.llm_handler.agenerate_response(query, context)
+            
+            self._cache_answer(query, embedding, context, result)
+            self._record_exchange(query, result)
+            
+            return result
+            
+        except Exception as e:
+            return {
+                "response": f"Error processing query: {str(e)}",
+                "error": True
+            }
+    
+    def process_queries(self, queries: List[str], max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Process a batch of queries, returning one result per query in input order
+        
+        Queries that need retrieval are embedded in one request and searched
+        with one FAISS search; LLM calls then run with at most max_concurrency
+        in flight. Identical queries are answered once. A query that fails
+        gets an error result without affecting the others.
+        """
+        if not self.rag_system or not self.llm_handler:
+            return [self._not_initialized_result() for _ in queries]
+        
+        results, pending = self._start_batch(queries)
+        unique_queries = list(pending)
+        if unique_queries:
+            try:
+                retrieved = self.rag_system.retrieve_contexts(unique_queries, provider=self.llm_handler.provider)
+            except Exception as e:
+                retrieved = [e] * len(unique_queries)
+            
+            def answer(query: str, retrieval) -> Dict[str, Any]:
+                try:
+                    result = self._get_batch_answer(query, retrieval)
+                    if result is not None:
+                        return result
+                    embedding, context = retrieval
+                    result = self.llm_handler.generate_response(query, context)
+                    self._cache_answer(query, embedding, context, result)
+                    return result
+                except Exception as e:
+                    return self._error_result(e)
+            
+            workers = max(1, min(max_concurrency or self.batch_concurrency, len(unique_queries)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                answers = list(executor.map(answer, unique_queries, retrieved))
+            self._fill_batch(results, pending, answers)
+        
+        return self._finish_batch(queries, results)
+    
+    async def aprocess_queries(self, queries: List[str], max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Process a batch of queries without blocking the event loop (see process_queries)"""
+        if not self.rag_system or not self.llm_handler:
+            return [self._not_initialized_result() for _ in queries]
+        
+        results, pending = self._start_batch(queries)
+        unique_queries = list(pending)
+        if unique_queries:
+            try:
+                retrieved = await self.rag_system.aretrieve_contexts(unique_queries, provider=self.llm_handler.provider)
+            except Exception as e:
+                retrieved = [e] * len(unique_queries)
+            
+            semaphore = asyncio.Semaphore(max(1, max_concurrency or self.batch_concurrency))
+            
+            async def answer(query: str, retrieval) -> Dict[str, Any]:
+                try:
+                    result = self._get_batch_answer(query, retrieval)
+                    if result is not None:
+                        return result
+                    embedding, context = retrieval
+                    async with semaphore:
+                        result = await self.llm_handler.agenerate_response(query, context)
+                    self._cache_answer(query, embedding, context, result)
+                    return result
+                except Exception as e:
+                    return self._error_result(e)
+            
+            answers = await asyncio.gather(*(answer(query, retrieval) for query, retrieval in zip(unique_queries, retrieved)))
+            self._fill_batch(results, pending, answers)
+        
+        return self._finish_batch(queries, results)
+    
+    def _start_batch(self, queries: List[str]) -> Tuple[List[Optional[Dict[str, Any]]], Dict[str, List[int]]]:
+        """Answer what a batch can without retrieval (empty queries, cached answers)
+        
+        Returns the partly filled results and, for every distinct query still
+        to answer, the positions it appears at.
+        """
+        results = [None] * len(queries)
+        pending = {}
+        for i, query in enumerate(queries):
+            if not query or not query.strip():
+                results[i] = {"response": "Query is empty", "error": True}
+                continue
+            if query in pending:
+                pending[query].append(i)
+                continue
+            cached = self._get_exact_cached_answer(query)
+            if cached:
+                results[i] = cached
+            else:
+                pending[query] = [i]
+        return results, pending
+    
+    def _get_batch_answer(self, query: str, retrieval: Union[Tuple[Optional[List[float]], str], Exception]) -> Optional[Dict[str, Any]]:
+        """Answer a batch query without the LLM if possible: a retrieval error or a similar cached answer"""
+        if isinstance(retrieval, Exception):
+            return self._error_result(retrieval)
+        embedding, context = retrieval
+        return self._get_similar_cached_answer(embedding, context)
+    
+    def _fill_batch(self, results: List[Optional[Dict[str, Any]]], pending: Dict[str, List[int]],
+                    answers: List[Dict[str, Any]]):
+        """Put each distinct query's answer at every position it appears at"""
+        for positions, answer in zip(pending.values(), answers):
+            for i in positions:
+                results[i] = answer
+    
+    def _finish_batch(self, queries: List[str], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Record a batch's successful answers in chat history, in input order"""
+        for query, result in zip(queries, results):
+            if not result.get("error"):
+                self._record_exchange(query, result)
+        return results
+    
+    def _error_result(self, error: Exception) -> Dict[str, Any]:
+        return {
+            "response": f"Error processing query: {str(error)}",
+            "error": True
+        }
+    
+    def _not_initialized_result(self) -> Dict[str, Any]:
+        return {
+            "response": "Chatbot not properly initialized. Please check your API keys.",
+            "error": True
+        }
+    
+    def stream_query(self, query: str) -> Iterator[Dict[str, Any]]:
+        """Process a user query, yielding response events as tokens arrive
+        
+        Yields {"type": "token", "content": ...} events, followed by either a
+        {"type": "done", ...} event carrying the full response or a
+        {"type": "error", ...} event.
+        """
+        if not self.rag_system or not self.llm_handler:
+            yield {
+                "type": "error",
+                "response": "Chatbot not properly initialized. Please check your API keys.",
+                "error": True
+            }
+            return
+        
+        chunks = []
+        try:
+            cached = self._get_exact_cached_answer(query, streaming=True)
+            if cached is None:
+                embedding, context = self.rag_system.retrieve_context(query, provider=self.llm_handler.provider)
+                cached = self._get_similar_cached_answer(embedding, context, streaming=True)
+            
+            if cached:
+                self._record_exchange(query, cached)
+                yield {"type": "token", "content": cached["response"]}
+                yield {"type": "done", **cached}
+                return
+            
+            for chunk in self.llm_handler.stream_response(query, context):
+                chunks.append(chunk)
+                yield {"type": "token", "content": chunk}
+            
+            yield self._finish_stream(query, embedding, context, chunks)
+            
+        except Exception as e:
+            yield self._stream_error(e, chunks)
+    
+    async def astream_query(self, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """Process a user query, yielding response events without blocking the event loop"""
+        if not self.rag_system or not self.llm_handler:
+            yield {
+                "type": "error",
+                "response": "Chatbot not properly initialized. Please check your API keys.",
+                "error": True
+            }
+            return
+        
+        chunks = []
+        try:
+            cached = self._get_exact_cached_answer(query, streaming=True)
+            if cached is None:
+                embedding, context = await self.rag_system.aretrieve_context(query, provider=self.llm_handler.provider)
+                cached = self._get_similar_cached_answer(embedding, context, streaming=True)
+            
+            if cached:
+                self._record_exchange(query, cached)
+                yield {"type": "token", "content": cached["response"]}
+                yield {"type": "done", **cached}
+                return
+            
+            async for chunk in self.llm_handler.astream_response(query, context):
+                chunks.append(chunk)
+                yield {"type": "token", "content": chunk}
+            
+            yield self._finish_stream(query, embedding, context, chunks)
+            
+        except Exception as e:
+            yield self._stream_error(e, chunks)
+    
+    def _finish_stream(self, query: str, embedding: Optional[List[float]], context: str,
+                       chunks: List[str]) -> Dict[str, Any]:
+        """Record a completed stream in chat history and build its final event"""
+        # The stream may have come from a fallback provider
+        provider = self.llm_handler.last_provider
+        result = {
+            "response": "".join(chunks),
+            "provider": provider,
+            "model": self.llm_handler.get_model_name(provider)
+        }
+        self._cache_answer(query, embedding, context, result)
+        self._record_exchange(query, result)
+        
+        return {"type": "done", **result}
+    
+    def _stream_error(self, error: Exception, chunks: List[str]) -> Dict[str, Any]:
+        """Build the error event for a failed stream"""
+        return {
+            "type": "error",
+            "response": f"Error generating response: {str(error)}",
+            "error": True,
+            # Tells callers whether any tokens were already delivered
+            "partial": bool(chunks)
+        }
+    
+    def _get_exact_cached_answer(self, query: str, streaming: bool = False) -> Optional[Dict[str, Any]]:
+        """Look up a cached answer for the same query before doing any retrieval"""
+        # Any change to the vector store invalidates every cached answer
+        self.answer_cache.validate(self.rag_system.index_version)
+        provider = self.llm_handler.get_expected_provider(streaming)
+        return self.answer_cache.get_exact(query, provider, self.llm_handler.get_model_name(provider))
+    
+    def _get_similar_cached_answer(self, embedding: Optional[List[float]], context: str,
+                                   streaming: bool = False) -> Optional[Dict[str, Any]]:
+        """Look up a cached answer for a similar query that retrieved the same context"""
+        if embedding is None:
+            return None
+        
+        provider = self.llm_handler.get_expected_provider(streaming)
+        return self.answer_cache.get_similar(embedding, context, provider, self.llm_handler.get_model_name(provider))
+    
+    def _cache_answer(self, query: str, embedding: Optional[List[float]], context: str, result: Dict[str, Any]):
+        """Cache a successful answer under the provider and model that actually produced it"""
+        if embedding is None or result.get("error") or not result.get("response"):
+            return
+        
+        provider = result.get("provider", self.llm_handler.provider)
+        self.answer_cache.put(
+            query, embedding, context, provider, result.get("model", self.llm_handler.get_model_name(provider)), result
+        )
+    
+    def _record_exchange(self, query: str, result: Dict[str, Any]):
+        """Add a query and its result to chat history"""
+        self.chat_history.append({
+            "query": query,
+            "response": result.get("response", "No response generated"),
+            "provider": result.get("provider", "unknown"),
+            "model": result.get("model", "unknown")
+        })
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get retrieval cache statistics"""
+        if not self.rag_system:
+            return {}
+        
+        return {
+            "query_embeddings": self.rag_system.get_cache_stats(),
+            "answers": self.answer_cache.get_stats()
+        }
+    
     def get_chat_history(self) -> List[Dict[str, Any]]:
-        """Get chat history"""
-        return self.chat_history
+        """Get the most recent chat history kept in memory"""
+        return self.chat_history.get_recent()
+    
+    def get_chat_history_page(self, cursor: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+        """Get a page of chat history, newest page first (see ChatHistory.get_page)"""
+        return self.chat_history.get_page(cursor, limit)
     
     def clear_chat_history(self):
         """Clear chat history"""
-        self.chat_history = []
+        self.chat_history.clear()
@@ -0,0 +1,154 @@
+"""
+On-disk chunk store for the FAISS vector store
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """SQLite-backed docstore holding chunk text and metadata by chunk id.
+
+    Stands in for langchain's pickled InMemoryDocstore, so chunk texts stay
+    on disk and are read only for the handful of ids a search returns.
+    Chunk ids are content addresses, so adding an existing id is a no-op and
+    the same database is shared by every snapshot generation. Deleted ids are
+    only removed by purge(), once no snapshot still refers to them.
+
+    Each chunk can also keep its full-precision float32 vector, so compressed
+    indexes can re-rank candidates exactly and be rebuilt without re-embedding.
+
+    Chunk texts are indexed in an FTS5 inverted index (chunks_fts), kept in
+    step with the chunks table by triggers, for BM25 keyword search.
+    """
+
+    # SQLite's default limit on parameters per statement is 999
+    MAX_QUERY_IDS = 500
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._pending_deletes = set()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        # WAL lets processes serving queries read while ingestion writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks "
+            "(id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL, vector BLOB)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if "vector" not in columns:
+            # Created before vectors were kept
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+        self._create_text_index()
+        self._conn.commit()
+
+    def _create_text_index(self):
+        """Create the full-text index over chunk contents, indexing existing chunks if it's new"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+        ).fetchone()
+        if exists:
+            return
+        self._conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content, content='chunks', content_rowid='rowid', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF content ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+            END;
+            INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild');
+        """)
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Get a chunk by id, or a not-found message like InMemoryDocstore"""
+        with self._lock:
+            row = self._conn.execute("SELECT content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Store chunks; ids that are already stored are left as they are"""
+        rows = [
+            (chunk_id, doc.page_content, json.dumps(doc.metadata, default=str))
+            for chunk_id, doc in texts.items()
+        ]
+        with self._lock:
+            self._pending_deletes.difference_update(texts)
+            self._conn.executemany("INSERT OR IGNORE INTO chunks (id, content, metadata) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def put_vectors(self, ids: List[str], vectors) -> None:
+        """Keep full-precision vectors for chunks that are already stored"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [(vector.tobytes(), chunk_id) for chunk_id, vector in zip(ids, vectors)]
+        with self._lock:
+            self._conn.executemany("UPDATE chunks SET vector = ? WHERE id = ?", rows)
+            self._conn.commit()
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Get the full-precision vectors kept for chunks; ids without one are left out"""
+        vectors = {}
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), self.MAX_QUERY_IDS):
+                batch = ids[start:start + self.MAX_QUERY_IDS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT id, vector FROM chunks WHERE vector IS NOT NULL AND id IN ({placeholders})", batch
+                )
+                for chunk_id, blob in rows:
+                    vectors[chunk_id] = np.frombuffer(blob, dtype=np.float32)
+        return vectors
+
+    def search_text(self, expression: str, limit: int) -> List[Tuple[str, float]]:
+        """Full-text search with an FTS5 match expression
+
+        Returns (chunk id, BM25 score) pairs, best (highest score) first.
+        Chunks marked for removal are left out.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunks.id, -bm25(chunks_fts) AS score FROM chunks_fts "
+                "JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+                "WHERE chunks_fts MATCH ? ORDER BY score DESC LIMIT ?",
+                (expression, limit + len(self._pending_deletes))
+            ).fetchall()
+            hits = [(chunk_id, float(score)) for chunk_id, score in rows if chunk_id not in self._pending_deletes]
+        return hits[:limit]
+
+    def delete(self, ids: List) -> None:
+        """Mark chunks for removal on the next purge()"""
+        with self._lock:
+            self._pending_deletes.update(ids)
+
+    def purge(self) -> int:
+        """Remove chunks marked by delete(); returns the number removed"""
+        with self._lock:
+            ids = list(self._pending_deletes)
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+            self._pending_deletes.clear()
+        return len(ids)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,154 @@
+"""
+Token-budgeted packing of search results into the context sent to the LLM
+"""
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+# Prompt tokens available for retrieved context, per LLM provider
+DEFAULT_TOKEN_BUDGETS = {
+    "openai": 1000,
+    "anthropic": 1500,
+    "google": 1500
+}
+DEFAULT_TOKEN_BUDGET = 1000
+
+# English policy text averages about 4 characters per token for these models' tokenizers
+CHARS_PER_TOKEN = 4
+
+# Shortest shared text taken as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+# Characters (the whitespace the splitter dropped) that may separate adjacent chunks
+MAX_ADJACENT_GAP = 2
+# Don't bother with a truncated passage shorter than this many tokens
+MIN_PASSAGE_TOKENS = 50
+
+SENTENCE_END = re.compile(r"[.!?;:]\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens in a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def get_token_budget(budgets: Dict[str, int], provider: Optional[str]) -> int:
+    """Context token budget for a provider"""
+    return budgets.get(provider, DEFAULT_TOKEN_BUDGET)
+
+
+def cut_at_score_gap(results: List[Dict[str, Any]], max_gap: float) -> List[Dict[str, Any]]:
+    """Keep results (best first) up to the first drop in relevance larger than max_gap"""
+    for i in range(1, len(results)):
+        if results[i - 1]["relevance"] - results[i]["relevance"] > max_gap:
+            return results[:i]
+    return results
+
+
+def get_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of first that is a prefix of second (0 if under MIN_OVERLAP_CHARS)"""
+    for length in range(min(len(first), len(second)), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _join(first: Dict[str, Any], second: Dict[str, Any]) -> Optional[str]:
+    """Text of two chunks of the same page merged in reading order, or None if they aren't neighbours"""
+    first_start = first["metadata"].get("start_index")
+    second_start = second["metadata"].get("start_index")
+    if first_start is not None and second_start is not None:
+        if second_start < first_start:
+            first, second, first_start, second_start = second, first, second_start, first_start
+        first_end = first_start + len(first["content"])
+        if second_start + len(second["content"]) <= first_end:
+            return first["content"]
+        if second_start - first_end > MAX_ADJACENT_GAP:
+            return None
+        if second_start >= first_end:
+            return first["content"] + "\n" + second["content"]
+        return first["content"] + second["content"][first_end - second_start:]
+
+    # Chunks indexed before positions were recorded: match the splitter's overlap by text
+    for before, after in ((first, second), (second, first)):
+        if after["content"] in before["content"]:
+            return before["content"]
+        overlap = get_overlap(before["content"], after["content"])
+        if overlap:
+            return before["content"] + after["content"][overlap:]
+    return None
+
+
+def merge_neighbours(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge overlapping or adjacent chunks of the same page into single passages
+
+    Each merged passage takes the best relevance of its chunks and the place
+    of its best chunk; passages are returned best first.
+    """
+    passages = []
+    for result in results:
+        passage = {
+            "content": result["content"],
+            "metadata": dict(result["metadata"]),
+            "relevance": result["relevance"]
+        }
+        merged = True
+        while merged:
+            merged = False
+            for other in passages:
+                if (other["metadata"].get("source"), other["metadata"].get("page")) != \
+                        (passage["metadata"].get("source"), passage["metadata"].get("page")):
+                    continue
+                text = _join(other, passage)
+                if text is None:
+                    continue
+                starts = [p["metadata"].get("start_index") for p in (other, passage)]
+                other["content"] = text
+                other["metadata"]["start_index"] = min(starts) if None not in starts else None
+                other["relevance"] = max(other["relevance"], passage["relevance"])
+                # The grown passage may now reach one it didn't touch before
+                passages.remove(other)
+                passage = other
+                merged = True
+                break
+        passages.append(passage)
+
+    return sorted(passages, key=lambda passage: passage["relevance"], reverse=True)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten a text to about max_tokens, ending at a sentence (or else word) boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    text = text[:max_chars]
+    sentence_ends = [match.end() for match in SENTENCE_END.finditer(text)]
+    if sentence_ends and sentence_ends[-1] > max_chars // 2:
+        return text[:sentence_ends[-1]].rstrip()
+    return text.rsplit(None, 1)[0] if " " in text else text
+
+
+def pack_context(results: List[Dict[str, Any]], token_budget: int, max_gap: float) -> List[Dict[str, Any]]:
+    """Choose the passages to send for search results that carry a 0..1 "relevance", best first
+
+    Results past a relevance gap larger than max_gap are dropped, chunks of
+    the same page that overlap or touch are merged, and passages are added
+    best first until token_budget is spent. The passage that doesn't fit is
+    cut at a sentence boundary if enough budget is left; the best passage is
+    always sent, truncated if needed.
+    """
+    passages = merge_neighbours(cut_at_score_gap(results, max_gap))
+
+    packed = []
+    remaining = token_budget
+    for passage in passages:
+        tokens = estimate_tokens(passage["content"])
+        if tokens > remaining:
+            if packed and remaining < MIN_PASSAGE_TOKENS:
+                break
+            passage["content"] = truncate_to_tokens(passage["content"], remaining)
+            packed.append(passage)
+            break
+        packed.append(passage)
+        remaining -= tokens
+
+    return packed
@@ -6,12 +6,31 @@ This script processes PDF files in the policy_docs folder and creates a FAISS ve
 
 import os
 import sys
+import argparse
 from dotenv import load_dotenv
-from rag_system import InsuranceRAGSystem
+from rag_system import InsuranceRAGSystem, VECTORSTORE_DIR
+from index_store import has_vectorstore
 from utils import get_api_key_and_provider, validate_api_key
+from embedders import EMBEDDING_BACKENDS, LOCAL
 
-def main():
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Create the FAISS vector store from policy documents")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Chunks per embedding request (default: EMBEDDING_BATCH_SIZE or 100)")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Embedding requests in flight at once (default: EMBEDDING_CONCURRENCY or 4)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Processes used to parse PDFs (default: INGEST_JOBS or the number of CPU cores)")
+    parser.add_argument("--embedding-backend", default=None, choices=EMBEDDING_BACKENDS,
+                        help="Embedder to build the index with (default: EMBEDDING_BACKEND or openai)")
+    return parser.parse_args()
+
+def main(args=None):
     """Main function to create vector store from policy documents"""
+    if args is None:
+        args = parse_args()
+    
     print("🚀 Starting vector store creation...")
     
     # Load environment variables
@@ -19,8 +38,10 @@ def main():
     
     # Get API key and provider
     api_key, provider = get_api_key_and_provider()
+    embedding_backend = args.embedding_backend or os.getenv("EMBEDDING_BACKEND", "openai")
     
-    if not validate_api_key(api_key, provider):
+    # The local embedder makes no API calls, so no key is needed to build the index
+    if embedding_backend != LOCAL and not validate_api_key(api_key, provider):
         print(f"❌ Error: No valid API key found for provider '{provider}'")
         print("Please check your .env file and ensure you have set a valid API key.")
         print("\nExample .env file content:")
@@ -28,11 +49,20 @@ def main():
         print("DEFAULT_LLM_PROVIDER=openai")
         return False
     
-    print(f"✅ Using {provider} provider with API key configured")
+    if embedding_backend == LOCAL:
+        print("✅ Using the local embedder (no API calls)")
+    else:
+        print(f"✅ Using {provider} provider with API key configured")
     
     # Initialize RAG system
     try:
-        rag_system = InsuranceRAGSystem(api_key, provider)
+        rag_system = InsuranceRAGSystem(
+            api_key,
+            provider,
+            embedding_batch_size=args.batch_size,
+            embedding_concurrency=args.concurrency,
+            embedding_backend=embedding_backend
+        )
         print("✅ RAG system initialized successfully")
     except Exception as e:
         print(f"❌ Error initializing RAG system: {str(e)}")
@@ -53,16 +83,17 @@ def main():
     
     print(f"📄 Found {len(pdf_files)} PDF file(s): {', '.join(pdf_files)}")
     
-    # Process each PDF file
+    # Parse PDFs in a process pool; each file is embedded as soon as its chunks are ready
+    jobs = args.jobs or int(os.getenv("INGEST_JOBS", "0")) or os.cpu_count()
+    file_paths = [os.path.join(policy_docs_dir, pdf_file) for pdf_file in sorted(pdf_files)]
+    print(f"\n📖 Processing with {jobs} parser process(es)...")
+    
     total_chunks = 0
-    for pdf_file in pdf_files:
-        file_path = os.path.join(policy_docs_dir, pdf_file)
-        print(f"\n📖 Processing {pdf_file}...")
-        
-        try:
-            success, message = rag_system.load_policy_document(file_path)
+    try:
+        for file_path, success, message in rag_system.load_policy_documents(file_paths, jobs=jobs):
+            pdf_file = os.path.basename(file_path)
             if success:
-                print(f"✅ {message}")
+                print(f"✅ {pdf_file}: {message}")
                 # Extract number of chunks from message if possible
                 if "chunks" in message:
                     try:
@@ -74,9 +105,9 @@ def main():
                 print(f"❌ Error processing {pdf_file}: {message}")
                 return False
                 
-        except Exception as e:
-            print(f"❌ Exception while processing {pdf_file}: {str(e)}")
-            return False
+    except Exception as e:
+        print(f"❌ Exception while processing policy documents: {str(e)}")
+        return False
     
     # Save the vector store
     print(f"\n💾 Saving vector store...")
@@ -88,9 +119,11 @@ def main():
         return False
     
     # Verify the vector store was created
-    if os.path.exists("models/faiss_index/index.faiss"):
+    if has_vectorstore(VECTORSTORE_DIR):
         print("✅ Vector store files created successfully")
         print(f"📊 Total document chunks processed: {total_chunks}")
+        stats = rag_system.get_ingestion_stats()
+        print(f"⚡ Embedded {stats['chunks_embedded']} chunks at {stats['chunks_per_second']} chunks/sec")
         print("\n🎉 Vector store creation completed successfully!")
         print("You can now run the Streamlit app: streamlit run app.py")
         return True
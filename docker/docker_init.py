@@ -8,8 +8,10 @@ import os
 import sys
 import logging
 from dotenv import load_dotenv
-from rag_system import InsuranceRAGSystem
+from rag_system import InsuranceRAGSystem, VECTORSTORE_DIR
+from index_store import has_vectorstore
 from utils import get_api_key_and_provider, validate_api_key
+from embedders import LOCAL
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,13 +23,18 @@ def create_vectorstore():
     load_dotenv()
     
     api_key, provider = get_api_key_and_provider()
+    embedding_backend = os.getenv("EMBEDDING_BACKEND", "openai")
     
-    if not validate_api_key(api_key, provider):
+    # The local embedder makes no API calls, so the index can be built without a key
+    if embedding_backend != LOCAL and not validate_api_key(api_key, provider):
         logger.warning(f"No valid API key found for provider '{provider}'")
         logger.info("Vector store will be created when the app starts with valid API keys")
         return True  # Don't fail the build, just skip vector store creation
     
-    logger.info(f"Using {provider} provider with API key configured")
+    if embedding_backend == LOCAL:
+        logger.info("Using the local embedder (no API calls)")
+    else:
+        logger.info(f"Using {provider} provider with API key configured")
    
     try:
         rag_system = InsuranceRAGSystem(api_key, provider)
@@ -49,15 +56,16 @@ def create_vectorstore():
     
     logger.info(f"📄 Found {len(pdf_files)} PDF file(s): {', '.join(pdf_files)}")
     
+    jobs = int(os.getenv("INGEST_JOBS", "0")) or os.cpu_count()
+    file_paths = [os.path.join(policy_docs_dir, pdf_file) for pdf_file in sorted(pdf_files)]
+    logger.info(f"📖 Processing with {jobs} parser process(es)...")
+    
     total_chunks = 0
-    for pdf_file in pdf_files:
-        file_path = os.path.join(policy_docs_dir, pdf_file)
-        logger.info(f"📖 Processing {pdf_file}...")
-        
-        try:
-            success, message = rag_system.load_policy_document(file_path)
+    try:
+        for file_path, success, message in rag_system.load_policy_documents(file_paths, jobs=jobs):
+            pdf_file = os.path.basename(file_path)
             if success:
-                logger.info(f"{message}")
+                logger.info(f"{pdf_file}: {message}")
                 if "chunks" in message:
                     try:
                         chunks = int(message.split()[0])
@@ -68,9 +76,9 @@ def create_vectorstore():
                 logger.error(f"Error processing {pdf_file}: {message}")
                 return False
                 
-        except Exception as e:
-            logger.error(f"Exception while processing {pdf_file}: {str(e)}")
-            return False
+    except Exception as e:
+        logger.error(f"Exception while processing policy documents: {str(e)}")
+        return False
     
     logger.info(f"Saving vector store...")
     try:
@@ -80,9 +88,12 @@ def create_vectorstore():
         logger.error(f"Error saving vector store: {str(e)}")
         return False
     
-    if os.path.exists("models/faiss_index/index.faiss"):
+    if has_vectorstore(VECTORSTORE_DIR):
         logger.info("Vector store files created successfully")
         logger.info(f"Total document chunks processed: {total_chunks}")
+        stats = rag_system.get_ingestion_stats()
+        logger.info(f"Embedded {stats['chunks_embedded']} chunks at {stats['chunks_per_second']} chunks/sec "
+                    f"(batch size {stats.get('batch_size')}, concurrency {stats.get('max_concurrency')})")
         logger.info("Vector store creation completed successfully!")
         return True
     else:
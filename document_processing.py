@@ -0,0 +1,194 @@
+"""
+PDF parsing and chunking for the Insurance Chatbot application
+
+The functions here run inside worker processes, so this module only imports
+what parsing needs.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Files with more pages than this are split into page ranges parsed in parallel
+PAGES_PER_TASK = 25
+
+# Parser pools by worker count, kept for the life of the process
+_parser_pools = {}
+_parser_pools_lock = threading.Lock()
+
+
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Create the splitter used for all policy documents"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        # Lets neighbouring chunks retrieved together be merged back into one passage
+        add_start_index=True,
+    )
+
+
+def parse_pdf_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> List[Document]:
+    """Extract and split a range of PDF pages
+
+    Produces the same chunks as PyPDFLoader followed by split_documents: one
+    document per page with source/page metadata, split page by page.
+    """
+    reader = PdfReader(file_path)
+    end = len(reader.pages) if end is None else min(end, len(reader.pages))
+
+    pages = [
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": file_path, "page": page})
+        for page in range(start, end)
+    ]
+    return create_text_splitter().split_documents(pages)
+
+
+def get_page_ranges(file_path: str, pages_per_task: int = PAGES_PER_TASK) -> List[Tuple[int, int]]:
+    """Split a PDF into page ranges of at most pages_per_task pages"""
+    page_count = len(PdfReader(file_path).pages)
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    # A PDF without pages still produces one (empty) segment so callers see it finish
+    return ranges or [(0, 0)]
+
+
+def _iter_parse_tasks(file_paths: Iterable[str], pages_per_task: int) -> Iterator[Tuple[str, int, int, bool, Optional[str]]]:
+    """Lazily plan (file_path, start, end, is_last, error) tasks across files"""
+    for file_path in file_paths:
+        try:
+            ranges = get_page_ranges(file_path, pages_per_task)
+        except Exception as e:
+            yield file_path, 0, 0, True, str(e)
+            continue
+
+        for i, (start, end) in enumerate(ranges):
+            yield file_path, start, end, i == len(ranges) - 1, None
+
+
+def _get_mp_context():
+    """Start workers from a clean server process rather than forking the (threaded) caller"""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # Workers inherit the parsing imports from the server instead of each loading them
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def get_parser_pool(jobs: int) -> ProcessPoolExecutor:
+    """Get the shared pool of `jobs` parser processes, starting it on first use"""
+    with _parser_pools_lock:
+        pool = _parser_pools.get(jobs)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=jobs, mp_context=_get_mp_context())
+            _parser_pools[jobs] = pool
+        return pool
+
+
+def _discard_parser_pool(jobs: int, pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next call starts a new one"""
+    with _parser_pools_lock:
+        if _parser_pools.get(jobs) is pool:
+            del _parser_pools[jobs]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_parsed_segments(file_paths: Iterable[str], jobs: Optional[int] = None,
+                         pages_per_task: int = PAGES_PER_TASK) -> Iterator[Tuple[str, List[Document], int, bool, Optional[str]]]:
+    """Parse and split PDFs page range by page range
+
+    Yields (file_path, chunks, pages, is_last, error) segments of at most
+    pages_per_task pages, in file and page order. A file's last segment has
+    is_last set; after a failed segment the file's remaining pages are skipped
+    and the error segment is its last. With jobs > 1 the ranges are parsed in
+    a process pool with at most two tasks per worker in flight, so memory use
+    is bounded by the window rather than by document size.
+
+    The pool is shared by all calls and lives as long as the process. Its
+    workers come from a forkserver (spawn where that is unavailable), not
+    from forking the caller: that is usually a multi-threaded server holding
+    locks, SQLite connections and a loaded index, none of which a child
+    should inherit. Both start methods import the caller's __main__ once in
+    each worker, so scripts that call this must keep their work behind an
+    `if __name__ == "__main__":` guard.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    tasks = _iter_parse_tasks(file_paths, pages_per_task)
+
+    if jobs <= 1:
+        failed_file = None
+        for file_path, start, end, is_last, error in tasks:
+            if file_path == failed_file:
+                continue
+            if error is None:
+                try:
+                    chunks = parse_pdf_pages(file_path, start, end)
+                except Exception as e:
+                    error = str(e)
+            if error is not None:
+                failed_file = file_path
+                yield file_path, [], 0, True, error
+            else:
+                yield file_path, chunks, end - start, is_last, None
+        return
+
+    executor = get_parser_pool(jobs)
+    pending = deque()
+    try:
+        exhausted = False
+        failed_file = None
+
+        while True:
+            while not exhausted and len(pending) < jobs * 2:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                file_path, start, end, is_last, error = task
+                future = None
+                if error is None:
+                    try:
+                        future = executor.submit(parse_pdf_pages, file_path, start, end)
+                    except BrokenProcessPool as e:
+                        _discard_parser_pool(jobs, executor)
+                        error = str(e)
+                pending.append((file_path, future, end - start, is_last, error))
+
+            if not pending:
+                break
+
+            file_path, future, pages, is_last, error = pending.popleft()
+            if file_path == failed_file:
+                if future is not None:
+                    future.cancel()
+                continue
+
+            if error is None:
+                try:
+                    chunks = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died; later ranges fail too and the next call gets a new pool
+                    _discard_parser_pool(jobs, executor)
+                    error = str(e)
+                except Exception as e:
+                    error = str(e)
+
+            if error is not None:
+                failed_file = file_path
+                yield file_path, [], 0, True, error
+            else:
+                yield file_path, chunks, pages, is_last, None
+    finally:
+        # Stopped early (failure or the caller closed us): don't leave work queued on the shared pool
+        for _, future, _, _, _ in pending:
+            if future is not None:
+                future.cancel()
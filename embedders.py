@@ -0,0 +1,104 @@
+"""
+Embedding backends for the vector store: OpenAI or a local CPU embedder
+"""
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+OPENAI = "openai"
+LOCAL = "local"
+EMBEDDING_BACKENDS = (OPENAI, LOCAL)
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+LOCAL_EMBEDDING_DIMENSION = 768
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+@lru_cache(maxsize=100000)
+def hash_feature(feature: str, dimension: int) -> Tuple[int, float]:
+    """Stable (bucket, sign) of a feature; Python's hash() is salted per process"""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimension, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """Local CPU embedder using signed feature hashing of words and word bigrams.
+
+    Needs no network and no model files. Each text's features are weighted
+    by sublinear term frequency (1 + log tf), hashed into `dimension` buckets
+    with a random sign so collisions cancel out on average, and L2-normalized.
+    Texts that share wording land close together, so it works well for the
+    keyword-heavy language of policy documents but doesn't match paraphrases
+    the way a neural model does. Vectors don't depend on the corpus, so
+    adding documents never changes existing embeddings.
+    """
+
+    def __init__(self, dimension: int = LOCAL_EMBEDDING_DIMENSION, ngrams: int = 2):
+        self.dimension = dimension
+        self.ngrams = ngrams
+        self.model = f"local-hashing-{ngrams}gram-{dimension}"
+
+    def _get_features(self, text: str) -> Counter:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = Counter(tokens)
+        for n in range(2, self.ngrams + 1):
+            features.update(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return features
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts into a (len(texts), dimension) float32 array"""
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, count in self._get_features(text).items():
+                bucket, sign = hash_feature(feature, self.dimension)
+                rows.append(row)
+                columns.append(bucket)
+                values.append(sign * (1.0 + math.log(count)))
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)),
+                  np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # CPU-only and fast, so there's nothing to gain from an executor
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+def create_embeddings(backend: str = OPENAI, api_key: Optional[str] = None) -> Embeddings:
+    """Create the embeddings for a backend"""
+    if backend == OPENAI:
+        # Imported here so a local-only deployment doesn't need the OpenAI client configured
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(openai_api_key=api_key, model=OPENAI_EMBEDDING_MODEL)
+    if backend == LOCAL:
+        return HashingEmbeddings(int(os.getenv("LOCAL_EMBEDDING_DIMENSION", str(LOCAL_EMBEDDING_DIMENSION))))
+    raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def get_embedder_name(embeddings: Embeddings) -> str:
+    """Name identifying the model behind some embeddings (vectors from different names don't mix)"""
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+def get_embedder_info(embeddings: Embeddings, dimension: int) -> Dict[str, Any]:
+    """Description of an embedder to record with a vector store"""
+    return {"model": get_embedder_name(embeddings), "dimension": dimension}
@@ -0,0 +1,241 @@
+"""
+Persistent embedding cache for the Insurance Chatbot application
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different queries share a cache entry"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """Text -> vector cache keyed by embedding model.
+
+    Recently used vectors are kept as float32 arrays in an in-memory LRU.
+    Every entry is also written to a SQLite database so the cache survives
+    restarts and is shared by all processes (API workers, Streamlit sessions)
+    using the same file.
+
+    Reads never write: disk hits are noted in memory and their last-used
+    times written out in batches (with the next write, or every
+    touch_batch_size hits), so the on-disk LRU order is approximate. The
+    row count is kept up to date by triggers, so bounding the table never
+    counts it.
+    """
+
+    def __init__(self, db_path: str = "models/embedding_cache.sqlite3", max_memory_entries: int = 1024,
+                 max_disk_entries: int = 50000, table: str = "embeddings", touch_batch_size: int = 100):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.table = table
+        self.touch_batch_size = touch_batch_size
+        self._memory = OrderedDict()
+        # (model, key) -> last time it was read from disk, not yet written back
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts_since_eviction = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._open_database()
+
+    def _open_database(self):
+        """Open the on-disk store, falling back to memory-only caching on failure"""
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            # WAL lets several processes read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (model, key))"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)"
+            )
+            self._conn.commit()
+            self._create_row_count()
+        except sqlite3.Error:
+            self._conn = None
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Get a cached vector, or None on a miss"""
+        return self.get_by_key(model, normalize_text(text))
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Store a vector for a text"""
+        self.put_by_key(model, normalize_text(text), vector)
+
+    def get_by_key(self, model: str, key: str) -> Optional[List[float]]:
+        """Get a cached vector by its exact key"""
+        with self._lock:
+            memory_key = (model, key)
+            if memory_key in self._memory:
+                self._memory.move_to_end(memory_key)
+                self.hits += 1
+                return self._memory[memory_key].tolist()
+
+            vector = self._read_from_disk(model, key)
+            if vector is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self._remember(memory_key, vector)
+            self._touched[memory_key] = time.time()
+            if len(self._touched) >= self.touch_batch_size:
+                self._flush_touches()
+                self._commit()
+            return vector.tolist()
+
+    def put_by_key(self, model: str, key: str, vector: List[float]):
+        """Store a vector under an exact key"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember((model, key), vector)
+            self._write_to_disk(model, key, vector)
+
+    def _remember(self, memory_key, vector: np.ndarray):
+        """Insert into the in-memory LRU, evicting the least recently used entry"""
+        self._memory[memory_key] = vector
+        self._memory.move_to_end(memory_key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_from_disk(self, model: str, key: str) -> Optional[np.ndarray]:
+        """Read a vector from the on-disk store"""
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute(
+                f"SELECT vector FROM {self.table} WHERE model = ? AND key = ?", (model, key)
+            ).fetchone()
+            if row is None:
+                return None
+            return np.frombuffer(row[0], dtype=np.float32)
+        except sqlite3.Error:
+            return None
+
+    def _write_to_disk(self, model: str, key: str, vector: np.ndarray):
+        """Write a vector to the on-disk store and keep it within its size bound"""
+        if self._conn is None:
+            return
+        try:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete would skip the row count trigger
+            self._conn.execute(
+                f"INSERT INTO {self.table} (model, key, vector, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (model, key) DO UPDATE SET vector = excluded.vector, last_used = excluded.last_used",
+                (model, key, vector.tobytes(), time.time())
+            )
+            self._flush_touches()
+            self._puts_since_eviction += 1
+            # Evict in batches, so deletes are amortised over many writes
+            if self._puts_since_eviction >= 100:
+                self._evict_from_disk()
+                self._puts_since_eviction = 0
+            self._conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def _evict_from_disk(self):
+        """Drop the least recently used rows beyond max_disk_entries"""
+        count = self._get_row_count()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"(SELECT rowid FROM {self.table} ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+
+    def _create_row_count(self):
+        """Keep the table's row count in a one-row table maintained by triggers"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_size (entries INTEGER NOT NULL)")
+            if self._conn.execute(f"SELECT 1 FROM {self.table}_size").fetchone() is None:
+                # Only caches written before the count existed pay for this scan, once
+                self._conn.execute(f"INSERT INTO {self.table}_size SELECT COUNT(*) FROM {self.table}")
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self.table}_inserted AFTER INSERT ON {self.table} "
+                f"BEGIN UPDATE {self.table}_size SET entries = entries + 1; END"
+            )
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self.table}_deleted AFTER DELETE ON {self.table} "
+                f"BEGIN UPDATE {self.table}_size SET entries = entries - 1; END"
+            )
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+
+    def _get_row_count(self) -> int:
+        return self._conn.execute(f"SELECT entries FROM {self.table}_size").fetchone()[0]
+
+    def _flush_touches(self):
+        """Write pending last-used times of disk hits; the caller commits"""
+        if not self._touched or self._conn is None:
+            return
+        touched, self._touched = self._touched, {}
+        try:
+            self._conn.executemany(
+                f"UPDATE {self.table} SET last_used = ? WHERE model = ? AND key = ?",
+                [(last_used, model, key) for (model, key), last_used in touched.items()]
+            )
+        except sqlite3.Error:
+            # Only LRU order is lost
+            pass
+
+    def _commit(self):
+        try:
+            self._conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        """Remove all cached vectors from memory and disk"""
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute(f"DELETE FROM {self.table}")
+                    self._conn.commit()
+                except sqlite3.Error:
+                    pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and cache sizes"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            disk_entries = None
+            if self._conn is not None:
+                try:
+                    disk_entries = self._get_row_count()
+                except sqlite3.Error:
+                    pass
+            return {
+                "memory_hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "max_memory_entries": self.max_memory_entries,
+                "disk_entries": disk_entries,
+                "max_disk_entries": self.max_disk_entries,
+                "persistent": self._conn is not None
+            }
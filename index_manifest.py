@@ -0,0 +1,109 @@
+"""
+Per-document manifest for the FAISS vector store
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Any, List, Optional, Set
+
+
+def hash_file(file_path: str) -> str:
+    """Hash a file's contents without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_document_key(file_path: str) -> str:
+    """Key a document by its normalized path"""
+    return os.path.normpath(file_path)
+
+
+class IndexManifest:
+    """Tracks which chunks each source document contributed to the index.
+
+    For every document the manifest stores its content hash, mtime, size and
+    the content addresses of its chunks, so a revised document can have its
+    old chunks replaced without rebuilding the whole index. Chunks that are
+    deleted are tombstoned (hidden from search) until the index is compacted.
+    It also records the embedder (model name and dimension) the index was
+    built with, so queries are never embedded with a different one.
+    """
+
+    FILENAME = "manifest.json"
+
+    def __init__(self, documents: Optional[Dict[str, Dict[str, Any]]] = None, tombstones: Optional[Set[str]] = None,
+                 embedder: Optional[Dict[str, Any]] = None):
+        self.documents = documents or {}
+        self.tombstones = tombstones or set()
+        # None for indexes written before embedders were recorded
+        self.embedder = embedder
+
+    @classmethod
+    def load(cls, directory: str, filename: str = FILENAME) -> Optional["IndexManifest"]:
+        """Load the manifest stored next to an index, or None if there is none"""
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("documents", {}), set(data.get("tombstones", [])), data.get("embedder"))
+
+    def save(self, directory: str, filename: str = FILENAME):
+        """Write the manifest next to an index"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "tombstones": sorted(self.tombstones),
+            "embedder": self.embedder
+        }
+
+    def get_document(self, file_path: str) -> Optional[Dict[str, Any]]:
+        return self.documents.get(get_document_key(file_path))
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """Check whether a document is indexed with exactly its current contents"""
+        entry = self.get_document(file_path)
+        if entry is None:
+            return False
+
+        stat = os.stat(file_path)
+        # mtime and size match: trust it without hashing the file
+        if entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+            return True
+
+        if entry.get("content_hash") == hash_file(file_path):
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            return True
+
+        return False
+
+    def set_document(self, file_path: str, chunk_ids: List[str], content_hash: Optional[str] = None):
+        """Record the chunks a document currently contributes"""
+        stat = os.stat(file_path)
+        self.documents[get_document_key(file_path)] = {
+            "source": file_path,
+            "content_hash": content_hash or hash_file(file_path),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "chunk_ids": chunk_ids
+        }
+
+    def remove_document(self, file_path: str) -> Optional[Dict[str, Any]]:
+        return self.documents.pop(get_document_key(file_path), None)
+
+    def get_referenced_chunk_ids(self, exclude_key: Optional[str] = None) -> Set[str]:
+        """Get every chunk id still referenced by a document"""
+        referenced = set()
+        for key, entry in self.documents.items():
+            if key != exclude_key:
+                referenced.update(entry["chunk_ids"])
+        return referenced
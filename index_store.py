@@ -0,0 +1,459 @@
+"""
+Crash-safe persistence for the FAISS vector store
+"""
+import base64
+import json
+import os
+import pickle
+import re
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from chunk_store import ChunkStore
+from index_manifest import IndexManifest
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process writer lock
+    fcntl = None
+
+# Directories whose writer lock is held by an IndexStore in this process
+_locked_directories = set()
+_locked_directories_lock = threading.Lock()
+
+# Take a new snapshot once the log holds this fraction of the snapshot's vectors
+SNAPSHOT_LOG_RATIO = 0.5
+SNAPSHOT_MIN_LOGGED_VECTORS = 1000
+GENERATION_FILE = re.compile(r"^(index|manifest|log)\.\d+\.")
+# Map the index file instead of reading it into the heap; IO_FLAG_MMAP_IFC covers flat indexes
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+
+def fsync_path(path: str):
+    """Flush a file (or directory, where supported) to stable storage"""
+    if os.path.isdir(path):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    else:
+        fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def has_vectorstore(directory: str) -> bool:
+    """Check whether a directory holds a saved vector store"""
+    return (os.path.exists(os.path.join(directory, IndexStore.CURRENT))
+            or os.path.exists(os.path.join(directory, "index.faiss")))
+
+
+class IndexStore:
+    """Snapshot + append-only log persistence for a FAISS vector store.
+
+    A snapshot is a generation-numbered set of files: index.<n>.faiss, the
+    chunk id of every vector position in index.<n>.ids and manifest.<n>.json.
+    Chunk texts and metadata live in the ChunkStore (chunks.sqlite3), which
+    all generations share. A snapshot only becomes current once the
+    CURRENT pointer file is atomically replaced, so a crash mid-write leaves
+    the previous snapshot intact. Changes made after a snapshot are appended
+    to log.<n>.jsonl as they happen and sealed by a commit record on flush;
+    loading replays committed records and ignores anything after the last
+    commit. A flush therefore costs time in proportion to what changed, and
+    the log is folded into a new snapshot once it grows large relative to it
+    or when the index was compacted.
+
+    Directories written before snapshots existed (a plain index.faiss,
+    index.pkl and manifest.json), and snapshots with a pickled docstore
+    (index.<n>.pkl), are still loaded; their chunks are moved into the chunk
+    store and the next flush replaces them with a new snapshot.
+
+    With mmap=True the snapshot's index file is memory-mapped read-only, so
+    processes serving queries share it through the OS page cache instead of
+    each holding a copy. Vectors replayed from the log are kept in a small
+    in-memory shard searched alongside it. Such a store can't be written to;
+    load it again without mmap first.
+
+    Only one writer at a time may change a directory. The first change
+    after a flush takes an exclusive lock on its LOCK file, held until the
+    next flush (or close or load), so a batch of changes is written as a
+    unit; another writer - a process or a second IndexStore in this one -
+    fails straight away instead of interleaving its log records and
+    snapshots with it. A store whose loaded state is older than what
+    another writer has since flushed must be loaded again before writing;
+    is_stale() tells.
+    """
+
+    CURRENT = "CURRENT"
+    CHUNKS_FILENAME = "chunks.sqlite3"
+    LOCK_FILENAME = "LOCK"
+    LEGACY_FILES = ("index.faiss", "index.pkl", IndexManifest.FILENAME)
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._chunks = None
+        self.generation = None
+        self.snapshot_vectors = 0
+        self.logged_vectors = 0
+        # Byte offset just past the last commit record of the current log
+        self._committed_offset = 0
+        self._log = None
+        self._needs_snapshot = False
+        self._dirty = False
+        self.read_only = False
+        # (mapped index, in-memory index) shards of a read-only store with logged vectors
+        self._shards = None
+        self._lock = threading.Lock()
+        # Open LOCK file while this process holds the writer lock
+        self._writer_lock = None
+        # Whether load() has read this directory; a store that hasn't is being built from scratch
+        self._loaded = False
+
+    def load(self, embeddings, mmap: bool = False) -> Tuple[FAISS, Optional[IndexManifest]]:
+        """Load the current snapshot and replay its log
+
+        The manifest is None for directories written before manifests existed.
+        """
+        with self._lock:
+            self._close_log()
+            # What gets loaded may have been written by another process since
+            self._release_writer_lock()
+            self.read_only = mmap
+            self._shards = None
+            self._loaded = True
+            current = self._read_current()
+            if current is None:
+                vectorstore, migrated = self._load_snapshot(embeddings, "index", mmap)
+                self.generation = None
+                self.snapshot_vectors = vectorstore.index.ntotal
+                self.logged_vectors = 0
+                self._committed_offset = 0
+                self._needs_snapshot = migrated
+                self._dirty = migrated
+                return vectorstore, IndexManifest.load(self.directory)
+
+            self.generation = current["generation"]
+            vectorstore, migrated = self._load_snapshot(embeddings, f"index.{self.generation}", mmap)
+            manifest = IndexManifest.load(self.directory, f"manifest.{self.generation}.json") or IndexManifest()
+            self.snapshot_vectors = vectorstore.index.ntotal
+            self.logged_vectors = 0
+            self._committed_offset = self._replay(vectorstore, manifest)
+            self._needs_snapshot = migrated
+            self._dirty = migrated
+            return vectorstore, manifest
+
+    @property
+    def chunks(self) -> ChunkStore:
+        """The on-disk chunk store, opened on first use"""
+        if self._chunks is None:
+            self._chunks = ChunkStore(os.path.join(self.directory, self.CHUNKS_FILENAME))
+        return self._chunks
+
+    def new_vectorstore(self, embeddings, dimension: int) -> FAISS:
+        """Create an empty vector store backed by the chunk store"""
+        return FAISS(embeddings, faiss.IndexFlatL2(dimension), self.chunks, {})
+
+    def append(self, record: Dict[str, Any]):
+        """Log a change; it becomes durable on the next flush"""
+        with self._lock:
+            self._check_writable()
+            self._dirty = True
+            if self.generation is None or self._needs_snapshot:
+                # The next flush writes a full snapshot anyway
+                return
+            self._write_record(record)
+
+    def append_vectors(self, ids: List[str], vectors: List[List[float]]):
+        """Log vectors added to the index; their chunks are already in the chunk store"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.append({
+            "op": "add",
+            "ids": ids,
+            "dim": int(vectors.shape[1]),
+            "vectors": base64.b64encode(vectors.tobytes()).decode("ascii")
+        })
+        with self._lock:
+            self.logged_vectors += len(ids)
+
+    def require_snapshot(self):
+        """Mark the log unusable (e.g. vector positions changed) until the next snapshot"""
+        with self._lock:
+            # Nothing is written until the flush, which takes the writer lock
+            if self.read_only:
+                raise RuntimeError("Vector store was loaded read-only (memory-mapped)")
+            self._needs_snapshot = True
+            self._dirty = True
+
+    def flush(self, vectorstore: FAISS, manifest: IndexManifest, snapshot: bool = False):
+        """Make every change so far durable
+
+        Seals the log with a commit record, or writes a new snapshot when one
+        is required, forced, or the log has grown large.
+        """
+        with self._lock:
+            if vectorstore is None or not (self._dirty or snapshot):
+                self._release_writer_lock()
+                return
+            self._check_writable()
+
+            log_limit = max(SNAPSHOT_MIN_LOGGED_VECTORS, self.snapshot_vectors * SNAPSHOT_LOG_RATIO)
+            if snapshot or self._needs_snapshot or self.generation is None or self.logged_vectors > log_limit:
+                self._write_snapshot(vectorstore, manifest)
+            else:
+                self._write_record({"op": "commit"})
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._committed_offset = self._log.tell()
+            self._dirty = False
+            # Other writers may go ahead now; our log handle would be stale once they have
+            self._close_log()
+            self._release_writer_lock()
+
+    def is_stale(self) -> bool:
+        """Check whether another writer has flushed changes since this store was loaded"""
+        with self._lock:
+            return self._writer_lock is None and self._loaded and self._changed_on_disk()
+
+    def close(self):
+        """Close the log and give up the writer lock"""
+        with self._lock:
+            self._close_log()
+            self._release_writer_lock()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("Vector store was loaded read-only (memory-mapped)")
+        self._acquire_writer_lock()
+
+    def _acquire_writer_lock(self):
+        """Take the directory's writer lock, failing fast if another writer holds it"""
+        if self._writer_lock is not None or fcntl is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, self.LOCK_FILENAME), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            with _locked_directories_lock:
+                holder = "this process" if os.path.realpath(self.directory) in _locked_directories else "another process"
+            raise RuntimeError(
+                f"Vector store {self.directory} is being written by another writer in {holder}; try again once it has finished"
+            )
+        if self._loaded and self._changed_on_disk():
+            # Another writer flushed after this store was loaded; its changes would be overwritten
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            lock_file.close()
+            raise RuntimeError(
+                f"Vector store {self.directory} was changed by another writer; load it again before writing"
+            )
+        self._writer_lock = lock_file
+        with _locked_directories_lock:
+            _locked_directories.add(os.path.realpath(self.directory))
+
+    def _release_writer_lock(self):
+        if self._writer_lock is not None:
+            with _locked_directories_lock:
+                _locked_directories.discard(os.path.realpath(self.directory))
+            fcntl.flock(self._writer_lock.fileno(), fcntl.LOCK_UN)
+            self._writer_lock.close()
+            self._writer_lock = None
+
+    def _changed_on_disk(self) -> bool:
+        """Check for a newer snapshot or log commits past what was loaded"""
+        current = self._read_current()
+        if current is None or self.generation is None:
+            # A directory loaded without a snapshot has changed once another writer took one
+            return current is not None or self.generation is not None
+        if current["generation"] != self.generation:
+            return True
+        path = self._log_path()
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            f.seek(self._committed_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    if json.loads(line)["op"] == "commit":
+                        return True
+                except ValueError:
+                    break
+        return False
+
+    def _load_snapshot(self, embeddings, index_name: str, mmap: bool) -> Tuple[FAISS, bool]:
+        """Read a snapshot's index and chunk ids, mapping the index file if requested
+
+        Returns the vector store and whether a pickled docstore was moved into
+        the chunk store (which calls for a new snapshot).
+        """
+        index = self._read_index(os.path.join(self.directory, f"{index_name}.faiss"), mmap)
+
+        ids_path = os.path.join(self.directory, f"{index_name}.ids")
+        if os.path.exists(ids_path):
+            with open(ids_path, "r", encoding="utf-8") as f:
+                index_to_docstore_id = dict(enumerate(json.load(f)))
+            return FAISS(embeddings, index, self.chunks, index_to_docstore_id), False
+
+        with open(os.path.join(self.directory, f"{index_name}.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        if mmap:
+            # Read-only: serve from the unpickled docstore until a writer migrates it
+            return FAISS(embeddings, index, docstore, index_to_docstore_id), False
+
+        self.chunks.add(dict(docstore._dict))
+        return FAISS(embeddings, index, self.chunks, index_to_docstore_id), True
+
+    @staticmethod
+    def _read_index(path: str, mmap: bool):
+        if not mmap:
+            return faiss.read_index(path)
+        try:
+            return faiss.read_index(path, MMAP_FLAGS)
+        except RuntimeError:
+            # IVF lists can only be mapped through IO_FLAG_MMAP on its own
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+    def _add_vectors(self, vectorstore: FAISS, record: Dict[str, Any]):
+        """Add logged vectors to a loaded snapshot"""
+        vectors = np.frombuffer(base64.b64decode(record["vectors"]), dtype=np.float32)
+        vectors = vectors.reshape(-1, record["dim"])
+        if "texts" in record:
+            # Logged before chunks had their own store
+            vectorstore.docstore.add({
+                chunk_id: Document(page_content=text, metadata=metadata)
+                for chunk_id, text, metadata in zip(record["ids"], record["texts"], record["metadatas"])
+            })
+
+        start = vectorstore.index.ntotal
+        if not self.read_only:
+            vectorstore.index.add(vectors)
+            vectorstore.index_to_docstore_id.update({start + i: chunk_id for i, chunk_id in enumerate(record["ids"])})
+            return
+
+        # Adding to a mapped index is not allowed, so search an in-memory shard after it
+        if self._shards is None:
+            mapped = vectorstore.index
+            self._shards = (mapped, faiss.IndexFlat(mapped.d, mapped.metric_type))
+            vectorstore.index = faiss.IndexShards(mapped.d, False, True)
+            for shard in self._shards:
+                vectorstore.index.add_shard(shard)
+
+        self._shards[1].add(vectors)
+        vectorstore.index.syncWithSubIndexes()
+        vectorstore.index_to_docstore_id.update({start + i: chunk_id for i, chunk_id in enumerate(record["ids"])})
+
+    def _write_snapshot(self, vectorstore: FAISS, manifest: IndexManifest):
+        os.makedirs(self.directory, exist_ok=True)
+        current = self._read_current() if self.generation is None else None
+        # A store built from scratch over an existing one must not reuse its generation (or replay its log)
+        generation = max(self.generation or 0, current["generation"] if current else 0) + 1
+        index_name = f"index.{generation}"
+
+        # Nothing refers to these files until CURRENT is swapped
+        faiss.write_index(vectorstore.index, os.path.join(self.directory, f"{index_name}.faiss"))
+        with open(os.path.join(self.directory, f"{index_name}.ids"), "w", encoding="utf-8") as f:
+            json.dump([vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)], f)
+        manifest.save(self.directory, f"manifest.{generation}.json")
+        for name in (f"{index_name}.faiss", f"{index_name}.ids", f"manifest.{generation}.json"):
+            fsync_path(os.path.join(self.directory, name))
+
+        current_path = os.path.join(self.directory, self.CURRENT)
+        with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "vectors": vectorstore.index.ntotal}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_path + ".tmp", current_path)
+        fsync_path(self.directory)
+
+        self._close_log()
+        self.generation = generation
+        self.snapshot_vectors = vectorstore.index.ntotal
+        self.logged_vectors = 0
+        self._committed_offset = 0
+        self._needs_snapshot = False
+        self._remove_stale_files()
+        # Chunks compacted away are no longer referenced by any snapshot
+        self.chunks.purge()
+
+    def _remove_stale_files(self):
+        """Delete files of older generations and of the pre-snapshot layout"""
+        keep = {f"index.{self.generation}.faiss", f"index.{self.generation}.ids",
+                f"manifest.{self.generation}.json", f"log.{self.generation}.jsonl", self.CURRENT}
+        for name in os.listdir(self.directory):
+            stale = name in self.LEGACY_FILES or GENERATION_FILE.match(name) is not None
+            if stale and name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _read_current(self) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.directory, self.CURRENT)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, f"log.{self.generation}.jsonl")
+
+    def _write_record(self, record: Dict[str, Any]):
+        if self._log is None:
+            # Drop any uncommitted tail left by a crashed writer before appending
+            self._log = open(self._log_path(), "ab")
+            self._log.truncate(self._committed_offset)
+            self._log.seek(self._committed_offset)
+        self._log.write(json.dumps(record).encode("utf-8") + b"\n")
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _replay(self, vectorstore: FAISS, manifest: IndexManifest) -> int:
+        """Apply committed log records; returns the offset after the last commit"""
+        path = self._log_path()
+        if not os.path.exists(path):
+            return 0
+
+        committed_offset = 0
+        pending = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash - nothing after it was committed
+                    break
+                if record["op"] != "commit":
+                    pending.append(record)
+                    continue
+                for pending_record in pending:
+                    self._apply(vectorstore, manifest, pending_record)
+                pending = []
+                committed_offset = f.tell()
+        return committed_offset
+
+    def _apply(self, vectorstore: FAISS, manifest: IndexManifest, record: Dict[str, Any]):
+        op = record["op"]
+        if op == "add":
+            self._add_vectors(vectorstore, record)
+            self.logged_vectors += len(record["ids"])
+        elif op == "tombstone":
+            manifest.tombstones.update(record["ids"])
+        elif op == "revive":
+            manifest.tombstones.difference_update(record["ids"])
+        elif op == "document":
+            manifest.documents[record["key"]] = record["entry"]
+        elif op == "remove_document":
+            manifest.documents.pop(record["key"], None)
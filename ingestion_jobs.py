@@ -0,0 +1,144 @@
+"""
+Background ingestion jobs for the Insurance Chatbot API
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class IngestionJobQueue:
+    """In-process queue that loads policy documents outside the request cycle.
+
+    Jobs are run one at a time by a background worker thread, since they all
+    write to the same vector store; each job still parses its PDFs in a
+    process pool. Progress (pages and chunks indexed) is updated as page
+    ranges are embedded. Finished jobs are kept for lookup up to
+    max_finished_jobs, oldest dropped first.
+    """
+
+    def __init__(self, jobs: Optional[int] = None, max_finished_jobs: int = 1000):
+        self.jobs = jobs
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._events = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, chatbot, file_paths: List[str]) -> str:
+        """Queue documents for loading and return the job id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": QUEUED,
+                "files": list(file_paths),
+                "pages_processed": 0,
+                "chunks_processed": 0,
+                "documents": [],
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None
+            }
+            self._events[job_id] = threading.Event()
+            self._ensure_worker()
+        self._queue.put((job_id, chatbot))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a snapshot of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Get snapshots of all known jobs, oldest first"""
+        with self._lock:
+            return [self._snapshot(job) for job in self._jobs.values()]
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a job finishes (or the timeout passes) and return it"""
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get(job_id)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job_id, chatbot = self._queue.get()
+            try:
+                self._process(job_id, chatbot)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job_id: str, chatbot):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+            file_paths = list(job["files"])
+
+        # Running (pages, chunks) totals per document
+        progress = {}
+
+        def on_progress(file_path: str, pages: int, chunks: int):
+            with self._lock:
+                progress[file_path] = (pages, chunks)
+                job["pages_processed"] = sum(p for p, _ in progress.values())
+                job["chunks_processed"] = sum(c for _, c in progress.values())
+
+        try:
+            for file_path, success, message in chatbot.load_policy_documents(
+                    file_paths, jobs=self.jobs, progress_callback=on_progress):
+                chunks = progress.get(file_path, (0, 0))[1]
+                if success and not chunks:
+                    # Skipped as unchanged - report what the index already holds
+                    chunks = chatbot.get_document_chunk_count(file_path) or 0
+                with self._lock:
+                    job["documents"].append({
+                        "file": file_path,
+                        "success": success,
+                        "message": message,
+                        "chunks": chunks if success else 0
+                    })
+        except Exception as e:
+            with self._lock:
+                job["error"] = str(e)
+
+        with self._lock:
+            job["chunks_processed"] = sum(document["chunks"] for document in job["documents"])
+            failed = job["error"] is not None or not all(document["success"] for document in job["documents"])
+            job["status"] = FAILED if failed else COMPLETED
+            job["finished_at"] = time.time()
+            self._events.pop(job_id).set()
+            self._prune()
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond max_finished_jobs"""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (COMPLETED, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+        snapshot = dict(job)
+        snapshot["files"] = list(job["files"])
+        snapshot["documents"] = [dict(document) for document in job["documents"]]
+        return snapshot
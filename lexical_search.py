@@ -0,0 +1,67 @@
+"""
+Keyword (BM25) retrieval helpers: query terms, match expressions and fusion with vector scores
+"""
+import re
+from typing import List, Tuple
+
+import faiss
+
+VECTOR = "vector"
+HYBRID = "hybrid"
+RETRIEVAL_MODES = (VECTOR, HYBRID)
+
+# Question words and fillers that carry no keyword signal
+STOPWORDS = frozenset("""
+a about am an and any are as at be been but by can could did do does for from had has have how i if in
+into is it its me my no not of on or our please should so than that the their them then there these
+they this to under us was we were what when where which while who why will with would you your
+""".split())
+
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
+
+def get_query_terms(query: str) -> List[str]:
+    """Get the distinct keywords of a query, in order, without stopwords"""
+    terms = []
+    for term in TERM_PATTERN.findall(query.lower()):
+        if term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def get_match_expression(terms: List[str], match_all: bool = False) -> str:
+    """FTS5 match expression for chunks containing any (or all) of the terms"""
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    return (" AND " if match_all else " OR ").join(quoted)
+
+
+def normalize_scores(candidates: List[Tuple[str, float]], higher_is_better: bool = True) -> dict:
+    """Min-max scale (id, score) candidates to 0..1, with 1 the best"""
+    if not candidates:
+        return {}
+    scores = [score for _, score in candidates]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {candidate_id: 1.0 for candidate_id, _ in candidates}
+    if higher_is_better:
+        return {candidate_id: (score - low) / (high - low) for candidate_id, score in candidates}
+    return {candidate_id: (high - score) / (high - low) for candidate_id, score in candidates}
+
+
+def fuse_scores(vector_candidates: List[Tuple[str, float]], lexical_candidates: List[Tuple[str, float]],
+                vector_weight: float = 0.5, metric: int = faiss.METRIC_L2) -> List[Tuple[str, float]]:
+    """Combine vector and BM25 candidates into one ranking, best first
+
+    Each list is scaled to 0..1 and the scores are mixed as
+    vector_weight * vector + (1 - vector_weight) * lexical; a chunk missing
+    from one list scores 0 there.
+    """
+    vector_scores = normalize_scores(vector_candidates, higher_is_better=metric == faiss.METRIC_INNER_PRODUCT)
+    lexical_scores = normalize_scores(lexical_candidates)
+
+    fused = {}
+    for candidate_id in list(vector_scores) + [candidate_id for candidate_id in lexical_scores
+                                               if candidate_id not in vector_scores]:
+        fused[candidate_id] = (vector_weight * vector_scores.get(candidate_id, 0.0)
+                               + (1 - vector_weight) * lexical_scores.get(candidate_id, 0.0))
+    return sorted(fused.items(), key=lambda candidate: candidate[1], reverse=True)
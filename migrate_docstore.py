@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Script to move the pickled FAISS docstore (index.pkl) into the on-disk chunk store
+Chunk texts and metadata are copied into models/faiss_index/chunks.sqlite3 and a new snapshot
+is written that only stores chunk ids next to the index; the vectors are not re-embedded
+"""
+
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+from rag_system import InsuranceRAGSystem, VECTORSTORE_DIR
+from index_store import IndexStore, has_vectorstore
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Move the pickled docstore of a FAISS vector store into the chunk store")
+    parser.add_argument("--directory", default=VECTORSTORE_DIR,
+                        help=f"Vector store directory (default: {VECTORSTORE_DIR})")
+    return parser.parse_args()
+
+def get_size(path):
+    """Get a file's size in bytes, or 0 if it doesn't exist"""
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def main(args=None):
+    """Main function to migrate the docstore of an existing vector store"""
+    if args is None:
+        args = parse_args()
+
+    load_dotenv()
+
+    if not has_vectorstore(args.directory):
+        print(f"❌ Error: No vector store found in {args.directory}")
+        return False
+
+    pickled = [f for f in os.listdir(args.directory) if f.endswith(".pkl")]
+    if not pickled:
+        print("✅ Vector store already uses the chunk store - nothing to migrate")
+        return True
+    pickled_bytes = sum(get_size(os.path.join(args.directory, f)) for f in pickled)
+
+    print(f"🚀 Migrating {', '.join(pickled)} ({pickled_bytes / 1e6:.1f} MB)...")
+
+    try:
+        # No embedding calls are made, so any key will do
+        rag_system = InsuranceRAGSystem(os.getenv("OPENAI_API_KEY") or "unused", mmap_index=False)
+        rag_system.store = IndexStore(args.directory)
+
+        success, message = rag_system.load_vectorstore()
+        if not success:
+            print(f"❌ Error: {message}")
+            return False
+
+        rag_system.save_vectorstore(snapshot=True)
+    except Exception as e:
+        print(f"❌ Error migrating vector store: {str(e)}")
+        return False
+
+    chunks_path = os.path.join(args.directory, IndexStore.CHUNKS_FILENAME)
+    print(f"✅ Moved {len(rag_system.store.chunks)} chunks into {chunks_path} ({get_size(chunks_path) / 1e6:.1f} MB)")
+    print(f"📊 Snapshot generation {rag_system.store.generation} with {rag_system.vectorstore.index.ntotal} vectors")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,238 @@
+"""
+Process-wide, pooled LLM provider clients shared by every LLMHandler
+"""
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+
+MODEL_NAMES = {
+    "openai": "gpt-3.5-turbo",
+    "anthropic": "claude-3-sonnet-20240229",
+    "google": "gemini-pro"
+}
+
+# Hosts the HTTP providers' SDKs talk to, used to open connections ahead of the first request
+BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com"
+}
+
+
+class ProviderClientRegistry:
+    """One set of clients per (provider, API key), shared across handlers and requests.
+
+    OpenAI and Anthropic clients run on httpx clients with a bounded
+    keep-alive connection pool (max_connections, max_keepalive_connections,
+    keepalive_expiry) and connect/request timeouts, so requests reuse warm
+    TLS connections instead of every handler opening its own. warm() builds
+    the clients and opens a connection before any request needs it.
+
+    The Gemini SDK keeps its own gRPC channel and is configured per process,
+    so Google has a single set of clients and the pool settings don't apply.
+
+    A provider's SDK is imported only when its clients are first created, so
+    a process never pays to import SDKs for providers it doesn't use.
+
+    API keys come from callers, so at most max_clients sets of clients are
+    kept; the least recently used set is dropped and its connection pools
+    closed to make room. Get clients from the registry for each request
+    rather than holding on to them, so a dropped set is rebuilt on demand.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60, connect_timeout: float = 5, request_timeout: float = 60,
+                 max_retries: int = 2, max_clients: int = 100):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.max_clients = max_clients
+        # (provider, api_key) -> {"client": ..., "async_client": ..., "http_client": ..., "async_http_client": ...},
+        # least recently used first
+        self._clients = OrderedDict()
+        # Async pools of dropped clients, closed from the next event loop that comes by
+        self._retired = []
+        self._closing = set()
+        self.evicted = 0
+        self._google_api_key = None
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, api_key: str) -> Dict[str, Any]:
+        """Get the shared clients for a provider and API key, creating them on first use"""
+        key = self._get_key(provider, api_key)
+        with self._lock:
+            if provider == "google" and api_key != self._google_api_key:
+                import google.generativeai as genai
+                # As before the registry, the most recently used key is the one Gemini calls go out with
+                genai.configure(api_key=api_key)
+                self._google_api_key = api_key
+            clients = self._clients.get(key)
+            if clients is None:
+                clients = self._create_clients(provider, api_key)
+                self._clients[key] = clients
+                self._evict()
+            else:
+                self._clients.move_to_end(key)
+        self._close_retired()
+        return clients
+
+    def warm(self, provider: str, api_key: str) -> bool:
+        """Create a provider's clients and open a connection to it; returns whether the connection opened
+
+        Any HTTP response counts, since the point is only to have a TLS
+        connection waiting in the pool.
+        """
+        clients = self.get(provider, api_key)
+        try:
+            if provider == "google":
+                import google.generativeai as genai
+                genai.get_model(f"models/{MODEL_NAMES['google']}")
+            else:
+                clients["http_client"].head(BASE_URLS[provider])
+            return True
+        except Exception:
+            return False
+
+    async def awarm(self, provider: str, api_key: str) -> bool:
+        """Open a connection in a provider's async pool, from the event loop that will use it"""
+        clients = self.get(provider, api_key)
+        if clients.get("async_http_client") is None:
+            return False
+        try:
+            await clients["async_http_client"].head(BASE_URLS[provider])
+            return True
+        except Exception:
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Describe the registered clients and pool settings (API keys are not included)"""
+        with self._lock:
+            providers = [provider for provider, _ in self._clients]
+        return {
+            "clients": len(providers),
+            "max_clients": self.max_clients,
+            "evicted": self.evicted,
+            "providers": sorted(set(providers)),
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connect_timeout": self.timeout.connect,
+            "request_timeout": self.timeout.read
+        }
+
+    def close(self):
+        """Close the sync connection pools (async pools are closed with aclose())"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), OrderedDict()
+        for entry in clients:
+            if entry.get("http_client") is not None:
+                entry["http_client"].close()
+
+    async def aclose(self):
+        """Close every connection pool"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), OrderedDict()
+            retired, self._retired = self._retired, []
+        for async_http_client in retired:
+            await async_http_client.aclose()
+        for entry in clients:
+            if entry.get("http_client") is not None:
+                entry["http_client"].close()
+            if entry.get("async_http_client") is not None:
+                await entry["async_http_client"].aclose()
+
+    def _evict(self):
+        """Drop least recently used clients over max_clients, closing their pools (lock held)"""
+        while len(self._clients) > self.max_clients:
+            _, entry = self._clients.popitem(last=False)
+            self.evicted += 1
+            if entry.get("http_client") is not None:
+                entry["http_client"].close()
+            if entry.get("async_http_client") is not None:
+                self._retired.append(entry["async_http_client"])
+
+    def _close_retired(self):
+        """Close dropped async pools if called from an event loop; otherwise a later call will"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for async_http_client in retired:
+            task = loop.create_task(async_http_client.aclose())
+            # Keep a reference until the task is done so it isn't garbage collected mid-close
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _get_key(self, provider: str, api_key: str) -> Tuple[str, Optional[str]]:
+        # genai.configure() is process-wide, so one Google client serves every key
+        return (provider, None) if provider == "google" else (provider, api_key)
+
+    def _create_clients(self, provider: str, api_key: str) -> Dict[str, Any]:
+        if provider == "openai":
+            import openai
+            from langchain_openai import ChatOpenAI
+            http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            async_http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            client_params = {"api_key": api_key, "timeout": self.timeout, "max_retries": self.max_retries}
+            # langchain-openai would hand one http_client to both its sync and async clients, so build them here
+            client = ChatOpenAI(
+                openai_api_key=api_key,
+                model_name=MODEL_NAMES["openai"],
+                temperature=0.7,
+                client=openai.OpenAI(http_client=http_client, **client_params).chat.completions,
+                async_client=openai.AsyncOpenAI(http_client=async_http_client, **client_params).chat.completions
+            )
+            return {"client": client, "async_client": None,
+                    "http_client": http_client, "async_http_client": async_http_client}
+        if provider == "anthropic":
+            import anthropic
+            http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            async_http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            return {
+                "client": anthropic.Anthropic(api_key=api_key, http_client=http_client,
+                                              timeout=self.timeout, max_retries=self.max_retries),
+                "async_client": anthropic.AsyncAnthropic(api_key=api_key, http_client=async_http_client,
+                                                         timeout=self.timeout, max_retries=self.max_retries),
+                "http_client": http_client,
+                "async_http_client": async_http_client
+            }
+        if provider == "google":
+            import google.generativeai as genai
+            return {"client": genai.GenerativeModel(MODEL_NAMES["google"]), "async_client": None,
+                    "http_client": None, "async_http_client": None}
+        raise ValueError(f"Unsupported provider '{provider}'")
+
+
+def create_client_registry() -> ProviderClientRegistry:
+    """Create a client registry configured from the environment"""
+    return ProviderClientRegistry(
+        max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY_SECONDS", "60")),
+        connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5")),
+        request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        max_clients=int(os.getenv("LLM_MAX_CLIENTS", "100"))
+    )
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> ProviderClientRegistry:
+    """The process-wide client registry, configured from the environment on first use"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = create_client_registry()
+        return _registry
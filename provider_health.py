@@ -0,0 +1,377 @@
+"""
+Process-wide health of LLM providers: circuit breakers, recent latencies and the routing scores built on them
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Kinds of failed calls
+PROVIDER_FAILURE = "provider"  # the provider is down, overloaded or unreachable
+CREDENTIALS_FAILURE = "credentials"  # the API key was refused
+REQUEST_FAILURE = "request"  # the request itself is at fault; another provider won't do better
+
+# Statuses the provider answers with when it can't serve anyone right now (server errors aside)
+PROVIDER_FAILURE_STATUSES = {408, 409, 429}
+CREDENTIALS_STATUSES = {401, 403}
+# SDK errors raised without a response; matched by class name so the SDKs needn't be imported
+TRANSPORT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of a failed provider call, if the provider answered"""
+    # openai/anthropic errors have status_code, google.api_core errors have code
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: BaseException) -> str:
+    """Whether a failed call points at the provider, the API key or the request"""
+    status = get_status_code(error)
+    if status is not None:
+        if status in CREDENTIALS_STATUSES:
+            return CREDENTIALS_FAILURE
+        if status >= 500 or status in PROVIDER_FAILURE_STATUSES:
+            return PROVIDER_FAILURE
+        return REQUEST_FAILURE
+    if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return PROVIDER_FAILURE
+    if any(cls.__name__ in TRANSPORT_ERROR_NAMES for cls in type(error).__mro__):
+        return PROVIDER_FAILURE
+    return REQUEST_FAILURE
+
+
+class CircuitBreaker:
+    """Stops calls to a failing provider and lets a few probes through once it may have recovered.
+
+    After failure_threshold consecutive provider failures the circuit opens
+    and requests are refused. recovery_timeout seconds later it turns half
+    open: up to half_open_max_calls probe requests go through, the first
+    success closes the circuit again and a failure reopens it for another
+    recovery_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update(time.monotonic())
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go out now; a True from a half-open circuit uses up a probe"""
+        with self._lock:
+            self._update(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probes = 0
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._open()
+
+    def release(self):
+        """Finish a call that says nothing about the provider's health (a bad request, a cancelled hedge)"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._update(time.monotonic())
+            stats = {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened
+            }
+            if self._state == OPEN:
+                stats["retry_in_seconds"] = max(0.0, self._opened_at + self.recovery_timeout - time.monotonic())
+            return stats
+
+    def _open(self):
+        """Open the circuit (lock held)"""
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self.opened += 1
+
+    def _update(self, now: float):
+        """Turn an open circuit half open once the recovery timeout has passed (lock held)"""
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+
+class ProviderHealth:
+    """A provider's circuit breaker and how it has been performing lately.
+
+    Keeps the latencies of recent blocking responses (for hedging
+    percentiles) and exponentially weighted moving averages (weight
+    ewma_alpha on the newest sample) of blocking response latency, streamed
+    response latency, time to first streamed token and error rate. The error rate also halves every
+    error_half_life seconds without calls, so a provider that failed a
+    while ago and was avoided since gets a fresh chance.
+    """
+
+    def __init__(self, provider: str, breaker: CircuitBreaker, latency_window: int = 100,
+                 ewma_alpha: float = 0.2, error_half_life: float = 300):
+        self.provider = provider
+        self.breaker = breaker
+        self.ewma_alpha = ewma_alpha
+        self.error_half_life = error_half_life
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        # None until measured
+        self.ewma_latency = None
+        self.ewma_stream_latency = None
+        self.ewma_ttft = None
+        self._error_rate = 0.0
+        self._error_updated = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._get_error_rate(time.monotonic())
+
+    def allow_request(self) -> bool:
+        return self.breaker.allow_request()
+
+    def record_success(self, latency: Optional[float] = None):
+        """Record a successful blocking call and how long it took"""
+        with self._lock:
+            self.successes += 1
+            self._update_error_rate(0.0)
+            if latency is not None:
+                self._latencies.append(latency)
+                self.ewma_latency = self._ewma(self.ewma_latency, latency)
+        self.breaker.record_success()
+
+    def record_first_token(self, seconds: float):
+        """Record how long a stream took to produce its first token"""
+        with self._lock:
+            self.ewma_ttft = self._ewma(self.ewma_ttft, seconds)
+
+    def record_stream_success(self, latency: float):
+        """Record a completed stream and how long it took in all"""
+        with self._lock:
+            self.successes += 1
+            self._update_error_rate(0.0)
+            self.ewma_stream_latency = self._ewma(self.ewma_stream_latency, latency)
+        self.breaker.record_success()
+
+    def record_error(self, error: BaseException) -> str:
+        """Record a failed call; only provider failures count against the circuit. Returns the error's kind"""
+        kind = classify_error(error)
+        if kind == PROVIDER_FAILURE:
+            with self._lock:
+                self.failures += 1
+                self._update_error_rate(1.0)
+            self.breaker.record_failure()
+        else:
+            # A refused key belongs to one caller, not to the provider every session shares
+            self.breaker.release()
+        return kind
+
+    def release(self):
+        self.breaker.release()
+
+    def get_latency_percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """Latency below which `percentile` percent of recent responses came back, or None with too few samples"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = min(len(latencies) - 1, max(0, int(round(percentile / 100 * len(latencies))) - 1))
+        return latencies[index]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.breaker.get_stats()
+        stats.update({
+            "successes": self.successes,
+            "failures": self.failures,
+            "error_rate": self.error_rate,
+            "ewma_latency": self.ewma_latency,
+            "ewma_stream_latency": self.ewma_stream_latency,
+            "ewma_ttft": self.ewma_ttft,
+            "latency_p50": self.get_latency_percentile(50),
+            "latency_p95": self.get_latency_percentile(95)
+        })
+        return stats
+
+    def _ewma(self, average: Optional[float], sample: float) -> float:
+        return sample if average is None else average + self.ewma_alpha * (sample - average)
+
+    def _get_error_rate(self, now: float) -> float:
+        """Error rate decayed for the time since the last call (lock held)"""
+        if self.error_half_life <= 0:
+            return self._error_rate
+        return self._error_rate * 0.5 ** ((now - self._error_updated) / self.error_half_life)
+
+    def _update_error_rate(self, sample: float):
+        """Fold a call's outcome (1 failed, 0 succeeded) into the error rate (lock held)"""
+        now = time.monotonic()
+        self._error_rate = self._ewma(self._get_error_rate(now), sample)
+        self._error_updated = now
+
+
+class ProviderHealthRegistry:
+    """One ProviderHealth per provider, shared by every handler in the process.
+
+    Health is tracked per provider rather than per API key: an outage hits
+    every key alike, so all sessions learn about it from the first few
+    failures. Refused keys are the exception and never open a circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1,
+                 latency_window: int = 100, ewma_alpha: float = 0.2, error_half_life: float = 300):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.latency_window = latency_window
+        self.ewma_alpha = ewma_alpha
+        self.error_half_life = error_half_life
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> ProviderHealth:
+        """Get a provider's health, starting with a closed circuit on first use"""
+        with self._lock:
+            health = self._providers.get(provider)
+            if health is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.recovery_timeout, self.half_open_max_calls)
+                health = ProviderHealth(provider, breaker, self.latency_window, self.ewma_alpha, self.error_half_life)
+                self._providers[provider] = health
+            return health
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = dict(self._providers)
+        return {provider: health.get_stats() for provider, health in sorted(providers.items())}
+
+
+def create_provider_health() -> ProviderHealthRegistry:
+    """Create a provider health registry configured from the environment"""
+    return ProviderHealthRegistry(
+        failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+        recovery_timeout=float(os.getenv("LLM_CIRCUIT_RECOVERY_SECONDS", "30")),
+        half_open_max_calls=int(os.getenv("LLM_CIRCUIT_HALF_OPEN_MAX_CALLS", "1")),
+        latency_window=int(os.getenv("LLM_LATENCY_WINDOW", "100")),
+        ewma_alpha=float(os.getenv("LLM_EWMA_ALPHA", "0.2")),
+        error_half_life=float(os.getenv("LLM_ERROR_RATE_HALF_LIFE_SECONDS", "300"))
+    )
+
+
+class ProviderRouter:
+    """Orders providers by how well they are doing right now, best first.
+
+    Latencies are only compared between calls of the same kind. Blocking
+    requests score
+        latency_weight * EWMA latency + error_weight * error rate
+    and streamed ones
+        ttft_weight * EWMA time to first token + latency_weight * EWMA stream latency
+        + error_weight * error rate
+    in seconds, lower is better. A provider without a measurement for the
+    kind of call takes the mean of the providers that have one, so it
+    neither jumps the queue nor gets starved. The current provider keeps
+    its place unless another scores better by more than the stickiness
+    fraction, so routing doesn't flap between providers within noise of
+    each other.
+    """
+
+    def __init__(self, health: ProviderHealthRegistry, latency_weight: float = 1.0, ttft_weight: float = 1.0,
+                 error_weight: float = 10.0, stickiness: float = 0.2):
+        self.health = health
+        self.latency_weight = latency_weight
+        self.ttft_weight = ttft_weight
+        self.error_weight = error_weight
+        self.stickiness = stickiness
+
+    def get_scores(self, providers: List[str], streaming: bool = False) -> Dict[str, float]:
+        """Routing score of each provider for a blocking or a streamed request"""
+        healths = {provider: self.health.get(provider) for provider in providers}
+        if streaming:
+            parts = [("ttft", self.ttft_weight), ("stream_latency", self.latency_weight)]
+        else:
+            parts = [("latency", self.latency_weight)]
+
+        scores = {provider: self.error_weight * health.error_rate for provider, health in healths.items()}
+        for name, weight in parts:
+            measured = {provider: getattr(health, f"ewma_{name}") for provider, health in healths.items()}
+            known = [value for value in measured.values() if value is not None]
+            prior = sum(known) / len(known) if known else 0.0
+            for provider, value in measured.items():
+                scores[provider] += weight * (prior if value is None else value)
+        return scores
+
+    def rank(self, providers: List[str], current: Optional[str] = None, streaming: bool = False) -> List[str]:
+        """Providers best first (ties keep their given order), the current one first unless clearly beaten"""
+        scores = self.get_scores(providers, streaming)
+        ranked = sorted(providers, key=lambda provider: scores[provider])
+        if current in scores and ranked[0] != current and scores[ranked[0]] >= scores[current] * (1 - self.stickiness):
+            ranked.remove(current)
+            ranked.insert(0, current)
+        return ranked
+
+
+_health = None
+_health_lock = threading.Lock()
+
+
+def get_provider_health() -> ProviderHealthRegistry:
+    """The process-wide provider health registry, configured from the environment on first use"""
+    global _health
+    with _health_lock:
+        if _health is None:
+            _health = create_provider_health()
+        return _health
+
+
+def create_provider_router(health: Optional[ProviderHealthRegistry] = None) -> ProviderRouter:
+    """Create a router over the process-wide provider health, weighted from the environment"""
+    return ProviderRouter(
+        health or get_provider_health(),
+        latency_weight=float(os.getenv("LLM_ROUTING_LATENCY_WEIGHT", "1")),
+        ttft_weight=float(os.getenv("LLM_ROUTING_TTFT_WEIGHT", "1")),
+        error_weight=float(os.getenv("LLM_ROUTING_ERROR_WEIGHT", "10")),
+        stickiness=float(os.getenv("LLM_ROUTING_STICKINESS", "0.2"))
+    )
+
+
+def is_routing_enabled() -> bool:
+    """Whether requests are routed by score (LLM_ROUTING); off, the requested provider is always tried first"""
+    return os.getenv("LLM_ROUTING", "false").lower() == "true"
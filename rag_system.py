@@ -1,125 +1,1141 @@
 import os
-import pickle
+import sys
+import time
+import logging
+import random
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+import faiss
 import numpy as np
-from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader
-import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Tuple, Iterable, Iterator, Union
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from embedding_cache import EmbeddingCache
+from embedders import OPENAI, OPENAI_EMBEDDING_MODEL, create_embeddings, get_embedder_info, get_embedder_name
+from index_store import IndexStore, has_vectorstore
+from chunk_store import ChunkStore
+from vector_index import (AUTO, ANN_THRESHOLD, FLAT, FLOAT32, build_index, configure_search, get_index_encoding,
+                          get_index_type, get_memory_usage, is_lossy, needs_rebuild, reconstruct_vectors,
+                          rerank, select_encoding, select_index_type)
+from lexical_search import HYBRID, VECTOR, RETRIEVAL_MODES, fuse_scores, get_match_expression, get_query_terms
+from index_manifest import IndexManifest, hash_file, get_document_key
+from document_processing import create_text_splitter, iter_parsed_segments
+from context_packing import DEFAULT_TOKEN_BUDGETS, get_token_budget, pack_context
+
+logger = logging.getLogger(__name__)
+
+# Chunk ids stay keyed by the original model name whichever embedder is configured
+EMBEDDING_MODEL = OPENAI_EMBEDDING_MODEL
+VECTORSTORE_DIR = "models/faiss_index"
+# Compact automatically once this fraction of the index is tombstoned
+COMPACTION_THRESHOLD = 0.25
+# Vector and keyword candidates fetched per result before fusing them in hybrid retrieval
+HYBRID_CANDIDATE_FACTOR = 4
+
+def get_chunk_id(content: str, model: str = EMBEDDING_MODEL) -> str:
+    """Content address of a chunk: the same text embedded by the same model gets the same id"""
+    return hashlib.sha256(f"{model}\0{content}".encode("utf-8")).hexdigest()
+
+def is_retryable_embedding_error(error: Exception) -> bool:
+    """Check whether an embedding request failed with a rate limit, server or connection error"""
+    # The OpenAI SDK is only imported once OpenAI embeddings are used; before that no error can come from it
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+class EmbeddingPipeline:
+    """Embeds chunk texts in fixed-size batches with bounded concurrency.
+    
+    Rate limit (429), 5xx and connection errors are retried with exponential
+    backoff and full jitter. Throughput counters are kept across calls.
+    """
+    
+    def __init__(self, embeddings, batch_size: int = 100, max_concurrency: int = 4, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self.chunks_embedded = 0
+        self.batches = 0
+        self.retries = 0
+        self.seconds = 0.0
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, returning vectors in input order"""
+        if not texts:
+            return []
+        
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        start = time.perf_counter()
+        
+        if len(batches) == 1 or self.max_concurrency == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        
+        with self._lock:
+            self.chunks_embedded += len(texts)
+            self.batches += len(batches)
+            self.seconds += time.perf_counter() - start
+        
+        return [vector for batch_vectors in results for vector in batch_vectors]
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch, retrying transient failures"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(batch)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable_embedding_error(e):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get throughput statistics"""
+        with self._lock:
+            return {
+                "chunks_embedded": self.chunks_embedded,
+                "batches": self.batches,
+                "retries": self.retries,
+                "seconds": round(self.seconds, 3),
+                "chunks_per_second": round(self.chunks_embedded / self.seconds, 2) if self.seconds else 0.0,
+                "batch_size": self.batch_size,
+                "max_concurrency": self.max_concurrency
+            }
+
 
 class InsuranceRAGSystem:
-    def __init__(self, api_key: str, provider: str = "openai"):
+    def __init__(self, api_key: str, provider: str = "openai", embedding_batch_size: Optional[int] = None,
+                 embedding_concurrency: Optional[int] = None, mmap_index: Optional[bool] = None,
+                 index_type: Optional[str] = None, encoding: Optional[str] = None,
+                 retrieval_mode: Optional[str] = None, embedding_backend: Optional[str] = None,
+                 embedding_api_key: Optional[str] = None):
         self.api_key = api_key
         self.provider = provider
+        # OpenAI key for embeddings, when it shouldn't be derived from the LLM provider's key
+        self.embedding_api_key = embedding_api_key
+        self.embedding_batch_size = embedding_batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+        self.embedding_concurrency = embedding_concurrency or int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+        # Memory-map the saved index read-only so processes share it; it's reloaded into memory before any write
+        self.mmap_index = mmap_index if mmap_index is not None else os.getenv("VECTORSTORE_MMAP", "false").lower() == "true"
+        # flat (exact), ivf or hnsw (approximate); auto switches to ivf once the corpus reaches ann_threshold
+        self.index_type = index_type or os.getenv("VECTORSTORE_INDEX_TYPE", AUTO)
+        self.ann_threshold = int(os.getenv("VECTORSTORE_ANN_THRESHOLD", str(ANN_THRESHOLD)))
+        self.nprobe = int(os.getenv("VECTORSTORE_NPROBE", "16"))
+        self.ef_search = int(os.getenv("VECTORSTORE_EF_SEARCH", "64"))
+        # float32, or a compressed float16 / sq8 / pq encoding that re-ranks from full-precision vectors on disk
+        self.encoding = encoding or os.getenv("VECTORSTORE_ENCODING", FLOAT32)
+        self.rerank = os.getenv("VECTORSTORE_RERANK", "true").lower() == "true"
+        self.rerank_factor = int(os.getenv("VECTORSTORE_RERANK_FACTOR", "4"))
+        # vector, or hybrid (opt-in): BM25 keyword scores fused with vector scores
+        self.retrieval_mode = retrieval_mode or os.getenv("RETRIEVAL_MODE", VECTOR)
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{self.retrieval_mode}', expected one of {', '.join(RETRIEVAL_MODES)}")
+        self.hybrid_vector_weight = float(os.getenv("HYBRID_VECTOR_WEIGHT", "0.5"))
+        # Short keyword queries that keyword search answers confidently skip the embedding call (opt-in)
+        self.lexical_fast_path = os.getenv("LEXICAL_FAST_PATH", "false").lower() == "true"
+        self.lexical_max_terms = int(os.getenv("LEXICAL_MAX_TERMS", "3"))
+        self.lexical_max_match_ratio = float(os.getenv("LEXICAL_MAX_MATCH_RATIO", "0.1"))
+        # Context for the LLM: up to context_max_chunks results, cut at a relevance gap, merged and fit to a token budget
+        self.context_max_chunks = int(os.getenv("CONTEXT_MAX_CHUNKS", "8"))
+        self.context_score_gap = float(os.getenv("CONTEXT_SCORE_GAP", "0.2"))
+        self.context_token_budgets = {
+            provider: int(os.getenv(f"CONTEXT_TOKEN_BUDGET_{provider.upper()}", str(budget)))
+            for provider, budget in DEFAULT_TOKEN_BUDGETS.items()
+        }
+        # openai, or local (CPU-only, no network); the vector store records which one built it
+        self.embedding_backend = embedding_backend or os.getenv("EMBEDDING_BACKEND", OPENAI)
         self.embeddings = None
+        self.embedding_pipeline = None
+        # Set when the saved vector store was built with a different embedder
+        self.embedder_error = None
         self.vectorstore = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        # Bumped whenever the vector store contents change so dependent caches can invalidate
+        self.index_version = 0
+        self.embedding_cache = EmbeddingCache("models/embedding_cache.sqlite3")
+        # Chunk vectors are kept by content address so re-ingested text is never embedded twice
+        self.chunk_embedding_cache = EmbeddingCache(
+            "models/embedding_cache.sqlite3",
+            max_memory_entries=256,
+            max_disk_entries=1000000,
+            table="chunk_embeddings"
         )
+        # Content addresses of every live (not tombstoned) chunk in the vector store
+        self.chunk_ids = set()
+        self.manifest = IndexManifest()
+        # Background ingestion adds to the FAISS index while queries search it
+        self.index_lock = threading.RLock()
+        self.store = IndexStore(VECTORSTORE_DIR)
+        # Saves are deferred while inside batch()
+        self._batch_depth = 0
+        self.text_splitter = create_text_splitter()
         
     def initialize_embeddings(self):
-        """Initialize embeddings based on provider"""
-        if self.provider == "openai":
-            self.embeddings = OpenAIEmbeddings(
-                openai_api_key=self.api_key,
-                model="text-embedding-ada-002"
-            )
-        else:
-            # For other providers, we'll use OpenAI as fallback
-            self.embeddings = OpenAIEmbeddings(
-                openai_api_key=self.api_key,
-                model="text-embedding-ada-002"
+        """Initialize embeddings for the configured embedding backend"""
+        # The API key belongs to the LLM provider; OpenAI embeddings need an OpenAI key
+        api_key = self.embedding_api_key or (
+            self.api_key if self.provider == "openai" else os.getenv("OPENAI_API_KEY") or self.api_key
+        )
+        self.embeddings = create_embeddings(self.embedding_backend, api_key)
+    
+    def set_embedding_api_key(self, api_key: str):
+        """Embed with another OpenAI key from now on, keeping the loaded vector store"""
+        if api_key == self.embedding_api_key:
+            return
+        self.embedding_api_key = api_key
+        if self.embeddings is not None:
+            self.initialize_embeddings()
+    
+    def get_embedding_model(self) -> str:
+        """Name of the model the configured embeddings use"""
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        return get_embedder_name(self.embeddings)
+    
+    def _check_embedder(self, vectorstore, manifest: IndexManifest):
+        """Make sure the configured embeddings are the ones a vector store was built with
+        
+        Stores saved before embedders were recorded were built with OpenAI
+        ada-002. Raises ValueError on a mismatch.
+        """
+        dimension = vectorstore.index.d
+        recorded = manifest.embedder or {"model": OPENAI_EMBEDDING_MODEL, "dimension": dimension}
+        model = self.get_embedding_model()
+        embedding_dimension = getattr(self.embeddings, "dimension", None) or dimension
+        if recorded["model"] != model or recorded["dimension"] != embedding_dimension:
+            raise ValueError(
+                f"Vector store was built with embedder {recorded['model']} ({recorded['dimension']} dimensions) "
+                f"but {model} is configured - set EMBEDDING_BACKEND to match or rebuild it with create_vectorstore.py"
             )
     
     def load_policy_document(self, file_path: str):
-        """Load and process insurance policy document"""
-        try:
-            if not os.path.exists(file_path):
-                return False, f"File not found: {file_path}"
-            if not file_path.lower().endswith('.pdf'):
-                return False, "Only PDF files are supported"
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
-            
-            if not documents:
-                return False, "No content found in PDF file - the PDF may be image-based or corrupted"
-
-            texts = self.text_splitter.split_documents(documents)
+        """Load and process insurance policy document
+        
+        Unchanged documents are skipped. A revised document has its old chunks
+        replaced, so the cost is proportional to that document only.
+        """
+        # Consume the whole generator so the vector store gets saved; a failed save is reported last
+        results = list(self.load_policy_documents([file_path], jobs=1))
+        _, success, message = results[-1]
+        return success, message
+    
+    def load_policy_documents(self, file_paths: Iterable[str], jobs: Optional[int] = None,
+                              progress_callback: Optional[Callable[[str, int, int], None]] = None) -> Iterator[Tuple[str, bool, str]]:
+        """Load several policy documents, parsing them in a process pool
+        
+        Yields (file_path, success, message) per document. Missing, invalid and
+        unchanged documents are reported first; the rest are reported in input
+        order. Documents stream through page ranges -> chunks -> embedding
+        batches -> index adds, so peak memory does not grow with document size
+        and embedding one range overlaps with parsing the next. The vector store
+        is saved once at the end; if that fails, the documents loaded by this
+        call are reported again, as failed. Errors are always reported this
+        way rather than raised.
+        
+        progress_callback, if given, is called as (file_path, pages, chunks)
+        with the running totals for a document after each indexed page range.
+        """
+        to_parse = []
+        content_hashes = {}
+        for file_path in file_paths:
+            try:
+                if not os.path.exists(file_path):
+                    yield file_path, False, f"File not found: {file_path}"
+                elif not file_path.lower().endswith('.pdf'):
+                    yield file_path, False, "Only PDF files are supported"
+                elif self.manifest.is_unchanged(file_path):
+                    yield file_path, True, "Document already indexed and unchanged"
+                else:
+                    content_hashes[file_path] = hash_file(file_path)
+                    to_parse.append(file_path)
+            except Exception as e:
+                yield file_path, False, f"Error loading document: {str(e)}"
+        
+        if to_parse:
+            try:
+                self._ensure_writable()
+            except Exception as e:
+                for file_path in to_parse:
+                    yield file_path, False, f"Error loading document: {str(e)}"
+                return
+        
+        loaded = []
+        changed = False
+        progress = None
+        for file_path, texts, pages, is_last, error in iter_parsed_segments(to_parse, jobs=jobs):
+            if progress is None:
+                progress = {"chunk_ids": {}, "added_ids": [], "pages": 0, "chunks": 0, "added": 0, "error": None}
             
-            if not texts:
-                return False, "No text chunks could be extracted from the document - try a different PDF or check if it's text-based"
+            if progress["error"] is None:
+                if error is not None:
+                    progress["error"] = error
+                else:
+                    try:
+                        self._index_segment(progress, texts)
+                        progress["pages"] += pages
+                        if progress_callback is not None:
+                            progress_callback(file_path, progress["pages"], progress["chunks"])
+                    except Exception as e:
+                        progress["error"] = str(e)
             
-            if self.embeddings is None:
-                self.initialize_embeddings()
+            if not is_last:
+                continue
             
-            if self.vectorstore is None:
-                self.vectorstore = FAISS.from_documents(texts, self.embeddings)
+            if progress["error"] is not None:
+                # Don't leave chunks of a half-loaded document searchable
+                changed = self._discard_chunks(progress["added_ids"]) or changed
+                yield file_path, False, f"Error loading document: {progress['error']}"
+            elif not progress["chunks"]:
+                yield file_path, False, "No text chunks could be extracted from the document - try a different PDF or check if it's text-based"
             else:
-                self.vectorstore.add_documents(texts)
+                try:
+                    removed = self._replace_document_chunks(file_path, list(progress["chunk_ids"]), content_hashes[file_path])
+                except Exception as e:
+                    changed = self._discard_chunks(progress["added_ids"]) or changed
+                    yield file_path, False, f"Error loading document: {str(e)}"
+                    progress = None
+                    continue
+                changed = True
+                loaded.append(file_path)
+                yield file_path, True, f"Successfully loaded and processed {progress['chunks']} document chunks ({progress['added']} new, {progress['chunks'] - progress['added']} already indexed, {removed} removed)"
+            progress = None
+        
+        if to_parse:
+            try:
+                if changed:
+                    self._compact_if_needed()
+                # Also ends the write when nothing changed, releasing the store's writer lock
+                self.save_vectorstore()
+            except Exception as e:
+                for file_path in loaded:
+                    yield file_path, False, f"Error saving vector store: {str(e)}"
+    
+    def _index_segment(self, progress: Dict[str, Any], texts: List[Document]):
+        """Embed and index one page range of a document, updating its progress"""
+        chunk_ids = [get_chunk_id(text.page_content) for text in texts]
+        # Recorded up front so a failure part-way through can still be rolled back
+        progress["added_ids"].extend(chunk_id for chunk_id in dict.fromkeys(chunk_ids) if chunk_id not in self.chunk_ids)
+        progress["chunk_ids"].update(dict.fromkeys(chunk_ids))
+        
+        # One slice keeps every concurrent embedding request busy
+        step = self.embedding_batch_size * self.embedding_concurrency
+        for start in range(0, len(texts), step):
+            progress["added"] += self.add_chunks(texts[start:start + step])
+        
+        progress["chunks"] += len(texts)
+    
+    def _discard_chunks(self, chunk_ids: List[str]) -> bool:
+        """Tombstone chunks that no indexed document references"""
+        stale_ids = set(chunk_ids) & self.chunk_ids - self.manifest.get_referenced_chunk_ids()
+        self._tombstone_chunks(stale_ids)
+        return bool(stale_ids)
+    
+    def delete_policy_document(self, file_path: str):
+        """Remove a policy document's chunks from the vector store"""
+        try:
+            self._ensure_writable()
+            if self.manifest.get_document(file_path) is None:
+                return False, f"Document is not indexed: {file_path}"
+            # Logged first, so a failed write leaves the document indexed rather than half removed
+            self.store.append({"op": "remove_document", "key": get_document_key(file_path)})
+            entry = self.manifest.remove_document(file_path)
             
-            self.save_vectorstore()
+            # Chunks shared with other documents stay searchable
+            stale_ids = set(entry["chunk_ids"]) - self.manifest.get_referenced_chunk_ids()
+            self._tombstone_chunks(stale_ids)
+            self._compact_if_needed()
             
-            return True, f"Successfully loaded and processed {len(texts)} document chunks"
+            self.save_vectorstore()
             
+            return True, f"Removed {len(stale_ids)} document chunks from the index"
         except Exception as e:
-            return False, f"Error loading document: {str(e)}"
+            return False, f"Error deleting document: {str(e)}"
+    
+    def compact_vectorstore(self):
+        """Physically remove tombstoned vectors from the index"""
+        try:
+            self._ensure_writable()
+            reclaimed = self._compact()
+            if reclaimed:
+                self.save_vectorstore()
+            return True, f"Compacted vector store - reclaimed {reclaimed} vectors"
+        except Exception as e:
+            return False, f"Error compacting vector store: {str(e)}"
+    
+    def add_chunks(self, chunks: List[Document]) -> int:
+        """Embed and index chunks that are not already in the vector store
+        
+        Returns the number of chunks added. Chunks whose content address is
+        already indexed (or repeated within the batch) are skipped.
+        """
+        self._ensure_writable()
+        if self.embedder_error:
+            # Don't mix vectors into (or overwrite) a store built with another embedder
+            raise RuntimeError(self.embedder_error)
+        if self.vectorstore is not None:
+            self._check_embedder(self.vectorstore, self.manifest)
+        new_chunks, new_ids = [], []
+        revived_ids = []
+        for chunk in chunks:
+            chunk_id = get_chunk_id(chunk.page_content)
+            if chunk_id in self.chunk_ids:
+                continue
+            self.chunk_ids.add(chunk_id)
+            if chunk_id in self.manifest.tombstones:
+                # Deleted but not compacted yet - the vector is still in the index
+                self.manifest.tombstones.discard(chunk_id)
+                revived_ids.append(chunk_id)
+                continue
+            new_chunks.append(chunk)
+            new_ids.append(chunk_id)
+        
+        if revived_ids:
+            self.store.append({"op": "revive", "ids": revived_ids})
+            self.index_version += 1
+        
+        if not new_chunks:
+            return len(revived_ids)
+        
+        try:
+            vectors = self._embed_chunks(new_ids, [chunk.page_content for chunk in new_chunks])
+            text_embeddings = list(zip([chunk.page_content for chunk in new_chunks], vectors))
+            metadatas = [chunk.metadata for chunk in new_chunks]
+            
+            with self.index_lock:
+                if self.vectorstore is None:
+                    self.vectorstore = self.store.new_vectorstore(self.embeddings, len(vectors[0]))
+                    self.manifest.embedder = get_embedder_info(self.embeddings, len(vectors[0]))
+                self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=new_ids)
+            if self.encoding != FLOAT32:
+                # The index only keeps approximations; exact vectors are needed to re-rank and rebuild
+                self.store.chunks.put_vectors(new_ids, vectors)
+        except Exception:
+            self.chunk_ids.difference_update(new_ids)
+            raise
+        
+        self.store.append_vectors(new_ids, vectors)
+        self.index_version += 1
+        return len(new_chunks) + len(revived_ids)
+    
+    def _embed_chunks(self, chunk_ids: List[str], texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts, reusing previously computed vectors by content address"""
+        pipeline = self._get_embedding_pipeline()
+        
+        model = get_embedder_name(pipeline.embeddings)
+        vectors = [self.chunk_embedding_cache.get_by_key(model, chunk_id) for chunk_id in chunk_ids]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        
+        if missing:
+            embedded = pipeline.embed([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.chunk_embedding_cache.put_by_key(model, chunk_ids[i], vector)
+        
+        return vectors
+    
+    def _get_embedding_pipeline(self) -> EmbeddingPipeline:
+        """Get the batched embedding pipeline for the current embeddings"""
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        
+        if self.embedding_pipeline is None or self.embedding_pipeline.embeddings is not self.embeddings:
+            self.embedding_pipeline = EmbeddingPipeline(
+                self.embeddings,
+                batch_size=self.embedding_batch_size,
+                max_concurrency=self.embedding_concurrency
+            )
+        
+        return self.embedding_pipeline
+    
+    def _replace_document_chunks(self, file_path: str, chunk_ids: List[str], content_hash: str) -> int:
+        """Point a document's manifest entry at its new chunks and tombstone the stale ones"""
+        previous = self.manifest.get_document(file_path)
+        self.manifest.set_document(file_path, chunk_ids, content_hash)
+        key = get_document_key(file_path)
+        try:
+            self.store.append({"op": "document", "key": key, "entry": self.manifest.documents[key]})
+        except Exception:
+            # Keep the manifest in step with what was logged
+            if previous is None:
+                self.manifest.documents.pop(key, None)
+            else:
+                self.manifest.documents[key] = previous
+            raise
+        
+        if previous is None:
+            return 0
+        
+        stale_ids = (
+            set(previous["chunk_ids"])
+            - set(chunk_ids)
+            - self.manifest.get_referenced_chunk_ids(exclude_key=get_document_key(file_path))
+        )
+        self._tombstone_chunks(stale_ids)
+        return len(stale_ids)
+    
+    def _tombstone_chunks(self, chunk_ids):
+        """Hide chunks from search until the next compaction"""
+        chunk_ids = set(chunk_ids) & self.chunk_ids
+        if not chunk_ids:
+            return
+        
+        self.store.append({"op": "tombstone", "ids": sorted(chunk_ids)})
+        self.manifest.tombstones.update(chunk_ids)
+        self.chunk_ids.difference_update(chunk_ids)
+        self.index_version += 1
+    
+    def _compact_if_needed(self):
+        """Compact once tombstones make up a large share of the index"""
+        if self.vectorstore and len(self.manifest.tombstones) > COMPACTION_THRESHOLD * self.vectorstore.index.ntotal:
+            self._compact()
+    
+    def _compact(self) -> int:
+        """Remove tombstoned vectors from the index and docstore"""
+        if not self.vectorstore or not self.manifest.tombstones:
+            return 0
+        
+        with self.index_lock:
+            tombstones = list(self.manifest.tombstones)
+            if get_index_type(self.vectorstore.index) == FLAT:
+                self.vectorstore.delete(tombstones)
+            else:
+                # IVF keeps the old labels on remove_ids and HNSW can't remove at all
+                self._rebuild_index(get_index_type(self.vectorstore.index), get_index_encoding(self.vectorstore.index),
+                                    exclude_ids=set(tombstones))
+                self.vectorstore.docstore.delete(tombstones)
+            self.manifest.tombstones.clear()
+            # Vector positions moved, so the log can't be replayed onto the last snapshot
+            self.store.require_snapshot()
+        return len(tombstones)
+    
+    def _select_index(self):
+        """Rebuild the index as the type and encoding the configuration calls for at the current corpus size"""
+        if self.vectorstore is None or self.store.read_only:
+            return
+        
+        count = self.vectorstore.index.ntotal
+        index_type = select_index_type(count, self.index_type, self.ann_threshold)
+        encoding = select_encoding(count, self.encoding)
+        if needs_rebuild(self.vectorstore.index, index_type, encoding):
+            with self.index_lock:
+                self._rebuild_index(index_type, encoding)
+    
+    def _rebuild_index(self, index_type: str, encoding: str = FLOAT32, exclude_ids: Optional[set] = None):
+        """Rebuild the FAISS index as index_type with the given encoding, optionally leaving out some chunks
+        
+        Vectors come from the chunk store or are read back from the current
+        index, so nothing is re-embedded. Remaining vectors keep their
+        relative order.
+        """
+        index = self.vectorstore.index
+        kept = [
+            (position, chunk_id) for position, chunk_id in sorted(self.vectorstore.index_to_docstore_id.items())
+            if not exclude_ids or chunk_id not in exclude_ids
+        ]
+        # Compressed indexes need the exact vectors kept aside before the originals are encoded away
+        vectors = self._read_vectors(kept, store_missing=encoding != FLOAT32)
+        
+        # Too few vectors left to train IVF / PQ falls back to flat / SQ8
+        index_type = select_index_type(len(kept), index_type, self.ann_threshold)
+        encoding = select_encoding(len(kept), encoding)
+        rebuilt = build_index(vectors, index_type, index.metric_type, encoding=encoding)
+        configure_search(rebuilt, self.nprobe, self.ef_search)
+        self.vectorstore.index = rebuilt
+        self.vectorstore.index_to_docstore_id = {i: chunk_id for i, (_, chunk_id) in enumerate(kept)}
+        self.store.require_snapshot()
+        self.index_version += 1
+    
+    def _read_vectors(self, entries: List[Tuple[int, str]], store_missing: bool = False) -> np.ndarray:
+        """Get full-precision vectors for (position, chunk id) pairs of the index
+        
+        Vectors kept in the chunk store are used where present; the rest are
+        reconstructed from the index. With store_missing, reconstructed
+        vectors are kept in the chunk store if the index holds them exactly.
+        """
+        index = self.vectorstore.index
+        docstore = self.vectorstore.docstore
+        has_vectors = isinstance(docstore, ChunkStore)
+        stored = docstore.get_vectors([chunk_id for _, chunk_id in entries]) if has_vectors else {}
+        missing = [i for i, (_, chunk_id) in enumerate(entries) if chunk_id not in stored]
+        
+        if len(missing) == len(entries):
+            positions = None if len(entries) == index.ntotal else [position for position, _ in entries]
+            vectors = reconstruct_vectors(index, positions)
+        else:
+            vectors = np.zeros((len(entries), index.d), dtype=np.float32)
+            for i, (_, chunk_id) in enumerate(entries):
+                if chunk_id in stored:
+                    vectors[i] = stored[chunk_id]
+            if missing:
+                vectors[missing] = reconstruct_vectors(index, [entries[i][0] for i in missing])
+        
+        if missing and store_missing and has_vectors and not is_lossy(index):
+            docstore.put_vectors([entries[i][1] for i in missing], vectors[missing])
+        return vectors
+    
+    def get_index_vectors(self) -> np.ndarray:
+        """Get the full-precision vector of every index position, in position order"""
+        if self.vectorstore is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        with self.index_lock:
+            return self._read_vectors(sorted(self.vectorstore.index_to_docstore_id.items()))
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune approximate search: IVF lists probed (nprobe) and HNSW candidate list size (efSearch)"""
+        self.nprobe = nprobe or self.nprobe
+        self.ef_search = ef_search or self.ef_search
+        if self.vectorstore is not None:
+            with self.index_lock:
+                configure_search(self.vectorstore.index, self.nprobe, self.ef_search)
+    
+    def _migrate_legacy_index(self):
+        """Re-key an index built before the manifest existed by chunk content address
+        
+        The vectors are kept as they are. Only the docstore ids change, and
+        documents are recovered from each chunk's source metadata.
+        """
+        docs = {}
+        index_to_docstore_id = {}
+        documents = {}
+        for position, doc_id in self.vectorstore.index_to_docstore_id.items():
+            doc = self.vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                index_to_docstore_id[position] = doc_id
+                continue
+            
+            chunk_id = get_chunk_id(doc.page_content)
+            docs[chunk_id] = doc
+            index_to_docstore_id[position] = chunk_id
+            
+            source = doc.metadata.get("source")
+            if source:
+                entry = documents.setdefault(get_document_key(source), {
+                    "source": source,
+                    "content_hash": None,
+                    "mtime": None,
+                    "size": None,
+                    "chunk_ids": []
+                })
+                if chunk_id not in entry["chunk_ids"]:
+                    entry["chunk_ids"].append(chunk_id)
+        
+        if self.store.read_only:
+            self.vectorstore.docstore = InMemoryDocstore(docs)
+        else:
+            # Already moved into the chunk store under the old ids
+            old_ids = set(self.vectorstore.index_to_docstore_id.values()) - set(docs)
+            self.vectorstore.docstore.add(docs)
+            self.vectorstore.docstore.delete(list(old_ids))
+        self.vectorstore.index_to_docstore_id = index_to_docstore_id
+        self.manifest = IndexManifest(documents)
     
-    def save_vectorstore(self):
-        """Save vector store to disk"""
-        if self.vectorstore:
-            os.makedirs("models", exist_ok=True)
-            self.vectorstore.save_local("models/faiss_index")
+    @contextmanager
+    def batch(self):
+        """Defer saving the vector store until the outermost batch exits
+        
+        Use this around bulk loads and deletes so the changes are persisted
+        with one flush instead of one per operation.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.save_vectorstore()
     
-    def load_vectorstore(self):
-        """Load vector store from disk"""
+    def save_vectorstore(self, snapshot: bool = False):
+        """Persist changes to the vector store
+        
+        Changes are appended to a log and committed, so the cost depends on
+        what changed rather than on the index size. A full snapshot is written
+        when forced, after compaction, or once the log has grown large.
+        Inside batch() this is deferred until the batch exits.
+        """
+        if self._batch_depth and not snapshot:
+            return
+        
+        self._select_index()
+        with self.index_lock:
+            self.store.flush(self.vectorstore, self.manifest, snapshot=snapshot)
+    
+    def _ensure_writable(self):
+        """Reload a memory-mapped (read-only) vector store into memory so it can be changed
+        
+        Also reloads a store another writer (process or RAG system) has
+        changed since it was loaded, so its changes aren't written over.
+        """
+        if not self.store.read_only and not self.store.is_stale():
+            return
+        
+        success, message = self.load_vectorstore(mmap=False)
+        if not success:
+            raise RuntimeError(message)
+    
+    def load_vectorstore(self, mmap: Optional[bool] = None):
+        """Load vector store from disk
+        
+        With mmap (default: the mmap_index setting) the index file is mapped
+        read-only and shared through the OS page cache instead of being read
+        into this process.
+        """
         try:
             if self.embeddings is None:
                 self.initialize_embeddings()
             
-            if not os.path.exists("models/faiss_index"):
+            if not os.path.exists(self.store.directory):
                 return False, "No vector store found. Please load policy documents first."
             
-            if not os.path.exists("models/faiss_index/index.faiss"):
+            if not has_vectorstore(self.store.directory):
                 return False, "Vector store index file not found. Please load policy documents first."
             
-            self.vectorstore = FAISS.load_local("models/faiss_index", self.embeddings)
+            with self.index_lock:
+                vectorstore, manifest = self.store.load(
+                    self.embeddings, mmap=self.mmap_index if mmap is None else mmap
+                )
+                try:
+                    self._check_embedder(vectorstore, manifest or IndexManifest())
+                except ValueError as e:
+                    # Drop the loaded state so nothing gets written on top of that store
+                    self.vectorstore = None
+                    self.store = IndexStore(self.store.directory)
+                    self.embedder_error = str(e)
+                    raise
+                self.embedder_error = None
+                configure_search(vectorstore.index, self.nprobe, self.ef_search)
+                self.vectorstore = vectorstore
+            if manifest is None:
+                self._migrate_legacy_index()
+                if not self.store.read_only:
+                    self.store.require_snapshot()
+            else:
+                self.manifest = manifest
+            self.manifest.embedder = get_embedder_info(self.embeddings, self.vectorstore.index.d)
+            self.chunk_ids = set(self.vectorstore.index_to_docstore_id.values()) - self.manifest.tombstones
+            self.index_version += 1
             return True, "Vector store loaded successfully"
         except Exception as e:
             return False, f"Error loading vector store: {str(e)}"
     
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, using the embedding cache to skip the remote call when possible"""
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        
+        model = get_embedder_name(self.embeddings)
+        embedding = self.embedding_cache.get(model, query)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            self.embedding_cache.put(model, query, embedding)
+        
+        return embedding
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Embed a query asynchronously, using the embedding cache when possible"""
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        
+        model = get_embedder_name(self.embeddings)
+        embedding = self.embedding_cache.get(model, query)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            self.embedding_cache.put(model, query, embedding)
+        
+        return embedding
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries in one embedding request, using the embedding cache when possible"""
+        if self.embeddings is None:
+            self.initialize_embeddings()
+        
+        model = get_embedder_name(self.embeddings)
+        embeddings = [self.embedding_cache.get(model, query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            # Identical queries in a batch are embedded once
+            texts = list(dict.fromkeys(queries[i] for i in missing))
+            embedded = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            for text, embedding in embedded.items():
+                self.embedding_cache.put(model, text, embedding)
+            for i in missing:
+                embeddings[i] = embedded[queries[i]]
+        
+        return embeddings
+    
+    def get_ingestion_stats(self) -> Dict[str, Any]:
+        """Get embedding throughput statistics for document ingestion"""
+        if self.embedding_pipeline is None:
+            return {"chunks_embedded": 0, "chunks_per_second": 0.0}
+        
+        return self.embedding_pipeline.get_stats()
+    
+    def get_index_stats(self) -> Dict[str, Any]:
+        """Get the type, encoding, size, memory footprint and search settings of the FAISS index"""
+        if self.vectorstore is None:
+            return {"index_type": None, "vectors": 0}
+        
+        index = self.vectorstore.index
+        memory_bytes = get_memory_usage(index)
+        return {
+            "index_type": get_index_type(index),
+            "configured_index_type": self.index_type,
+            "encoding": get_index_encoding(index),
+            "configured_encoding": self.encoding,
+            "vectors": index.ntotal,
+            "memory_bytes": memory_bytes,
+            "bytes_per_vector": memory_bytes / index.ntotal if index.ntotal else 0.0,
+            "rerank": self.rerank and is_lossy(index),
+            "rerank_factor": self.rerank_factor,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "read_only": self.store.read_only
+        }
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get query-embedding cache statistics"""
+        return self.embedding_cache.get_stats()
+    
     def search_documents(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Search for relevant documents based on query"""
         if not self.vectorstore:
             return []
         
         try:
-            docs = self.vectorstore.similarity_search_with_score(query, k=k)
+            return self._retrieve(query, k)[1]
+        except Exception as e:
+            logger.error("Error searching documents: %s", e)
+            return []
+    
+    async def asearch_documents(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Search for relevant documents without blocking the event loop"""
+        if not self.vectorstore:
+            return []
+        
+        try:
+            return (await self._aretrieve(query, k))[1]
+        except Exception as e:
+            logger.error("Error searching documents: %s", e)
+            return []
+    
+    def search_by_vector(self, embedding: List[float], k: int = 5) -> List[Dict[str, Any]]:
+        """Search for relevant documents using an already computed query embedding"""
+        if not self.vectorstore:
+            return []
+        
+        docs = self._similarity_search(embedding, k)
+        return self._format_search_results(docs)
+    
+    async def asearch_by_vector(self, embedding: List[float], k: int = 5) -> List[Dict[str, Any]]:
+        """Search by query embedding with the FAISS search running in an executor"""
+        if not self.vectorstore:
+            return []
+        
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(None, self._similarity_search, embedding, k)
+        return self._format_search_results(docs)
+    
+    def _similarity_search(self, embedding: List[float], k: int) -> List[Tuple[Document, float]]:
+        """Search the FAISS index, skipping tombstoned chunks"""
+        with self.index_lock:
+            return self._get_documents(self._search_candidates(embedding, k), k)
+    
+    def _search_candidates(self, embedding: List[float], k: int) -> List[Tuple[str, float]]:
+        """Get (chunk id, score) pairs of the k nearest live chunks"""
+        return self._search_candidates_batch([embedding], k)[0]
+    
+    def _search_candidates_batch(self, embeddings: List[List[float]], k: int) -> List[List[Tuple[str, float]]]:
+        """Get the k nearest live chunks of several query embeddings with one FAISS search
+        
+        With a compressed index, k * rerank_factor candidates are re-scored
+        against their full-precision vectors and the best k are kept.
+        """
+        with self.index_lock:
+            index = self.vectorstore.index
+            docstore = self.vectorstore.docstore
+            exact_rerank = self.rerank and isinstance(docstore, ChunkStore) and is_lossy(index)
+            candidate_k = k * self.rerank_factor if exact_rerank else k
+            fetch_k = min(candidate_k + len(self.manifest.tombstones), index.ntotal)
+            if fetch_k <= 0 or not len(embeddings):
+                return [[] for _ in embeddings]
             
-            results = []
-            for doc, score in docs:
-                results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "score": float(score)
-                })
+            scores, positions = index.search(np.array(embeddings, dtype=np.float32), fetch_k)
+            
+            batch = []
+            for embedding, row_scores, row_positions in zip(embeddings, scores, positions):
+                candidates = []
+                for score, position in zip(row_scores, row_positions):
+                    if position == -1:
+                        continue
+                    doc_id = self.vectorstore.index_to_docstore_id.get(int(position))
+                    if doc_id is None or doc_id in self.manifest.tombstones:
+                        continue
+                    candidates.append((doc_id, float(score)))
+                    if len(candidates) == candidate_k:
+                        break
+                
+                if exact_rerank:
+                    vectors = docstore.get_vectors([doc_id for doc_id, _ in candidates])
+                    candidates = rerank(embedding, candidates, vectors, index.metric_type)[:k]
+                batch.append(candidates)
             
+            return batch
+    
+    def _get_documents(self, candidates: List[Tuple[str, float]], k: int) -> List[Tuple[Document, float]]:
+        """Look up the chunks of (chunk id, score) candidates, keeping the first k found"""
+        docs = []
+        for doc_id, score in candidates:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs.append((doc, score))
+            if len(docs) == k:
+                break
+        
+        return docs
+    
+    def _retrieve(self, query: str, k: int) -> Tuple[Optional[List[float]], List[Dict[str, Any]]]:
+        """Search for a query, returning the query embedding (None if none was needed) and the results"""
+        lexical_candidates, results = self._search_lexical(query, k)
+        if results is not None:
+            return None, results
+        
+        embedding = self.embed_query(query)
+        return embedding, self._search_hybrid(embedding, lexical_candidates, k)
+    
+    def _retrieve_batch(self, queries: List[str], k: int) -> List[Union[Tuple[Optional[List[float]], List[Dict[str, Any]]], Exception]]:
+        """Search for several queries with one embedding request and one FAISS search
+        
+        Queries answered by the keyword fast path aren't embedded. A query
+        whose search failed gets the exception in place of its result.
+        """
+        results = [None] * len(queries)
+        lexical = [[] for _ in queries]
+        pending = []
+        for i, query in enumerate(queries):
+            try:
+                lexical[i], found = self._search_lexical(query, k)
+            except Exception as e:
+                results[i] = e
+                continue
+            if found is not None:
+                results[i] = (None, found)
+            else:
+                pending.append(i)
+        
+        if not pending:
             return results
+        
+        try:
+            embeddings = self.embed_queries([queries[i] for i in pending])
+            candidate_k = k * HYBRID_CANDIDATE_FACTOR if any(lexical[i] for i in pending) else k
+            with self.index_lock:
+                vector_candidates = self._search_candidates_batch(embeddings, candidate_k)
+                for i, embedding, candidates in zip(pending, embeddings, vector_candidates):
+                    results[i] = (embedding, self._merge_candidates(candidates, lexical[i], k))
         except Exception as e:
-            st.error(f"Error searching documents: {str(e)}")
-            return []
+            for i in pending:
+                if results[i] is None:
+                    results[i] = e
+        return results
+    
+    async def _aretrieve(self, query: str, k: int) -> Tuple[Optional[List[float]], List[Dict[str, Any]]]:
+        """Search for a query without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        lexical_candidates, results = await loop.run_in_executor(None, self._search_lexical, query, k)
+        if results is not None:
+            return None, results
+        
+        embedding = await self.aembed_query(query)
+        return embedding, await loop.run_in_executor(None, self._search_hybrid, embedding, lexical_candidates, k)
+    
+    def _search_lexical(self, query: str, k: int) -> Tuple[List[Tuple[str, float]], Optional[List[Dict[str, Any]]]]:
+        """Run the keyword side of hybrid retrieval
+        
+        Returns the BM25 candidates to fuse with vector search, and the final
+        results instead when the keyword match is confident enough to skip
+        embedding the query.
+        """
+        if self.retrieval_mode != HYBRID or not isinstance(self.vectorstore.docstore, ChunkStore):
+            return [], None
+        
+        terms = get_query_terms(query)
+        candidates = self._lexical_candidates(get_match_expression(terms), k * HYBRID_CANDIDATE_FACTOR) if terms else []
+        if candidates and self._is_keyword_query(terms):
+            docs = self._get_documents(candidates, k)
+            best = docs[0][1] if docs else 0.0
+            # BM25 scores are relative to the best match
+            return candidates, self._format_search_results(docs, lambda score: score / best if best > 0 else 0.0)
+        return candidates, None
+    
+    def _lexical_candidates(self, expression: str, limit: int) -> List[Tuple[str, float]]:
+        """BM25 (chunk id, score) candidates for a match expression, skipping chunks not live in the index"""
+        hits = self.vectorstore.docstore.search_text(expression, limit + len(self.manifest.tombstones))
+        return [(chunk_id, score) for chunk_id, score in hits if chunk_id in self.chunk_ids][:limit]
+    
+    def _is_keyword_query(self, terms: List[str]) -> bool:
+        """Check whether keyword search alone can answer a query
+        
+        True for short keyword queries (at most lexical_max_terms terms) when
+        some chunk contains every term and at least one term is selective,
+        i.e. found in at most lexical_max_match_ratio of the chunks.
+        """
+        if not self.lexical_fast_path or len(terms) > self.lexical_max_terms:
+            return False
+        
+        if not self._lexical_candidates(get_match_expression(terms, match_all=True), 1):
+            return False
+        
+        # A term found in a single chunk is selective however small the corpus
+        max_matches = max(1, int(self.lexical_max_match_ratio * len(self.chunk_ids)))
+        return any(
+            len(self._lexical_candidates(get_match_expression([term]), max_matches + 1)) <= max_matches
+            for term in terms
+        )
+    
+    def _search_hybrid(self, embedding: List[float], lexical_candidates: List[Tuple[str, float]],
+                       k: int) -> List[Dict[str, Any]]:
+        """Fuse vector search with BM25 candidates; plain vector search when there are none
+        
+        Fused results are scored 0..1, higher is better.
+        """
+        with self.index_lock:
+            candidate_k = k * HYBRID_CANDIDATE_FACTOR if lexical_candidates else k
+            return self._merge_candidates(self._search_candidates(embedding, candidate_k), lexical_candidates, k)
     
-    def get_context_for_query(self, query: str, max_chunks: int = 3) -> str:
-        """Get relevant context for a query"""
-        search_results = self.search_documents(query, k=max_chunks)
+    def _merge_candidates(self, vector_candidates: List[Tuple[str, float]], lexical_candidates: List[Tuple[str, float]],
+                          k: int) -> List[Dict[str, Any]]:
+        """Turn vector candidates, fused with any BM25 candidates, into the top k search results"""
+        if lexical_candidates:
+            fused = fuse_scores(vector_candidates, lexical_candidates, self.hybrid_vector_weight,
+                                self.vectorstore.index.metric_type)
+            return self._format_search_results(self._get_documents(fused, k), lambda score: score)
+        return self._format_search_results(self._get_documents(vector_candidates, k))
+    
+    def _format_search_results(self, docs, relevance: Optional[Callable[[float], float]] = None) -> List[Dict[str, Any]]:
+        """Convert (document, score) pairs into result dictionaries
+        
+        Besides its raw score, each result gets a "relevance" from 0 to 1,
+        higher is better, that means the same whichever search produced it.
+        Scores are taken as vector distances unless a relevance function is
+        given.
+        """
+        relevance = relevance or self._vector_relevance
+        results = []
+        for doc, score in docs:
+            results.append({
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "score": float(score),
+                "relevance": min(1.0, max(0.0, float(relevance(score))))
+            })
+        
+        return results
+    
+    def _vector_relevance(self, score: float) -> float:
+        """Cosine similarity for a vector search score (embeddings are unit length)"""
+        if self.vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return score
+        # Squared L2 distance between unit vectors is 2 - 2 * cosine
+        return 1.0 - score / 2.0
+    
+    def get_context_for_query(self, query: str, max_chunks: Optional[int] = None, provider: Optional[str] = None) -> str:
+        """Get relevant context for a query, packed into the provider's token budget"""
+        search_results = self.search_documents(query, k=max_chunks or self.context_max_chunks)
+        return self._build_context(search_results, provider)
+    
+    async def aget_context_for_query(self, query: str, max_chunks: Optional[int] = None,
+                                     provider: Optional[str] = None) -> str:
+        """Get relevant context for a query asynchronously"""
+        search_results = await self.asearch_documents(query, k=max_chunks or self.context_max_chunks)
+        return self._build_context(search_results, provider)
+    
+    def retrieve_context(self, query: str, max_chunks: Optional[int] = None,
+                         provider: Optional[str] = None) -> Tuple[Optional[List[float]], str]:
+        """Get relevant context for a query along with the query embedding used to find it
+        
+        Up to max_chunks (default context_max_chunks) results are packed into
+        the token budget of provider (default the system's provider). The
+        embedding is None when keyword search alone answered the query.
+        """
+        if not self.vectorstore:
+            return None, self._build_context([])
+        
+        try:
+            embedding, search_results = self._retrieve(query, max_chunks or self.context_max_chunks)
+            return embedding, self._build_context(search_results, provider)
+        except Exception as e:
+            logger.error("Error searching documents: %s", e)
+            return None, self._build_context([])
+    
+    async def aretrieve_context(self, query: str, max_chunks: Optional[int] = None,
+                                provider: Optional[str] = None) -> Tuple[Optional[List[float]], str]:
+        """Get relevant context and the query embedding asynchronously"""
+        if not self.vectorstore:
+            return None, self._build_context([])
+        
+        try:
+            embedding, search_results = await self._aretrieve(query, max_chunks or self.context_max_chunks)
+            return embedding, self._build_context(search_results, provider)
+        except Exception as e:
+            logger.error("Error searching documents: %s", e)
+            return None, self._build_context([])
+    
+    def retrieve_contexts(self, queries: List[str], max_chunks: Optional[int] = None,
+                          provider: Optional[str] = None) -> List[Union[Tuple[Optional[List[float]], str], Exception]]:
+        """Get context and query embedding for several queries at once
         
+        All queries that need embedding are embedded in one request and
+        searched with one FAISS search. A query whose retrieval failed gets
+        the exception in place of its (embedding, context) pair.
+        """
+        if not self.vectorstore:
+            return [(None, self._build_context([])) for _ in queries]
+        
+        return [
+            result if isinstance(result, Exception) else (result[0], self._build_context(result[1], provider))
+            for result in self._retrieve_batch(queries, max_chunks or self.context_max_chunks)
+        ]
+    
+    async def aretrieve_contexts(self, queries: List[str], max_chunks: Optional[int] = None,
+                                 provider: Optional[str] = None) -> List[Union[Tuple[Optional[List[float]], str], Exception]]:
+        """Get context for several queries at once without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.retrieve_contexts, queries, max_chunks, provider)
+    
+    def _build_context(self, search_results: List[Dict[str, Any]], provider: Optional[str] = None) -> str:
+        """Format search results into the context passed to the LLM
+        
+        Results past a relevance gap are dropped, overlapping or adjacent
+        chunks of a page are merged, and passages fill the provider's token
+        budget best first.
+        """
         if not search_results:
             return "No relevant information found in the policy documents."
         
+        token_budget = get_token_budget(self.context_token_budgets, provider or self.provider)
+        passages = pack_context(search_results, token_budget, self.context_score_gap)
+        
         context_parts = []
-        for i, result in enumerate(search_results, 1):
-            context_parts.append(f"Context {i}:\n{result['content']}\n")
+        for i, passage in enumerate(passages, 1):
+            context_parts.append(f"Context {i}:\n{passage['content']}\n")
         
         return "\n".join(context_parts)
@@ -0,0 +1,210 @@
+"""
+Per-session chatbots for the Insurance Chatbot API
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from answer_cache import SemanticAnswerCache
+from chat_history import ChatHistory, ChatHistoryStore
+from chatbot import InsuranceChatbot
+
+DEFAULT_SESSION_ID = "default"
+
+
+def get_credentials_fingerprint(api_key: str, provider: str) -> str:
+    """Identify a provider and API key without keeping the key itself"""
+    return hashlib.sha256(f"{provider}:{api_key}".encode("utf-8")).hexdigest()
+
+
+def get_default_session_id(api_key: str, provider: str) -> str:
+    """Session id for callers that don't send one, so callers with different keys never share a session"""
+    return f"{DEFAULT_SESSION_ID}-{get_credentials_fingerprint(api_key, provider)[:16]}"
+
+
+class ChatSessionManager:
+    """Chat sessions keyed by session id, all sharing one loaded vector store.
+
+    The first initialization loads the InsuranceRAGSystem (FAISS index, chunk
+    store, embeddings) once; every session after that only gets its own chat
+    history and LLM handler on top of it, plus the shared answer cache.
+    Sessions idle for longer than ttl_seconds are dropped, and once there are
+    max_sessions the least recently used one makes room for a new one.
+    Documents are loaded, deleted and compacted through indexer, so no
+    session ever writes to the shared index.
+
+    With a history_path, chat histories are appended to a ChatHistoryStore
+    there and outlive their sessions; only the newest history_window
+    exchanges of each live session stay in memory.
+
+    A session belongs to the provider and API key it was started with:
+    looked up with other credentials it counts as missing, and
+    get_or_create_session restarts it with the caller's own (the stored
+    history, keyed by session id, carries over).
+
+    Every session's LLM handler fails over to the (provider, api_key)
+    pairs in fallbacks, in order, when its own provider is failing.
+
+    Queries against the shared index are embedded with embedding_api_key,
+    a server-side OpenAI key, so no caller pays for everyone's embeddings.
+    Without one the index embeds with the key of the latest OpenAI caller
+    to initialize, so a revoked key is replaced by the next good one rather
+    than breaking retrieval until a restart.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 1800, history_path: Optional[str] = None,
+                 history_window: int = 100, history_max_entries: int = 1000, history_retention_seconds: float = 0,
+                 history_compact_interval: float = 300, fallbacks: Optional[List[Tuple[str, str]]] = None,
+                 embedding_api_key: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.history_path = history_path
+        self.history_window = history_window
+        self.history_max_entries = history_max_entries
+        self.history_retention_seconds = history_retention_seconds
+        self.history_compact_interval = history_compact_interval
+        self.fallbacks = fallbacks or []
+        self.embedding_api_key = embedding_api_key
+        # Opened on initialization
+        self.history_store = None
+        self.answer_cache = SemanticAnswerCache(
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+        )
+        # Chatbot owning the shared RAG system, used for document management and cache stats
+        self.indexer = None
+        # session_id -> {"chatbot": InsuranceChatbot, "last_used": float}, least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    @property
+    def rag_system(self):
+        return self.indexer.rag_system if self.indexer else None
+
+    def is_initialized(self) -> bool:
+        return self.indexer is not None
+
+    def initialize(self, api_key: str, provider: str = "openai") -> Tuple[bool, str]:
+        """Load the shared RAG system unless it is already loaded"""
+        with self._init_lock:
+            if self.indexer is not None:
+                if not self.embedding_api_key and provider == "openai":
+                    self.rag_system.set_embedding_api_key(api_key)
+                return True, "Vector store already loaded, session ready"
+
+            indexer = InsuranceChatbot(answer_cache=self.answer_cache)
+            success, message = indexer.initialize(api_key, provider, self.fallbacks,
+                                                  embedding_api_key=self.embedding_api_key)
+            if success:
+                if self.history_path and self.history_store is None:
+                    self.history_store = ChatHistoryStore(
+                        self.history_path,
+                        max_entries_per_session=self.history_max_entries,
+                        retention_seconds=self.history_retention_seconds
+                    )
+                    self.history_store.start_compaction(self.history_compact_interval)
+                self.indexer = indexer
+            return success, message
+
+    def create_session(self, session_id: str, api_key: str, provider: str = "openai") -> InsuranceChatbot:
+        """Start a session (replacing any session with the same id) on the shared RAG system"""
+        if self.indexer is None:
+            raise RuntimeError("Chatbot not initialized")
+
+        chatbot = InsuranceChatbot(
+            rag_system=self.rag_system,
+            answer_cache=self.answer_cache,
+            chat_history=ChatHistory(session_id, self.history_store, self.history_window)
+        )
+        chatbot.set_provider(api_key, provider, self.fallbacks)
+
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._evict(time.time(), room=1)
+            self._sessions[session_id] = {
+                "chatbot": chatbot,
+                "credentials": get_credentials_fingerprint(api_key, provider),
+                "last_used": time.time()
+            }
+            self.created += 1
+        return chatbot
+
+    def get_session(self, session_id: str, credentials: Optional[str] = None) -> Optional[InsuranceChatbot]:
+        """Get a live session's chatbot, marking it as just used
+
+        With credentials (see get_credentials_fingerprint), a session started
+        with a different provider or API key is not returned.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or (credentials is not None and session["credentials"] != credentials):
+                return None
+            now = time.time()
+            if self._is_expired(session, now):
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            session["last_used"] = now
+            self._sessions.move_to_end(session_id)
+            return session["chatbot"]
+
+    def get_or_create_session(self, session_id: str, api_key: str, provider: str = "openai") -> InsuranceChatbot:
+        """Get a live session's chatbot, (re)starting it if it doesn't exist or has other credentials"""
+        credentials = get_credentials_fingerprint(api_key, provider)
+        return self.get_session(session_id, credentials) or self.create_session(session_id, api_key, provider)
+
+    def get_history(self, session_id: str) -> Optional[ChatHistory]:
+        """Get a session's chat history, reading it from the store if the session has expired"""
+        chatbot = self.get_session(session_id)
+        if chatbot:
+            return chatbot.chat_history
+        if self.history_store is not None and self.history_store.count(session_id):
+            return ChatHistory(session_id, self.history_store, self.history_window)
+        return None
+
+    def end_session(self, session_id: str) -> bool:
+        """Drop a session and its stored history, returning whether either existed"""
+        with self._lock:
+            existed = self._sessions.pop(session_id, None) is not None
+        if self.history_store is not None:
+            existed = self.history_store.clear(session_id) > 0 or existed
+        return existed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get session counts and eviction statistics"""
+        with self._lock:
+            self._evict(time.time())
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "history_entries_compacted": self.history_store.compacted if self.history_store else 0
+            }
+
+    def _evict(self, now: float, room: int = 0):
+        """Drop idle sessions, then least recently used ones until `room` more fit under the cap (lock held)"""
+        # Sessions are ordered by last use, so the idle ones are all at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if not self._is_expired(session, now):
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+        while self._sessions and len(self._sessions) + room > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def _is_expired(self, session: Dict[str, Any], now: float) -> bool:
+        return now - session["last_used"] > self.ttl_seconds
@@ -0,0 +1,231 @@
+"""
+Tests for IndexStore snapshots, log replay and the writer lock, and ChunkStore purging
+"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_core.documents import Document
+
+from chunk_store import ChunkStore
+from index_manifest import IndexManifest
+from index_store import IndexStore
+
+DIMENSION = 4
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings(size=DIMENSION)
+
+
+def add_chunks(store, vectorstore, ids):
+    """Index chunks the way InsuranceRAGSystem.add_chunks does"""
+    vectors = np.random.default_rng(len(ids)).random((len(ids), DIMENSION), dtype=np.float32)
+    store.chunks.add({chunk_id: Document(page_content=f"text of {chunk_id}") for chunk_id in ids})
+    start = vectorstore.index.ntotal
+    vectorstore.index.add(vectors)
+    vectorstore.index_to_docstore_id.update({start + i: chunk_id for i, chunk_id in enumerate(ids)})
+    store.append_vectors(ids, vectors.tolist())
+
+
+def build_store(directory, embeddings, ids=("a", "b")):
+    """A store with one snapshot holding ids"""
+    store = IndexStore(directory)
+    vectorstore = store.new_vectorstore(embeddings, DIMENSION)
+    manifest = IndexManifest()
+    add_chunks(store, vectorstore, list(ids))
+    store.flush(vectorstore, manifest)
+    return store, vectorstore, manifest
+
+
+def indexed_ids(vectorstore):
+    return [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+
+
+def test_committed_log_records_are_replayed(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    add_chunks(store, vectorstore, ["c"])
+    store.flush(vectorstore, manifest)
+
+    assert os.path.getsize(tmp_path / f"log.{store.generation}.jsonl") > 0
+    reloaded, _ = IndexStore(str(tmp_path)).load(embeddings)
+    assert indexed_ids(reloaded) == ["a", "b", "c"]
+
+
+def test_crash_before_commit_drops_uncommitted_records(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    add_chunks(store, vectorstore, ["c"])
+    store.flush(vectorstore, manifest)
+    # Logged but never committed, then a torn write as the process dies
+    add_chunks(store, vectorstore, ["d"])
+    store._log.flush()
+    with open(tmp_path / f"log.{store.generation}.jsonl", "ab") as f:
+        f.write(b'{"op": "comm')
+    store._close_log()
+    store._release_writer_lock()
+
+    recovered = IndexStore(str(tmp_path))
+    reloaded, manifest = recovered.load(embeddings)
+    assert indexed_ids(reloaded) == ["a", "b", "c"]
+
+    # The next writer truncates the uncommitted tail before appending
+    add_chunks(recovered, reloaded, ["e"])
+    recovered.flush(reloaded, manifest)
+    reloaded, _ = IndexStore(str(tmp_path)).load(embeddings)
+    assert indexed_ids(reloaded) == ["a", "b", "c", "e"]
+
+
+def test_crash_during_snapshot_keeps_previous_snapshot(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    add_chunks(store, vectorstore, ["c"])
+    store.flush(vectorstore, manifest)
+    generation = store.generation
+    # A snapshot whose files were written but whose CURRENT swap never happened
+    with open(tmp_path / f"index.{generation + 1}.faiss", "wb") as f:
+        f.write(b"partial")
+    with open(tmp_path / "CURRENT.tmp", "w") as f:
+        f.write('{"generation": ')
+
+    recovered = IndexStore(str(tmp_path))
+    reloaded, manifest = recovered.load(embeddings)
+    assert recovered.generation == generation
+    assert indexed_ids(reloaded) == ["a", "b", "c"]
+
+    recovered.flush(reloaded, manifest, snapshot=True)
+    assert recovered.generation == generation + 1
+    reloaded, _ = IndexStore(str(tmp_path)).load(embeddings)
+    assert indexed_ids(reloaded) == ["a", "b", "c"]
+
+
+def test_tombstones_survive_reload(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    manifest.tombstones.add("a")
+    store.append({"op": "tombstone", "ids": ["a"]})
+    store.flush(vectorstore, manifest)
+
+    _, reloaded = IndexStore(str(tmp_path)).load(embeddings)
+    assert reloaded.tombstones == {"a"}
+
+    # And once folded into a snapshot
+    store.flush(vectorstore, manifest, snapshot=True)
+    _, reloaded = IndexStore(str(tmp_path)).load(embeddings)
+    assert reloaded.tombstones == {"a"}
+
+
+def test_revive_clears_tombstone(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    store.append({"op": "tombstone", "ids": ["a"]})
+    store.append({"op": "revive", "ids": ["a"]})
+    store.flush(vectorstore, manifest)
+
+    _, reloaded = IndexStore(str(tmp_path)).load(embeddings)
+    assert reloaded.tombstones == set()
+
+
+def test_stale_store_must_reload_before_writing(tmp_path, embeddings):
+    build_store(str(tmp_path), embeddings)
+    first, second = IndexStore(str(tmp_path)), IndexStore(str(tmp_path))
+    first_vectorstore, first_manifest = first.load(embeddings)
+    second_vectorstore, _ = second.load(embeddings)
+    assert not second.is_stale()
+
+    add_chunks(first, first_vectorstore, ["c"])
+    first.flush(first_vectorstore, first_manifest)
+    assert second.is_stale()
+    with pytest.raises(RuntimeError, match="changed by another writer"):
+        add_chunks(second, second_vectorstore, ["d"])
+
+    second_vectorstore, second_manifest = second.load(embeddings)
+    assert not second.is_stale()
+    add_chunks(second, second_vectorstore, ["d"])
+    second.flush(second_vectorstore, second_manifest)
+    reloaded, _ = IndexStore(str(tmp_path)).load(embeddings)
+    assert indexed_ids(reloaded) == ["a", "b", "c", "d"]
+
+
+def test_new_snapshot_makes_store_stale(tmp_path, embeddings):
+    build_store(str(tmp_path), embeddings)
+    first, second = IndexStore(str(tmp_path)), IndexStore(str(tmp_path))
+    first_vectorstore, first_manifest = first.load(embeddings)
+    second.load(embeddings)
+
+    first.flush(first_vectorstore, first_manifest, snapshot=True)
+    assert second.is_stale()
+
+
+def test_writer_lock_is_held_until_flush(tmp_path, embeddings):
+    build_store(str(tmp_path), embeddings)
+    first, second = IndexStore(str(tmp_path)), IndexStore(str(tmp_path))
+    first_vectorstore, first_manifest = first.load(embeddings)
+    second_vectorstore, _ = second.load(embeddings)
+
+    add_chunks(first, first_vectorstore, ["c"])
+    with pytest.raises(RuntimeError, match="another writer in this process"):
+        second.append({"op": "tombstone", "ids": ["a"]})
+
+    first.flush(first_vectorstore, first_manifest)
+    second_vectorstore, second_manifest = second.load(embeddings)
+    second.append({"op": "tombstone", "ids": ["a"]})
+    second.flush(second_vectorstore, second_manifest)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="no fcntl writer lock")
+def test_writer_lock_fails_fast_across_processes(tmp_path, embeddings):
+    store, vectorstore, _ = build_store(str(tmp_path), embeddings)
+    holder = subprocess.Popen(
+        [sys.executable, "-c",
+         "import fcntl, sys; f = open(sys.argv[1], 'a'); fcntl.flock(f, fcntl.LOCK_EX); "
+         "print('locked', flush=True); sys.stdin.read()",
+         str(tmp_path / IndexStore.LOCK_FILENAME)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        with pytest.raises(RuntimeError, match="another writer in another process"):
+            store.append({"op": "tombstone", "ids": ["a"]})
+    finally:
+        holder.communicate("")
+
+
+def test_memory_mapped_store_is_read_only(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    store.flush(vectorstore, manifest, snapshot=True)
+    add_chunks(store, vectorstore, ["c"])
+    store.flush(vectorstore, manifest)
+
+    reader = IndexStore(str(tmp_path))
+    mapped, _ = reader.load(embeddings, mmap=True)
+    assert reader.read_only
+    # The logged vector is searched from an in-memory shard beside the mapped index
+    assert indexed_ids(mapped) == ["a", "b", "c"]
+    with pytest.raises(RuntimeError, match="read-only"):
+        reader.append({"op": "tombstone", "ids": ["a"]})
+    with pytest.raises(RuntimeError, match="read-only"):
+        reader.require_snapshot()
+
+
+def test_chunk_store_purges_only_deleted_chunks(tmp_path):
+    chunks = ChunkStore(str(tmp_path / "chunks.sqlite3"))
+    chunks.add({"a": Document(page_content="collision cover"), "b": Document(page_content="theft cover")})
+
+    chunks.delete(["a"])
+    # Still readable until purged: older snapshots may refer to it
+    assert chunks.search("a").page_content == "collision cover"
+    assert [chunk_id for chunk_id, _ in chunks.search_text("collision", 5)] == []
+    assert len(chunks) == 2
+
+    assert chunks.purge() == 1
+    assert len(chunks) == 1
+    assert chunks.search("b").page_content == "theft cover"
+    assert chunks.purge() == 0
+
+
+def test_snapshot_purges_deleted_chunks(tmp_path, embeddings):
+    store, vectorstore, manifest = build_store(str(tmp_path), embeddings)
+    store.chunks.delete(["a"])
+    store.flush(vectorstore, manifest, snapshot=True)
+    assert len(store.chunks) == 1
@@ -0,0 +1,241 @@
+"""
+Tests for provider failover, hedging and the circuit breaker, against stub providers
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_handlers import LLMHandler
+from provider_health import (
+    CLOSED, CREDENTIALS_FAILURE, HALF_OPEN, OPEN, PROVIDER_FAILURE, REQUEST_FAILURE,
+    CircuitBreaker, ProviderHealthRegistry, classify_error
+)
+
+RECOVERY_SECONDS = 0.05
+
+
+class StatusError(Exception):
+    """A provider error carrying an HTTP status, like the SDKs raise"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class StubProvider:
+    """Answers like a provider's generate call, or raises; counts calls and can be slow"""
+
+    def __init__(self, provider: str, error: Exception = None, delay: float = 0):
+        self.provider = provider
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = threading.Event()
+
+    def generate(self, query, context):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._answer()
+
+    async def agenerate(self, query, context):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        return self._answer()
+
+    def _answer(self):
+        if self.error is not None:
+            raise self.error
+        return {"response": f"answer from {self.provider}", "provider": self.provider, "model": "stub"}
+
+
+@pytest.fixture(autouse=True)
+def no_clients(monkeypatch):
+    # Stubs stand in for the SDK clients
+    monkeypatch.setattr(LLMHandler, "_initialize_client", lambda self: None)
+    monkeypatch.delenv("LLM_ROUTING", raising=False)
+
+
+def make_handler(primary: StubProvider, fallback: StubProvider, failure_threshold: int = 2) -> LLMHandler:
+    handler = LLMHandler(primary.provider, "primary-key", fallbacks=[(fallback.provider, "fallback-key")])
+    handler.health = ProviderHealthRegistry(failure_threshold=failure_threshold, recovery_timeout=RECOVERY_SECONDS)
+    handler.router.health = handler.health
+    for target, stub in ((handler, primary), (handler.fallbacks[0], fallback)):
+        target._generate_response = stub.generate
+        target._agenerate_response = stub.agenerate
+    return handler
+
+
+def state(handler: LLMHandler, provider: str) -> str:
+    return handler.health.get(provider).breaker.state
+
+
+@pytest.mark.parametrize("status, kind", [
+    (503, PROVIDER_FAILURE), (500, PROVIDER_FAILURE), (429, PROVIDER_FAILURE),
+    (401, CREDENTIALS_FAILURE), (403, CREDENTIALS_FAILURE),
+    (400, REQUEST_FAILURE), (404, REQUEST_FAILURE)
+])
+def test_classify_error_by_status(status, kind):
+    assert classify_error(StatusError(status)) == kind
+
+
+def test_classify_error_without_status():
+    assert classify_error(ConnectionError("reset")) == PROVIDER_FAILURE
+    assert classify_error(ValueError("bad input")) == REQUEST_FAILURE
+
+
+def test_fails_over_on_provider_error():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+
+    result = handler.generate_response("q")
+    assert result["provider"] == "anthropic"
+    assert (primary.calls, fallback.calls) == (1, 1)
+    assert handler.health.get("openai").failures == 1
+    assert handler.last_provider == "anthropic"
+
+
+def test_does_not_fail_over_on_bad_request():
+    primary, fallback = StubProvider("openai", StatusError(400)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+
+    result = handler.generate_response("q")
+    assert "error" in result
+    assert fallback.calls == 0
+    # The request was at fault, not the provider
+    assert handler.health.get("openai").failures == 0
+    assert state(handler, "openai") == CLOSED
+
+
+def test_credentials_failure_fails_over_without_opening_circuit():
+    primary, fallback = StubProvider("openai", StatusError(401)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback, failure_threshold=1)
+
+    assert handler.generate_response("q")["provider"] == "anthropic"
+    assert state(handler, "openai") == CLOSED
+
+
+def test_async_fails_over_on_provider_error():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+
+    result = asyncio.run(handler.agenerate_response("q"))
+    assert result["provider"] == "anthropic"
+    assert (primary.calls, fallback.calls) == (1, 1)
+
+
+def test_circuit_opens_and_skips_failing_provider():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback, failure_threshold=2)
+
+    handler.generate_response("q")
+    handler.generate_response("q")
+    assert state(handler, "openai") == OPEN
+    assert handler.get_expected_provider() == "anthropic"
+
+    assert handler.generate_response("q")["provider"] == "anthropic"
+    assert primary.calls == 2
+
+
+def test_every_circuit_open_reports_unavailable():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic", StatusError(503))
+    handler = make_handler(primary, fallback, failure_threshold=1)
+
+    handler.generate_response("q")
+    result = handler.generate_response("q")
+    assert "circuit open" in result["error"]
+    assert (primary.calls, fallback.calls) == (1, 1)
+
+
+def test_half_open_probe_closes_circuit_on_success():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback, failure_threshold=1)
+    handler.generate_response("q")
+    assert state(handler, "openai") == OPEN
+
+    time.sleep(RECOVERY_SECONDS * 2)
+    assert state(handler, "openai") == HALF_OPEN
+    primary.error = None
+    assert handler.generate_response("q")["provider"] == "openai"
+    assert state(handler, "openai") == CLOSED
+
+
+def test_half_open_probe_reopens_circuit_on_failure():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback, failure_threshold=1)
+    handler.generate_response("q")
+
+    time.sleep(RECOVERY_SECONDS * 2)
+    assert handler.generate_response("q")["provider"] == "anthropic"
+    assert primary.calls == 2
+    assert state(handler, "openai") == OPEN
+
+
+def test_half_open_lets_limited_probes_through():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=RECOVERY_SECONDS, half_open_max_calls=1)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    time.sleep(RECOVERY_SECONDS * 2)
+    assert breaker.allow_request()
+    # The probe is still out
+    assert not breaker.allow_request()
+    # A probe that says nothing about the provider frees its slot
+    breaker.release()
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def enable_hedging(handler: LLMHandler, latency: float):
+    handler.hedge_percentile = 50
+    handler.hedge_min_samples = 1
+    handler.health.get(handler.provider).record_success(latency)
+
+
+def test_hedges_to_fallback_when_primary_is_slow():
+    primary, fallback = StubProvider("openai", delay=1.0), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+    enable_hedging(handler, 0.01)
+
+    start = time.perf_counter()
+    result = handler.generate_response("q")
+    assert result["provider"] == "anthropic"
+    assert time.perf_counter() - start < 0.5
+    assert (primary.calls, fallback.calls) == (1, 1)
+
+
+def test_does_not_hedge_a_prompt_primary():
+    primary, fallback = StubProvider("openai"), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+    enable_hedging(handler, 0.5)
+
+    assert handler.generate_response("q")["provider"] == "openai"
+    assert fallback.calls == 0
+
+
+def test_hedged_request_fails_over_when_primary_fails_first():
+    primary, fallback = StubProvider("openai", StatusError(503)), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+    enable_hedging(handler, 0.5)
+
+    assert handler.generate_response("q")["provider"] == "anthropic"
+
+
+def test_async_hedge_cancels_losing_call_without_counting_it():
+    primary, fallback = StubProvider("openai", delay=1.0), StubProvider("anthropic")
+    handler = make_handler(primary, fallback)
+    enable_hedging(handler, 0.01)
+
+    start = time.perf_counter()
+    result = asyncio.run(handler.agenerate_response("q"))
+    assert result["provider"] == "anthropic"
+    assert time.perf_counter() - start < 0.5
+    assert primary.cancelled.is_set()
+    assert handler.health.get("openai").failures == 0
+    assert state(handler, "openai") == CLOSED
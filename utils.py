@@ -2,7 +2,7 @@
 Utility functions for the Insurance Chatbot application
 """
 import os
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 
 def get_api_key_and_provider(provider: Optional[str] = None) -> Tuple[Optional[str], str]:
@@ -51,3 +51,16 @@ def validate_api_key(api_key: Optional[str], provider: str) -> bool:
 
 def get_supported_providers() -> list:
     return ["openai", "anthropic", "google"]
+
+
+def get_configured_providers() -> List[Tuple[str, str]]:
+    """(provider, api_key) for every provider with a valid API key in the environment, default provider first"""
+    configured = []
+    for provider in get_supported_providers():
+        api_key, provider = get_api_key_and_provider(provider)
+        if validate_api_key(api_key, provider):
+            configured.append((provider, api_key))
+    
+    default_provider = os.getenv("DEFAULT_LLM_PROVIDER", "openai")
+    configured.sort(key=lambda item: item[0] != default_provider)
+    return configured
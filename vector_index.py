@@ -0,0 +1,233 @@
+"""
+FAISS index types for the vector store: exact flat search or approximate IVF / HNSW,
+each storing vectors as float32 or in a compressed encoding (float16 / SQ8 / PQ)
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+FLAT = "flat"
+IVF = "ivf"
+HNSW = "hnsw"
+AUTO = "auto"
+INDEX_TYPES = (FLAT, IVF, HNSW)
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+SQ8 = "sq8"
+PQ = "pq"
+ENCODINGS = (FLOAT32, FLOAT16, SQ8, PQ)
+
+# Corpus size at which "auto" switches from exact to approximate search
+ANN_THRESHOLD = 100000
+# Training points sampled per IVF list (faiss wants at least 39)
+TRAIN_POINTS_PER_LIST = 64
+HNSW_M = 32
+# PQ codebooks have 256 centroids per sub-quantizer, which faiss wants 39 points each to train
+PQ_MIN_VECTORS = 256 * 39
+# Dimensions per PQ sub-quantizer (1536-d ada-002 vectors -> 96 bytes per vector)
+PQ_DIMS_PER_SUBQUANTIZER = 16
+
+
+def get_index_type(index) -> str:
+    """Get the type (flat / ivf / hnsw) of a FAISS index"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        # A read-only store searches its mapped index plus an in-memory flat shard
+        return get_index_type(index.at(0))
+    if isinstance(index, faiss.IndexHNSW):
+        return HNSW
+    if isinstance(index, faiss.IndexIVF):
+        return IVF
+    return FLAT
+
+
+def get_index_encoding(index) -> str:
+    """Get how a FAISS index stores its vectors (float32 / float16 / sq8 / pq)"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        return get_index_encoding(index.at(0))
+    if isinstance(index, faiss.IndexHNSW):
+        return get_index_encoding(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return PQ
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return FLOAT16 if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else SQ8
+    return FLOAT32
+
+
+def is_lossy(index) -> bool:
+    """Check whether an index holds approximations of its vectors rather than the vectors"""
+    return get_index_encoding(index) != FLOAT32
+
+
+def select_index_type(count: int, requested: str = AUTO, ann_threshold: int = ANN_THRESHOLD,
+                      ann_type: str = IVF) -> str:
+    """Pick the index type for a corpus of count vectors
+
+    An explicit type is used as is, except that IVF needs enough vectors to
+    train on. "auto" picks flat below ann_threshold and ann_type above it.
+    """
+    if requested == AUTO:
+        requested = ann_type if count >= ann_threshold else FLAT
+    if requested not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{requested}', expected one of {', '.join(INDEX_TYPES + (AUTO,))}")
+    if requested == IVF and count < 39 * 2:
+        return FLAT
+    return requested
+
+
+def select_encoding(count: int, requested: str = FLOAT32) -> str:
+    """Pick the vector encoding for a corpus of count vectors
+
+    PQ needs enough vectors to train its codebooks and falls back to SQ8.
+    """
+    if requested not in ENCODINGS:
+        raise ValueError(f"Unknown vector encoding '{requested}', expected one of {', '.join(ENCODINGS)}")
+    if requested == PQ and count < PQ_MIN_VECTORS:
+        return SQ8
+    return requested
+
+
+def get_pq_subquantizers(dimension: int) -> int:
+    """Number of PQ sub-quantizers (code bytes) for a dimension; it has to divide the dimension"""
+    m = max(1, dimension // PQ_DIMS_PER_SUBQUANTIZER)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def get_nlist(count: int) -> int:
+    """Number of IVF lists for count vectors (~4 * sqrt(count), enough points to train each)"""
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def needs_rebuild(index, index_type: str, encoding: str = FLOAT32) -> bool:
+    """Check whether an index should be rebuilt as index_type with the given encoding
+
+    Also true for an IVF index that has outgrown its number of lists.
+    """
+    if get_index_type(index) != index_type or get_index_encoding(index) != encoding:
+        return True
+    if index_type == IVF:
+        return faiss.extract_index_ivf(index).nlist < get_nlist(index.ntotal) / 2
+    return False
+
+
+def get_factory_string(index_type: str, encoding: str, dimension: int, count: int) -> str:
+    """faiss.index_factory description of an index type and encoding"""
+    codes = {
+        FLOAT32: "Flat",
+        FLOAT16: "SQfp16",
+        SQ8: "SQ8",
+        PQ: f"PQ{get_pq_subquantizers(dimension)}"
+    }
+    if encoding not in codes:
+        raise ValueError(f"Unknown vector encoding '{encoding}'")
+
+    if index_type == FLAT:
+        return codes[encoding]
+    if index_type == HNSW:
+        return f"HNSW{HNSW_M}" if encoding == FLOAT32 else f"HNSW{HNSW_M},{codes[encoding]}"
+    if index_type == IVF:
+        return f"IVF{get_nlist(count)},{codes[encoding]}"
+    raise ValueError(f"Unknown index type '{index_type}'")
+
+
+def build_index(vectors: np.ndarray, index_type: str, metric: int = faiss.METRIC_L2, seed: int = 0,
+                encoding: str = FLOAT32):
+    """Build an index of the given type and encoding holding vectors in order
+
+    IVF coarse centroids and SQ8 / PQ codebooks are trained on a random
+    sample of the vectors. The position of each vector is the same as in the
+    input, so existing position -> chunk id mappings stay valid.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    index = faiss.index_factory(dimension, get_factory_string(index_type, encoding, dimension, count), metric)
+    if not index.is_trained:
+        sample_points = 256 * TRAIN_POINTS_PER_LIST
+        if index_type == IVF:
+            sample_points = max(sample_points, get_nlist(count) * TRAIN_POINTS_PER_LIST)
+        sample = np.random.default_rng(seed).choice(count, min(count, sample_points), replace=False)
+        index.train(vectors[np.sort(sample)])
+
+    if count:
+        index.add(vectors)
+    return index
+
+
+def configure_search(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Set the recall / speed knobs of an (optionally sharded) index"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        for i in range(index.count()):
+            configure_search(index.at(i), nprobe, ef_search)
+    elif isinstance(index, faiss.IndexHNSW):
+        if ef_search:
+            index.hnsw.efSearch = ef_search
+    elif isinstance(index, faiss.IndexIVF):
+        if nprobe:
+            index.nprobe = min(nprobe, index.nlist)
+
+
+def reconstruct_vectors(index, positions: Optional[np.ndarray] = None) -> np.ndarray:
+    """Read stored vectors back from an index, all of them or the given positions"""
+    if get_index_type(index) == IVF:
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.no():
+            ivf.make_direct_map()
+
+    if positions is None:
+        return index.reconstruct_n(0, index.ntotal)
+    if not len(positions):
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+
+def get_memory_usage(index) -> int:
+    """Estimate the bytes an index holds: vector codes plus centroids, codebooks and graph links"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        return sum(get_memory_usage(index.at(i)) for i in range(index.count()))
+    if isinstance(index, faiss.IndexHNSW):
+        # int32 neighbour lists, plus per-vector levels and offsets
+        return get_memory_usage(index.storage) + index.hnsw.neighbors.size() * 4 + index.ntotal * 12
+    if isinstance(index, faiss.IndexIVF):
+        # Codes and int64 ids in the inverted lists, plus the coarse centroids
+        usage = index.ntotal * (index.code_size + 8) + index.nlist * index.d * 4
+        if isinstance(index, faiss.IndexIVFPQ):
+            usage += index.pq.centroids.size() * 4
+        return usage
+    usage = index.ntotal * index.code_size
+    if isinstance(index, faiss.IndexPQ):
+        usage += index.pq.centroids.size() * 4
+    return usage
+
+
+def exact_distances(query: np.ndarray, vectors: np.ndarray, metric: int = faiss.METRIC_L2) -> np.ndarray:
+    """Distances from a query to full-precision vectors, on the same scale as a flat index"""
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return vectors @ query
+    return ((vectors - query) ** 2).sum(axis=1)
+
+
+def rerank(query, candidates: List[Tuple[str, float]], vectors: Dict[str, np.ndarray],
+           metric: int = faiss.METRIC_L2) -> List[Tuple[str, float]]:
+    """Re-score (id, approximate score) candidates exactly and sort them best first
+
+    Candidates without a full-precision vector keep their approximate score.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    ids = [candidate_id for candidate_id, _ in candidates if candidate_id in vectors]
+    scores = dict(candidates)
+    if ids:
+        distances = exact_distances(query, np.stack([vectors[candidate_id] for candidate_id in ids]), metric)
+        scores.update(zip(ids, distances.tolist()))
+
+    reverse = metric == faiss.METRIC_INNER_PRODUCT
+    return sorted(((candidate_id, scores[candidate_id]) for candidate_id, _ in candidates),
+                  key=lambda candidate: candidate[1], reverse=reverse)